@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
+import time
+
+from cache import GCodeCache
+from gcode_generator import GCodeGenerator
+
+
+def load_profiles(source):
+    # source is a directory of settings json files, a single file, or a list of files, settings dicts
+    # or (name, settings) pairs
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isdir(source):
+            source = [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.endswith('.json')]
+        else:
+            source = [source]
+
+    profiles = []
+    for i, profile in enumerate(source):
+        if isinstance(profile, dict):
+            profiles.append((f'profile_{i}', profile))
+        elif isinstance(profile, (str, os.PathLike)):
+            with open(profile, 'r') as json_file:
+                settings = json.load(json_file)
+            profiles.append((os.path.splitext(os.path.basename(profile))[0], settings))
+        else:
+            profiles.append(tuple(profile))
+    return profiles
+
+
+def unique_names(profiles):
+    # profiles with the same name, e.g. x.json from two directories, get _2, _3, ... so no job overwrites another's
+    # output
+    taken = {name for name, _ in profiles}
+    seen = set()
+    renamed = []
+    for name, settings in profiles:
+        unique = name
+        suffix = 2
+        while unique in seen or (unique != name and unique in taken):
+            unique = f'{name}_{suffix}'
+            suffix += 1
+        seen.add(unique)
+        renamed.append((unique, settings))
+    return renamed
+
+
+def run_job(job):
+    name, settings, output_path, cache_dir = job
+    result = {'name': name, 'output': output_path, 'error': None}
+    start = time.perf_counter()
+    try:
+        if cache_dir is not None:
+            gcode = GCodeCache(cache_dir).generate(settings, output_path)
+        else:
+            gcode = GCodeGenerator.generate_from_settings(settings, output_path)
+        result['lines'] = gcode.count('\n')
+        result['bytes'] = len(gcode.encode())
+    except Exception as error:
+        result['error'] = f'{type(error).__name__}: {error}'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def generate_batch(profiles, output_dir, workers=None, cache_dir=None):
+    # generates every profile in its own process, returns a summary with the per-job timings
+    profiles = unique_names(load_profiles(profiles))
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [(name, settings, os.path.join(output_dir, f'{name}.gcode'), cache_dir) for name, settings in profiles]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_job, jobs))
+    return {
+        'jobs': results,
+        'failed': sum(result['error'] is not None for result in results),
+        'seconds': time.perf_counter() - start
+    }
+
+
+def format_summary(summary):
+    lines = []
+    for result in summary['jobs']:
+        if result['error'] is None:
+            lines.append(f'{result["name"]:<32} {result["seconds"]:8.3f}s {result["lines"]:>8} lines  '
+                         f'{result["output"]}')
+        else:
+            lines.append(f'{result["name"]:<32} {result["seconds"]:8.3f}s   FAILED  {result["error"]}')
+    lines.append(f'{len(summary["jobs"])} jobs, {summary["failed"]} failed, {summary["seconds"]:.3f}s wall time')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate pressure advance towers for many settings profiles')
+    parser.add_argument('profiles', nargs='+', help='settings json files or directories of them')
+    parser.add_argument('-o', '--output-dir', default='output', help='directory for the generated gcode')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, defaults to cpu count')
+    parser.add_argument('--cache', default=None, help='reuse generated gcode from this cache directory')
+    parser.add_argument('--json', action='store_true', help='print the summary as json')
+    args = parser.parse_args()
+
+    all_profiles = []
+    for path in args.profiles:
+        all_profiles.extend(load_profiles(path))
+    batch_summary = generate_batch(all_profiles, args.output_dir, args.jobs, args.cache)
+    print(json.dumps(batch_summary, indent=4) if args.json else format_summary(batch_summary))
+    raise SystemExit(1 if batch_summary['failed'] else 0)
@@ -0,0 +1,237 @@
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from gcode_generator import GCodeGenerator
+from sinks import NullSink
+
+
+BASELINE_PATH = 'benchmark_baseline.json'
+GOLDEN_PATH = 'golden_outputs.json'
+SETTINGS_PATH = 'settings.json'
+LEGACY_SCRIPT = 'pressure_advance.py'
+CLI_SCRIPT = 'pressure_advance_gen.py'
+# command line runs timed from process start to exit, help loads nothing but argparse, check the settings model and
+# generate a one layer tower the generator and numpy
+STARTUP_COMMANDS = {
+    'help': ['--help'],
+    'check': ['check', '--quiet', '--settings-only'],
+    'generate': ['generate', '--set', 'object_settings.height=0']
+}
+
+WIDTHS = (50, 100, 150)
+HEIGHTS = (15, 50)
+LAYER_HEIGHTS = (0.3, 0.1, 0.05)
+PA_RANGES = ((0.0, 0.1), (0.0, 0.3), (0.02, 0.08))
+# growth below these is timer and allocator noise, not a regression
+ABSOLUTE_SLACK = {'seconds': 0.001, 'peak_bytes': 64 * 1024, 'bytes': 0}
+
+
+def load_settings(path=SETTINGS_PATH):
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def benchmark_cases(settings, quick=False):
+    # (case id, settings) over the width x height x layer height x pa range matrix
+    cases = []
+    matrix = itertools.product(WIDTHS, HEIGHTS, LAYER_HEIGHTS, PA_RANGES)
+    if quick:
+        matrix = itertools.product(WIDTHS[1:2], HEIGHTS[:1], LAYER_HEIGHTS[::2], PA_RANGES[1:2])
+    for width, height, layer_height, (pa_start, pa_finish) in matrix:
+        case = copy.deepcopy(settings)
+        case['object_settings']['width'][0] = width
+        case['object_settings']['height'][0] = height
+        case['extrusion_settings']['other_layer_height'][0] = layer_height
+        case['pressure_advance_settings']['start'][0] = pa_start
+        case['pressure_advance_settings']['finish'][0] = pa_finish
+        cases.append((f'w{width}_h{height}_l{layer_height}_pa{pa_start}-{pa_finish}', case))
+    return cases
+
+
+def measure(generate, repeat):
+    # best wall time of repeat runs and the peak traced memory of one more run
+    seconds = min(timed(generate) for _ in range(repeat))
+    tracemalloc.start()
+    try:
+        generate()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def benchmark_case(settings, repeat):
+    gcode = GCodeGenerator.generate_from_settings(settings)
+    seconds, peak_bytes = measure(lambda: GCodeGenerator.stream(settings, NullSink()), repeat)
+    lines = gcode.count('\n')
+    return {
+        'seconds': seconds,
+        'peak_bytes': peak_bytes,
+        'lines': lines,
+        'lines_per_second': lines / seconds if seconds else 0.0,
+        'bytes': len(gcode.encode()),
+        'sha256': hashlib.sha256(gcode.encode()).hexdigest()
+    }
+
+
+def benchmark_templates(settings, repeat, renders=1000):
+    def render():
+        for _ in range(renders):
+            GCodeGenerator.header(settings)
+            GCodeGenerator.footer(settings)
+    seconds, peak_bytes = measure(render, repeat)
+    return {'seconds': seconds, 'peak_bytes': peak_bytes, 'renders_per_second': renders / seconds}
+
+
+def benchmark_legacy(repeat):
+    # the standalone script has hard coded settings and prints to stdout, so it is timed as a subprocess
+    def run():
+        return subprocess.run([sys.executable, LEGACY_SCRIPT], capture_output=True, check=True).stdout
+    output = run()
+    seconds = min(timed(run) for _ in range(repeat))
+    lines = output.count(b'\n')
+    return {'seconds': seconds, 'lines': lines, 'lines_per_second': lines / seconds, 'bytes': len(output),
+            'sha256': hashlib.sha256(output).hexdigest()}
+
+
+def benchmark_startup(repeat):
+    results = {}
+    for name, arguments in STARTUP_COMMANDS.items():
+        def run():
+            subprocess.run([sys.executable, CLI_SCRIPT] + arguments, capture_output=True, check=True)
+        run()
+        results[name] = {'seconds': min(timed(run) for _ in range(repeat))}
+    return results
+
+
+def run_benchmarks(settings, repeat=5, quick=False, legacy=True, startup=True):
+    results = {'cases': {}, 'templates': benchmark_templates(settings, repeat)}
+    for case_id, case in benchmark_cases(settings, quick):
+        results['cases'][case_id] = benchmark_case(case, repeat)
+    if legacy:
+        results['legacy'] = benchmark_legacy(repeat)
+    if startup:
+        results['startup'] = benchmark_startup(repeat)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # regressions against the stored baseline, time and memory may grow by tolerance
+    regressions = []
+    rows = list(results['cases'].items()) + [('templates', results['templates'])]
+    if 'legacy' in results:
+        rows.append(('legacy', results['legacy']))
+    rows += [(f'startup {name}', result) for name, result in results.get('startup', {}).items()]
+    for case_id, result in rows:
+        if case_id.startswith('startup '):
+            reference = baseline.get('startup', {}).get(case_id[len('startup '):])
+        elif case_id in ('templates', 'legacy'):
+            reference = baseline.get(case_id)
+        else:
+            reference = baseline.get('cases', {}).get(case_id)
+        if reference is None:
+            continue
+        for metric in ('seconds', 'peak_bytes', 'bytes'):
+            if metric not in result or metric not in reference:
+                continue
+            if result[metric] > reference[metric] * (1 + tolerance) + ABSOLUTE_SLACK[metric]:
+                regressions.append(f'{case_id}: {metric} {reference[metric]:.6g} -> {result[metric]:.6g} '
+                                   f'(+{result[metric] / reference[metric] - 1:.0%})')
+    return regressions
+
+
+def check_golden(results, golden, settings):
+    # generated gcode must not change unless the golden digests are deliberately updated
+    failures = []
+    for case_id, result in results['cases'].items():
+        if case_id in golden.get('cases', {}) and golden['cases'][case_id] != result['sha256']:
+            failures.append(f'{case_id}: output differs from golden digest')
+    if 'legacy' in results and 'legacy' in golden and golden['legacy'] != results['legacy']['sha256']:
+        failures.append(f'{LEGACY_SCRIPT}: output differs from golden digest')
+    if os.path.exists('pa_test.gcode'):
+        with open('pa_test.gcode', 'r', newline='') as file:
+            if file.read() != GCodeGenerator.generate_from_settings(settings):
+                failures.append(f'pa_test.gcode differs from the output for {SETTINGS_PATH}')
+    return failures
+
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def save_json(path, data):
+    with open(path, 'w') as json_file:
+        json.dump(data, json_file, indent=4, sort_keys=True)
+        json_file.write('\n')
+
+
+def format_results(results):
+    lines = [f'{"case":<32} {"ms":>9} {"peak kB":>9} {"lines":>8} {"lines/s":>11} {"bytes":>9}']
+    for case_id, result in results['cases'].items():
+        lines.append(f'{case_id:<32} {result["seconds"] * 1000:9.2f} {result["peak_bytes"] / 1024:9.1f} '
+                     f'{result["lines"]:>8} {result["lines_per_second"]:11.0f} {result["bytes"]:>9}')
+    templates = results['templates']
+    lines.append(f'{"templates (1000 renders)":<32} {templates["seconds"] * 1000:9.2f} '
+                 f'{templates["peak_bytes"] / 1024:9.1f}')
+    if 'legacy' in results:
+        legacy = results['legacy']
+        lines.append(f'{LEGACY_SCRIPT + " (subprocess)":<32} {legacy["seconds"] * 1000:9.2f} {"":>9} '
+                     f'{legacy["lines"]:>8} {legacy["lines_per_second"]:11.0f} {legacy["bytes"]:>9}')
+    for name, result in results.get('startup', {}).items():
+        lines.append(f'{CLI_SCRIPT + " " + name:<32} {result["seconds"] * 1000:9.2f}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generation throughput benchmarks and golden output checks')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case, the best time is kept')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed growth before flagging a regression')
+    parser.add_argument('--quick', action='store_true', help='only a few cases of the matrix')
+    parser.add_argument('--no-legacy', action='store_true', help=f'skip {LEGACY_SCRIPT}')
+    parser.add_argument('--no-startup', action='store_true', help=f'skip the {CLI_SCRIPT} startup times')
+    parser.add_argument('--update-baseline', action='store_true', help=f'store the timings in {BASELINE_PATH}')
+    parser.add_argument('--update-golden', action='store_true', help=f'bless the current output in {GOLDEN_PATH}')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    base_settings = load_settings()
+    benchmark_results = run_benchmarks(base_settings, args.repeat, args.quick, not args.no_legacy,
+                                       not args.no_startup)
+    print(format_results(benchmark_results))
+    if args.json:
+        save_json(args.json, benchmark_results)
+
+    if args.update_baseline:
+        save_json(BASELINE_PATH, benchmark_results)
+    if args.update_golden:
+        # digests of cases that did not run are kept
+        golden_outputs = load_json(GOLDEN_PATH)
+        golden_outputs.setdefault('cases', {}).update({case_id: result['sha256']
+                                                       for case_id, result in benchmark_results['cases'].items()})
+        if 'legacy' in benchmark_results:
+            golden_outputs['legacy'] = benchmark_results['legacy']['sha256']
+        save_json(GOLDEN_PATH, golden_outputs)
+
+    problems = check_golden(benchmark_results, load_json(GOLDEN_PATH), base_settings)
+    problems += compare(benchmark_results, load_json(BASELINE_PATH), args.tolerance)
+    for problem in problems:
+        print(problem)
+    print(f'{len(problems)} problems' if problems else 'no regressions, output matches golden digests')
+    raise SystemExit(1 if problems else 0)
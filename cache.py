@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+
+import gcode_generator
+import preflight
+import settings as settings_module
+import templates
+import toolpath
+from gcode_generator import GCodeGenerator
+from settings import Settings
+
+
+# bump when the layout of the cache changes, a change to the generator itself is caught by GENERATOR_DIGEST
+CACHE_VERSION = 2
+# modules whose code decides the generated gcode or whether it is generated at all
+GENERATOR_MODULES = (gcode_generator, preflight, settings_module, templates, toolpath)
+
+
+def source_digest(modules):
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+# entries made by other generator code are never served
+GENERATOR_DIGEST = source_digest(GENERATOR_MODULES)
+TEMPLATE_KEYS = ('start_gcode_default', 'end_gcode_default')
+
+
+class GCodeCache:
+    # content addressed store of generated gcode, whole files and the model body (base and test area) are kept
+    # separately so a template only change regenerates just the header or footer
+    def __init__(self, directory='.pa_cache', max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def settings_values(settings):
+        # setting values without their descriptions, editing a tooltip must not invalidate anything
+        return {group: {name: value[0] for name, value in values.items()}
+                for group, values in settings.items() if group not in TEMPLATE_KEYS}
+
+    @staticmethod
+    def hash_key(*parts):
+        canonical = json.dumps([CACHE_VERSION, GENERATOR_DIGEST, *parts], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def keys(self, settings):
+        # keyed on the settings as the generator resolves them, so a missing setting and its default share entries.
+        # A float setting written as 100 or 100.0 stays apart, the gcode prints it as written
+        settings = Settings.from_dict(settings).to_dict()
+        values = GCodeCache.settings_values(settings)
+        body_key = GCodeCache.hash_key('body', values)
+        header_key = GCodeCache.hash_key('header', values, settings['start_gcode_default'])
+        footer_key = GCodeCache.hash_key('footer', values, settings['end_gcode_default'])
+        return GCodeCache.hash_key('file', header_key, body_key, footer_key), body_key
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, f'{key}.{kind}')
+
+    def read(self, key, kind):
+        try:
+            with open(self.path(key, kind), 'r', newline='') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # reading counts as a use for the lru eviction
+        try:
+            os.utime(self.path(key, kind))
+        except FileNotFoundError:
+            pass
+        return data
+
+    def store(self, key, kind, data):
+        temporary_path = f'{self.path(key, kind)}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', newline='') as file:
+            file.write(data)
+        os.replace(temporary_path, self.path(key, kind))
+        self.evict()
+
+    def evict(self):
+        # drop the least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def generate(self, settings, output_path=None, on_layer=None):
+        # same contract as GCodeGenerator.generate_from_settings, on_layer only runs when the body is generated
+        file_key, body_key = self.keys(settings)
+        gcode = self.read(file_key, 'gcode')
+        if gcode is not None:
+            self.hits += 1
+        else:
+            body = self.read(body_key, 'body')
+            if body is not None:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+                body = ''.join(GCodeGenerator.iter_body_chunks(settings, on_layer))
+                self.store(body_key, 'body', body)
+            gcode = GCodeGenerator.header(settings) + body + GCodeGenerator.footer(settings)
+            self.store(file_key, 'gcode', gcode)
+
+        if output_path is not None:
+            with open(output_path, 'w') as file:
+                file.write(gcode)
+        return gcode
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
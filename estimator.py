@@ -0,0 +1,218 @@
+import argparse
+import copy
+import json
+import re
+
+import numpy as np
+
+from toolpath import LAYER_CHANGE_FEEDRATE, build_toolpath, test_area_layer_count
+
+
+DEFAULT_ACCELERATION = 1000.0
+DEFAULT_JERK = 10.0
+WORD = re.compile(r'([XYZEF])(-?\d*\.?\d+)')
+
+
+class Moves:
+    # linear moves as flat arrays, positions are the end point of every move and start from start
+    def __init__(self, x, y, z, e, feedrate, layer, start=(0.0, 0.0, 0.0)):
+        self.x = x
+        self.y = y
+        self.z = z
+        # filament pushed by every move, not the absolute E axis
+        self.e = e
+        # mm/min
+        self.feedrate = feedrate
+        self.layer = layer
+        self.start = start
+
+
+def moves_from_toolpath(toolpath):
+    # the toolpath moves with the layer change z move in front of every layer, straight from the arrays
+    layer_of_move = np.repeat(np.arange(toolpath.layer_count), np.diff(toolpath.layer_offsets))
+    first_moves = toolpath.layer_offsets[:-1]
+
+    # the z move starts and ends where the previous layer ended
+    previous = np.concatenate(([0], first_moves[1:] - 1))
+    z_x = np.where(np.arange(toolpath.layer_count) > 0, toolpath.x[previous], toolpath.x[0])
+    z_y = np.where(np.arange(toolpath.layer_count) > 0, toolpath.y[previous], toolpath.y[0])
+
+    e_delta = np.diff(toolpath.e, prepend=0.0)
+    e_delta[first_moves] = toolpath.e[first_moves]
+    return Moves(
+        np.insert(toolpath.x, first_moves, z_x),
+        np.insert(toolpath.y, first_moves, z_y),
+        np.insert(toolpath.layer_z[layer_of_move], first_moves, toolpath.layer_z),
+        np.insert(e_delta, first_moves, 0.0),
+        np.insert(toolpath.feedrate, first_moves, float(LAYER_CHANGE_FEEDRATE)),
+        np.insert(layer_of_move, first_moves, np.arange(toolpath.layer_count)),
+        (float(z_x[0]), float(z_y[0]), 0.0)
+    )
+
+
+def parse_gcode(text):
+    # G0/G1 moves of a gcode file, follows G90/G91, M82/M83 and G92, a move up in z starts a new layer
+    x = y = z = e = 0.0
+    feedrate = 0.0
+    absolute = absolute_e = True
+    layer = 0
+    layer_top = None
+    rows = []
+    for line in text.split('\n'):
+        words = line.split(';', 1)[0].split()
+        if not words:
+            continue
+        for i, command in enumerate(words):
+            if command in ('G90', 'G91'):
+                absolute = command == 'G90'
+                absolute_e = absolute
+            elif command in ('M82', 'M83'):
+                absolute_e = command == 'M82'
+            elif command == 'G92':
+                for axis, value in WORD.findall(' '.join(words[i + 1:])):
+                    if axis == 'E':
+                        e = float(value)
+                break
+            elif command in ('G0', 'G1'):
+                target = {'X': x, 'Y': y, 'Z': z}
+                extruded = 0.0
+                for axis, value in WORD.findall(' '.join(words[i + 1:])):
+                    value = float(value)
+                    if axis == 'F':
+                        feedrate = value
+                    elif axis == 'E':
+                        extruded = value - e if absolute_e else value
+                        e = value if absolute_e else e + value
+                    else:
+                        target[axis] = value if absolute else target[axis] + value
+                x, y, z = target['X'], target['Y'], target['Z']
+                if layer_top is not None and z > layer_top:
+                    layer += 1
+                layer_top = z if layer_top is None else max(layer_top, z)
+                rows.append((x, y, z, extruded, feedrate, layer))
+                break
+    data = np.array(rows, dtype=float).reshape(-1, 6)
+    return Moves(data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4], data[:, 5].astype(int))
+
+
+def junction_limits(dx, dy, dz, length, speed, jerk):
+    # squared speed allowed at the start of every move and at the end of the last one, the velocity vector may
+    # change by at most jerk at a corner, so a corner between unit directions u1 and u2 allows jerk / |u1 - u2|
+    with np.errstate(invalid='ignore', divide='ignore'):
+        direction = np.stack((dx, dy, dz), 1) / length[:, None]
+    direction[length == 0] = 0.0
+    change = np.linalg.norm(direction[1:] - direction[:-1], axis=1)
+    with np.errstate(divide='ignore'):
+        corner = np.where(change > 0, jerk / change, np.inf)
+    limit = np.concatenate(([min(jerk, speed[0])], np.minimum(np.minimum(speed[:-1], speed[1:]), corner),
+                            [min(jerk, speed[-1])]))
+    return limit ** 2
+
+
+def plan_speeds(limit, length, acceleration):
+    # forward and backward passes of a look ahead planner, w[j] = min(limit[j], w[j - 1] + 2 a length[j - 1]),
+    # solved without a python loop as a running minimum over the cumulative acceleration budget
+    budget = np.concatenate(([0.0], np.cumsum(2 * acceleration * length)))
+    forward = np.minimum.accumulate(limit - budget) + budget
+    backward = budget[-1] - budget
+    return np.minimum.accumulate((forward - backward)[::-1])[::-1] + backward
+
+
+def move_times(length, entry, exit_, speed, acceleration):
+    # trapezoid per move, or a triangle when the cruise speed is never reached
+    accelerate = (speed ** 2 - entry ** 2) / (2 * acceleration)
+    decelerate = (speed ** 2 - exit_ ** 2) / (2 * acceleration)
+    cruises = accelerate + decelerate <= length
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trapezoid = (speed - entry) / acceleration + (speed - exit_) / acceleration + \
+            (length - accelerate - decelerate) / speed
+        peak = np.sqrt((2 * acceleration * length + entry ** 2 + exit_ ** 2) / 2)
+        triangle = (peak - entry) / acceleration + (peak - exit_) / acceleration
+    return np.where(length > 0, np.where(cruises, trapezoid, triangle), 0.0)
+
+
+def estimate_moves(moves, acceleration=DEFAULT_ACCELERATION, jerk=DEFAULT_JERK):
+    if len(moves.x) == 0:
+        return {'seconds': 0.0, 'filament_mm': 0.0, 'layer_seconds': np.zeros(0), 'move_seconds': np.zeros(0)}
+    dx = np.diff(moves.x, prepend=moves.start[0])
+    dy = np.diff(moves.y, prepend=moves.start[1])
+    dz = np.diff(moves.z, prepend=moves.start[2])
+    length = np.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
+    speed = np.maximum(moves.feedrate / 60, 1e-3)
+
+    squared = plan_speeds(junction_limits(dx, dy, dz, length, speed, jerk), length, acceleration)
+    junction = np.sqrt(np.maximum(squared, 0.0))
+    seconds = move_times(length, junction[:-1], junction[1:], speed, acceleration)
+    layer_seconds = np.bincount(moves.layer, weights=seconds)
+    return {
+        'seconds': float(seconds.sum()),
+        'filament_mm': float(moves.e[moves.e > 0].sum()),
+        'layer_seconds': layer_seconds,
+        'move_seconds': seconds
+    }
+
+
+def estimate(settings, acceleration=DEFAULT_ACCELERATION, jerk=DEFAULT_JERK):
+    # print time of the tower described by settings without generating any gcode text
+    return estimate_moves(moves_from_toolpath(build_toolpath(settings)), acceleration, jerk)
+
+
+def estimate_gcode(text, acceleration=DEFAULT_ACCELERATION, jerk=DEFAULT_JERK):
+    return estimate_moves(parse_gcode(text), acceleration, jerk)
+
+
+def estimate_profiles(profiles, acceleration=DEFAULT_ACCELERATION, jerk=DEFAULT_JERK):
+    # print time and filament of every (name, settings) profile
+    results = []
+    for name, settings in profiles:
+        result = estimate(settings, acceleration, jerk)
+        results.append({'name': name, 'seconds': result['seconds'], 'filament_mm': result['filament_mm']})
+    return results
+
+
+def max_height_for_budget(settings, budget_seconds, acceleration=DEFAULT_ACCELERATION, jerk=DEFAULT_JERK):
+    # tallest object_settings.height that prints within budget_seconds, every test layer takes the same time so
+    # two estimates give the fixed and per layer cost
+    layer_height = settings['extrusion_settings']['other_layer_height'][0]
+    probe = copy.deepcopy(settings)
+    probe['object_settings']['height'][0] = 2 * layer_height
+    short = estimate(probe, acceleration, jerk)['seconds']
+    probe['object_settings']['height'][0] = 3 * layer_height
+    per_layer = estimate(probe, acceleration, jerk)['seconds'] - short
+    layers = int((budget_seconds - short) / per_layer) + 2 if per_layer > 0 else 0
+    layers = max(layers, 0)
+    while layers >= 2:
+        probe['object_settings']['height'][0] = layers * layer_height
+        if test_area_layer_count(probe) == layers and estimate(probe, acceleration, jerk)['seconds'] <= budget_seconds:
+            return layers * layer_height
+        layers -= 1
+    return 0.0
+
+
+def format_seconds(seconds):
+    return f'{int(seconds // 3600)}:{int(seconds % 3600 // 60):02d}:{seconds % 60:04.1f}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate print time and filament of a pressure advance tower')
+    parser.add_argument('input', nargs='?', default='settings.json', help='settings json or a gcode file')
+    parser.add_argument('--acceleration', type=float, default=DEFAULT_ACCELERATION, help='mm/s^2')
+    parser.add_argument('--jerk', type=float, default=DEFAULT_JERK, help='mm/s')
+    parser.add_argument('--budget', type=float, help='also print the tallest tower that fits in this many minutes')
+    parser.add_argument('--layers', action='store_true', help='print the time of every layer')
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as input_file:
+        content = input_file.read()
+    tower_settings = json.loads(content) if args.input.endswith('.json') else None
+    if tower_settings is not None:
+        estimation = estimate(tower_settings, args.acceleration, args.jerk)
+    else:
+        estimation = estimate_gcode(content, args.acceleration, args.jerk)
+    print(f'print time {format_seconds(estimation["seconds"])}, filament {estimation["filament_mm"] / 1000:.2f} m')
+    if args.layers:
+        for layer_nr, layer_time in enumerate(estimation['layer_seconds'], 1):
+            print(f'layer {layer_nr:>5} {layer_time:8.2f} s')
+    if args.budget is not None and tower_settings is not None:
+        height = max_height_for_budget(tower_settings, args.budget * 60, args.acceleration, args.jerk)
+        print(f'tallest tower within {args.budget} min: object_settings.height = {height:.2f} mm')
@@ -0,0 +1,259 @@
+import argparse
+import codecs
+import io
+import json
+import lzma
+import struct
+import time
+import zlib
+
+from gcode_generator import GCodeGenerator
+
+
+# binary container: file header, then blocks of at most block_size bytes of gcode text, each compressed on its own
+# so a reader can decode block by block, every block carries the crc32 of its text
+FILE_MAGIC = b'PAGC'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sHH')
+BLOCK_HEADER = struct.Struct('<BII')
+BLOCK_FOOTER = struct.Struct('<I')
+COMPRESSION_NONE, COMPRESSION_DEFLATE, COMPRESSION_LZMA = range(3)
+COMPRESSION_NAMES = {'none': COMPRESSION_NONE, 'deflate': COMPRESSION_DEFLATE, 'lzma': COMPRESSION_LZMA}
+
+# meatpack: the 15 most common gcode characters are sent as 4 bit codes, two per byte, anything else as a full
+# byte flagged by a 0b1111 nibble; in no spaces mode spaces are dropped and their code is reused for 'E'
+MEATPACK_CHARACTERS = '0123456789. \nGX'
+MEATPACK_FULL = 0b1111
+MEATPACK_SIGNAL = 0xFF
+MEATPACK_ENABLE_PACKING = 0xFB
+MEATPACK_DISABLE_PACKING = 0xFA
+MEATPACK_RESET_ALL = 0xF9
+MEATPACK_ENABLE_NO_SPACES = 0xF7
+MEATPACK_DISABLE_NO_SPACES = 0xF6
+# string arguments keep their spaces
+MEATPACK_KEEP_SPACES = ('M23', 'M28', 'M30', 'M32', 'M117', 'M118')
+
+
+def iter_text_blocks(chunks, block_size):
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk.encode())
+        pending_size += len(pending[-1])
+        if pending_size >= block_size:
+            data = b''.join(pending)
+            for start in range(0, len(data) - len(data) % block_size, block_size):
+                yield data[start:start + block_size]
+            pending = [data[len(data) - len(data) % block_size:]]
+            pending_size = len(pending[0])
+    if pending_size:
+        yield b''.join(pending)
+
+
+def compress(data, compression):
+    if compression == COMPRESSION_DEFLATE:
+        return zlib.compress(data, 9)
+    if compression == COMPRESSION_LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2, 'preset': 6}])
+    return data
+
+
+def decompress(data, compression):
+    if compression == COMPRESSION_DEFLATE:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_LZMA:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2}])
+    return data
+
+
+def iter_encode_binary(chunks, compression=COMPRESSION_DEFLATE, block_size=64 * 1024):
+    yield FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, 0)
+    for data in iter_text_blocks(chunks, block_size):
+        payload = compress(data, compression)
+        # a block that does not shrink is stored as is
+        block_compression = compression if len(payload) < len(data) else COMPRESSION_NONE
+        payload = payload if block_compression != COMPRESSION_NONE else data
+        yield BLOCK_HEADER.pack(block_compression, len(data), len(payload)) + payload + \
+            BLOCK_FOOTER.pack(zlib.crc32(data))
+
+
+def iter_decode_binary(file):
+    # text of every block of a binary container read from a binary file object, a character split between two
+    # blocks comes out with the second
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    magic, version, _ = FILE_HEADER.unpack(read_exactly(file, FILE_HEADER.size))
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+        raise ValueError('not a binary pressure advance gcode file')
+    while True:
+        header = file.read(BLOCK_HEADER.size)
+        if not header:
+            decoder.decode(b'', final=True)
+            return
+        compression, size, payload_size = BLOCK_HEADER.unpack(header + read_exactly(file, BLOCK_HEADER.size -
+                                                                                    len(header)))
+        data = decompress(read_exactly(file, payload_size), compression)
+        crc, = BLOCK_FOOTER.unpack(read_exactly(file, BLOCK_FOOTER.size))
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise ValueError('corrupted block in binary gcode file')
+        yield decoder.decode(data)
+
+
+def read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError('truncated binary gcode file')
+    return data
+
+
+def meatpack_lines(chunks, no_spaces=True):
+    # lines as the firmware sees them: comments and surrounding whitespace dropped, spaces removed in no spaces mode
+    for chunk in chunks:
+        for line in chunk.split('\n'):
+            line = line.split(';', 1)[0].strip()
+            if not line:
+                continue
+            if no_spaces and not line.startswith(MEATPACK_KEEP_SPACES):
+                line = line.replace(' ', '')
+            yield line
+
+
+def meatpack_tables(no_spaces):
+    characters = MEATPACK_CHARACTERS.replace(' ', 'E') if no_spaces else MEATPACK_CHARACTERS
+    return {character: code for code, character in enumerate(characters)}, characters
+
+
+def iter_encode_meatpack(chunks, no_spaces=True):
+    codes, _ = meatpack_tables(no_spaces)
+    header = bytes((MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_ENABLE_PACKING))
+    if no_spaces:
+        header += bytes((MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_ENABLE_NO_SPACES))
+    yield header
+
+    for line in meatpack_lines(chunks, no_spaces):
+        line += '\n'
+        if len(line) % 2:
+            # pairs never straddle lines, an empty line pads odd ones and is ignored by the firmware
+            line += '\n'
+        packed = bytearray()
+        for first, second in zip(line[::2], line[1::2]):
+            low = codes.get(first, MEATPACK_FULL)
+            high = codes.get(second, MEATPACK_FULL)
+            packed.append(low | high << 4)
+            if low == MEATPACK_FULL:
+                packed.append(ord(first))
+            if high == MEATPACK_FULL:
+                packed.append(ord(second))
+        yield bytes(packed)
+
+
+def decode_meatpack(data):
+    characters = MEATPACK_CHARACTERS
+    packing = False
+    output = []
+    position = 0
+    while position < len(data):
+        byte = data[position]
+        if byte == MEATPACK_SIGNAL and position + 1 < len(data) and data[position + 1] == MEATPACK_SIGNAL:
+            command = data[position + 2]
+            if command == MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif command == MEATPACK_DISABLE_PACKING:
+                packing = False
+            elif command == MEATPACK_ENABLE_NO_SPACES:
+                characters = MEATPACK_CHARACTERS.replace(' ', 'E')
+            elif command == MEATPACK_DISABLE_NO_SPACES:
+                characters = MEATPACK_CHARACTERS
+            elif command == MEATPACK_RESET_ALL:
+                packing = False
+                characters = MEATPACK_CHARACTERS
+            position += 3
+            continue
+        position += 1
+        if not packing:
+            output.append(chr(byte))
+            continue
+        for code in (byte & 0xF, byte >> 4):
+            if code == MEATPACK_FULL:
+                output.append(chr(data[position]))
+                position += 1
+            else:
+                output.append(characters[code])
+    return ''.join(output)
+
+
+def encode(chunks, mode):
+    # whole encoded output of a chunk stream, mode is text, binary, binary-lzma or meatpack
+    if mode == 'text':
+        return ''.join(chunks).encode()
+    if mode == 'binary':
+        return b''.join(iter_encode_binary(chunks, COMPRESSION_DEFLATE))
+    if mode == 'binary-lzma':
+        return b''.join(iter_encode_binary(chunks, COMPRESSION_LZMA))
+    if mode == 'meatpack':
+        return b''.join(iter_encode_meatpack(chunks))
+    raise ValueError(f'unknown output mode {mode}')
+
+
+def decode(data, mode):
+    if mode == 'text':
+        return data.decode()
+    if mode in ('binary', 'binary-lzma'):
+        return ''.join(iter_decode_binary(io.BytesIO(data)))
+    if mode == 'meatpack':
+        return decode_meatpack(data)
+    raise ValueError(f'unknown output mode {mode}')
+
+
+def report(settings, modes=('text', 'binary', 'binary-lzma', 'meatpack')):
+    # size, encode and decode time of every mode and whether decoding gives back the generator output; meatpack is
+    # lossless with respect to the commands the firmware executes, so it is compared without comments and spaces
+    text = GCodeGenerator.generate_from_settings(settings)
+    text_size = len(text.encode())
+    results = []
+    for mode in modes:
+        start = time.perf_counter()
+        data = encode(GCodeGenerator.iter_chunks(settings), mode)
+        encode_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = decode(data, mode)
+        decode_seconds = time.perf_counter() - start
+        if mode == 'meatpack':
+            lossless = list(meatpack_lines([decoded])) == list(meatpack_lines([text]))
+        else:
+            lossless = decoded == text
+        results.append({'mode': mode, 'bytes': len(data), 'ratio': len(data) / text_size,
+                        'encode_seconds': encode_seconds, 'decode_seconds': decode_seconds, 'lossless': lossless})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact output modes for pressure advance gcode')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    encode_parser = subparsers.add_parser('encode', help='generate and write a tower in a compact mode')
+    encode_parser.add_argument('output')
+    encode_parser.add_argument('--mode', default='binary', choices=('text', 'binary', 'binary-lzma', 'meatpack'))
+    encode_parser.add_argument('--settings', default='settings.json')
+    decode_parser = subparsers.add_parser('decode', help='decode a compact file back to text')
+    decode_parser.add_argument('input')
+    decode_parser.add_argument('output')
+    decode_parser.add_argument('--mode', default='binary', choices=('text', 'binary', 'binary-lzma', 'meatpack'))
+    report_parser = subparsers.add_parser('report', help='size and encode time of every mode')
+    report_parser.add_argument('--settings', default='settings.json')
+    args = parser.parse_args()
+
+    if args.command == 'decode':
+        with open(args.input, 'rb') as input_file:
+            encoded = input_file.read()
+        with open(args.output, 'w') as output_file:
+            output_file.write(decode(encoded, args.mode))
+    else:
+        with open(args.settings, 'r') as json_file:
+            tower_settings = json.load(json_file)
+        if args.command == 'encode':
+            with open(args.output, 'wb') as output_file:
+                output_file.write(encode(GCodeGenerator.iter_chunks(tower_settings), args.mode))
+        else:
+            for row in report(tower_settings):
+                print(f'{row["mode"]:<12} {row["bytes"]:>9} bytes {row["ratio"]:7.1%} '
+                      f'encode {row["encode_seconds"] * 1000:8.2f} ms  decode {row["decode_seconds"] * 1000:8.2f} ms'
+                      f'  {"lossless" if row["lossless"] else "MISMATCH"}')
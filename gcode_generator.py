@@ -0,0 +1,151 @@
+import json
+import os
+
+from preflight import check_toolpath
+from sinks import BufferSink, FileSink
+from templates import compile_template
+from toolpath import build_toolpath, iter_layers, pa_map
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GCodeGenerator:
+    @staticmethod
+    def generate(window, output_path='pa_test.gcode', cache=None):
+        window.update_settings()
+        GCodeGenerator.generate_to_file(window.settings, output_path, cache)
+
+    @staticmethod
+    def generate_to_file(settings, output_path, cache=None, on_layer=None, stages=None, pa_map_path=None):
+        # writes next to output_path and renames once complete, a failed or cancelled run leaves the old file as is.
+        # stages (an instrumentation.Instrumentation) only measures a run that does not come from the cache,
+        # pa_map_path also records the layer z and M572 values for pa_detect.py
+        temporary_path = f'{output_path}.{os.getpid()}.tmp'
+        try:
+            if cache is not None:
+                gcode = cache.generate(settings, on_layer=on_layer)
+                with FileSink(temporary_path) as sink:
+                    sink.write(gcode)
+            else:
+                GCodeGenerator.stream(settings, FileSink(temporary_path), on_layer, stages)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        os.replace(temporary_path, output_path)
+        if pa_map_path is not None:
+            GCodeGenerator.write_pa_map(settings, pa_map_path)
+
+    @staticmethod
+    def write_pa_map(settings, path):
+        with open(path, 'w') as json_file:
+            json.dump(pa_map(build_toolpath(settings), settings['object_settings']['width'][0]), json_file)
+
+    @staticmethod
+    def generate_from_settings(settings, output_path=None):
+        # settings has the same shape as settings.json, returns the gcode and writes it when output_path is given
+        sink = BufferSink()
+        sink.write_all(GCodeGenerator.iter_chunks(settings))
+        gcode = sink.getvalue()
+        if output_path is not None:
+            with FileSink(output_path) as file_sink:
+                file_sink.write(gcode)
+        return gcode
+
+    @staticmethod
+    def stream(settings, sink, on_layer=None, stages=None):
+        # writes the gcode chunk by chunk without holding the whole file, returns the bytes written
+        if stages is None:
+            with sink:
+                sink.write_all(GCodeGenerator.iter_chunks(settings, on_layer))
+            return sink.bytes_written
+        with stages:
+            with sink:
+                sink.write_all(GCodeGenerator.iter_chunks(settings, on_layer, stages))
+            stages.finish(sink.bytes_written)
+        return sink.bytes_written
+
+    @staticmethod
+    def iter_chunks(settings, on_layer=None, stages=None):
+        # yields the header, every base layer, every test layer and the footer as separate chunks,
+        # on_layer(done, total) is called after every layer. The toolpath is built and checked first so settings that
+        # fail the preflight check raise before anything is written
+        toolpath = GCodeGenerator.checked_toolpath(settings, stages)
+        if stages is None:
+            yield GCodeGenerator.header(settings)
+        else:
+            yield stages.call('header', GCodeGenerator.header, settings)
+        yield from GCodeGenerator.iter_body_chunks(settings, on_layer, stages, toolpath)
+        if stages is None:
+            yield GCodeGenerator.footer(settings)
+        else:
+            yield stages.call('footer', GCodeGenerator.footer, settings)
+
+    @staticmethod
+    def header(settings):
+        # write start gcode
+        return '; --------------------\n' \
+               ';     gcode header    \n' \
+               '; --------------------\n' + \
+               GCodeGenerator.process_template(settings['start_gcode_default'], settings) + '\n'
+
+    @staticmethod
+    def checked_toolpath(settings, stages=None):
+        # raises PreflightError when the tower leaves the bed, needs more flow than the hotend has or extrudes nonsense
+        if stages is None:
+            toolpath = build_toolpath(settings)
+            check_toolpath(toolpath, settings)
+        else:
+            toolpath = stages.call('toolpath', build_toolpath, settings, moves=lambda built: len(built.x))
+            stages.call('preflight', check_toolpath, toolpath, settings)
+        return toolpath
+
+    @staticmethod
+    def iter_body_chunks(settings, on_layer=None, stages=None, toolpath=None):
+        if toolpath is None:
+            toolpath = GCodeGenerator.checked_toolpath(settings, stages)
+        tool_index = settings['printer_settings']['tool_index'][0]
+        base_layers = iter_layers(toolpath, tool_index, 0, toolpath.base_layer_count)
+        test_layers = iter_layers(toolpath, tool_index, toolpath.base_layer_count)
+        if stages is not None:
+            base_moves = toolpath.layer_offsets[toolpath.base_layer_count]
+            base_layers = stages.wrap('base_layers', base_layers, base_moves)
+            test_layers = stages.wrap('test_layers', test_layers, len(toolpath.x) - base_moves)
+
+        # generate model base
+        yield '; --------------------\n' \
+              ';    gcode generated  \n' \
+              ';      model base     \n' \
+              '; --------------------\n'
+        yield from GCodeGenerator.report_layers(base_layers, 0, toolpath.layer_count, on_layer)
+        yield '\n'
+
+        # generate model test area
+        yield '; --------------------\n' \
+              ';    gcode generated  \n' \
+              ';       model top     \n' \
+              '; --------------------\n'
+        yield from GCodeGenerator.report_layers(test_layers, toolpath.base_layer_count, toolpath.layer_count, on_layer)
+        yield '\n'
+
+    @staticmethod
+    def report_layers(layers, done, total, on_layer):
+        for chunk in layers:
+            yield chunk
+            done += 1
+            if on_layer is not None:
+                on_layer(done, total)
+
+    @staticmethod
+    def footer(settings):
+        # write end gcode
+        return '; --------------------\n' \
+               ';     gcode footer    \n' \
+               '; --------------------\n' + \
+               GCodeGenerator.process_template(settings['end_gcode_default'], settings)
+
+    @staticmethod
+    def process_template(template, settings):
+        return compile_template(template).render(settings)
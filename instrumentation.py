@@ -0,0 +1,137 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+
+class Instrumentation:
+    # opt in measurements of one generation, pass it as stages= to GCodeGenerator.stream or generate_to_file.
+    # every finished stage is a dict {'stage', 'seconds', 'moves', 'bytes', 'peak_bytes'} that is handed to each hook
+    # and kept for the report. The stages are toolpath (the move arrays), preflight (bed, flow and extrusion checks),
+    # header and footer (start and end gcode templates), base_layers and test_layers (moves to gcode text) and write,
+    # the rest of the run which is mostly the sink. peak_bytes is the highest traced memory while the stage ran, only
+    # with memory=True as tracing slows generation down several times. cprofile=True also captures a cProfile of the
+    # run
+    def __init__(self, hooks=(), memory=False, cprofile=False):
+        self.hooks = list(hooks)
+        self.memory = memory
+        self.cprofile = cprofile
+        self.stages = []
+        self.profile = None
+        self.started = None
+        self.seconds = 0.0
+        self.bytes = 0
+        self.owns_tracing = False
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def __enter__(self):
+        # every run starts a new report
+        self.stages = []
+        self.bytes = 0
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracing = True
+        if self.cprofile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+        return False
+
+    def step(self, function, *args):
+        # result, seconds and peak traced memory of one call
+        if self.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        return result, seconds, tracemalloc.get_traced_memory()[1] if self.memory else None
+
+    def call(self, name, function, *args, moves=None):
+        # one call as a stage, moves(result) counts the moves it produced
+        result, seconds, peak_bytes = self.step(function, *args)
+        size = len(result.encode()) if isinstance(result, str) else 0
+        self.record(name, seconds, moves(result) if moves is not None else 0, size, peak_bytes)
+        return result
+
+    def wrap(self, name, chunks, moves=0):
+        # chunks of one stage, only the time spent producing them counts, not the time of the consumer
+        chunks = iter(chunks)
+        seconds = 0.0
+        size = 0
+        peak_bytes = None
+        while True:
+            try:
+                chunk, chunk_seconds, chunk_peak = self.step(next, chunks)
+            except StopIteration:
+                break
+            seconds += chunk_seconds
+            size += len(chunk.encode())
+            if chunk_peak is not None:
+                peak_bytes = max(peak_bytes or 0, chunk_peak)
+            yield chunk
+        self.record(name, seconds, moves, size, peak_bytes)
+
+    def finish(self, bytes_written):
+        # everything outside the measured stages is booked as write, its memory is not measured
+        seconds = time.perf_counter() - self.started - sum(stage['seconds'] for stage in self.stages)
+        self.bytes = bytes_written
+        self.record('write', max(seconds, 0.0), 0, bytes_written)
+
+    def record(self, name, seconds, moves=0, size=0, peak_bytes=None):
+        stage = {'stage': name, 'seconds': seconds, 'moves': int(moves), 'bytes': size, 'peak_bytes': peak_bytes}
+        self.stages.append(stage)
+        for hook in self.hooks:
+            hook(stage)
+
+    def report(self, top=20):
+        peaks = [stage['peak_bytes'] for stage in self.stages if stage['peak_bytes'] is not None]
+        report = {
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            # moves written as gcode, the toolpath stage builds the same moves without writing them
+            'moves': sum(stage['moves'] for stage in self.stages if stage['bytes']),
+            'peak_bytes': max(peaks) if peaks else None,
+            'stages': [dict(stage) for stage in self.stages]
+        }
+        if self.profile is not None:
+            report['profile'] = profile_functions(self.profile, top)
+        return report
+
+    def to_json(self, top=20):
+        return json.dumps(self.report(top), indent=4)
+
+    def dump_profile(self, path):
+        # the cProfile capture for pstats or snakeviz
+        self.profile.dump_stats(path)
+
+
+def profile_functions(profile, top=20):
+    # the functions with the most cumulative time
+    rows = []
+    for (filename, line, function), (_, calls, seconds, cumulative, _) in pstats.Stats(profile).stats.items():
+        rows.append({'function': f'{os.path.basename(filename)}:{line}({function})', 'calls': calls,
+                     'seconds': seconds, 'cumulative_seconds': cumulative})
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:top]
+
+
+def format_report(report):
+    lines = [f'{"stage":<12} {"ms":>9} {"moves":>8} {"bytes":>10} {"peak kB":>9}']
+    for stage in report['stages'] + [dict(report, stage='total')]:
+        peak = f'{stage["peak_bytes"] / 1024:9.1f}' if stage['peak_bytes'] is not None else f'{"":>9}'
+        lines.append(f'{stage["stage"]:<12} {stage["seconds"] * 1000:9.2f} {stage["moves"]:>8} {stage["bytes"]:>10} '
+                     f'{peak}')
+    return '\n'.join(lines)
@@ -0,0 +1,313 @@
+import argparse
+import json
+import math
+import re
+
+from gcode_generator import GCodeGenerator
+
+
+# a plain xy move, anything else (z moves, other axes, M572, G92, comments) ends the run of moves being optimized
+XY_MOVE = re.compile(r'^G[01]( X-?[\d.]+)( Y-?[\d.]+)( E-?[\d.]+)?( F[\d.]+)?$')
+WORD = re.compile(r'([A-Z])(-?[\d.]+)')
+# runs are flushed at this many moves so fitting stays cheap
+MAX_RUN = 256
+
+
+class Move:
+    def __init__(self, x, y, e, feedrate, words):
+        self.x = x
+        self.y = y
+        # absolute E after the move, None for a travel
+        self.e = e
+        self.feedrate = feedrate
+        # original ' X..', ' Y..', ' E..' and ' F..' text, numbers are written back exactly as they were
+        self.words = words
+
+
+class Optimizer:
+    # merges collinear moves and fits G2/G3 arcs over runs of xy moves with one feedrate, absolute E values of the
+    # kept end points are copied from the input so the extruded total never changes
+    def __init__(self, merge=True, arcs=True, tolerance=0.01, min_arc_moves=4, max_turn=math.radians(20),
+                 rate_tolerance=0.02):
+        self.merge = merge
+        self.arcs = arcs
+        self.tolerance = tolerance
+        self.min_arc_moves = min_arc_moves
+        self.max_turn = max_turn
+        self.rate_tolerance = rate_tolerance
+        self.x = self.y = 0.0
+        self.e = 0.0
+        self.feedrate = None
+        self.relative = False
+        self.run = []
+        self.run_start = (0.0, 0.0, 0.0)
+        self.partial = ''
+        self.stats = {'lines_in': 0, 'lines_out': 0, 'merged': 0, 'arcs': 0}
+
+    def iter_chunks(self, chunks):
+        # one output chunk per input chunk, moves at the end of a chunk are held until the run ends
+        for chunk in chunks:
+            lines = (self.partial + chunk).split('\n')
+            self.partial = lines.pop()
+            output = []
+            for line in lines:
+                self.feed(line, output)
+            yield ''.join(output)
+        output = []
+        if self.partial:
+            self.feed(self.partial, output, '')
+        self.flush(output)
+        yield ''.join(output)
+
+    def feed(self, line, output, newline='\n'):
+        self.stats['lines_in'] += 1
+        match = XY_MOVE.match(line) if not self.relative else None
+        if match is not None:
+            x_word, y_word, e_word, f_word = match.groups()
+            feedrate = float(f_word[2:]) if f_word else self.feedrate
+            e = float(e_word[2:]) if e_word else None
+            if self.run and (feedrate != self.run[0].feedrate or (e is None) != (self.run[0].e is None) or
+                             len(self.run) >= MAX_RUN):
+                self.flush(output)
+            if not self.run:
+                self.run_start = (self.x, self.y, self.e)
+            self.run.append(Move(float(x_word[2:]), float(y_word[2:]), e, feedrate, (x_word, y_word, e_word, f_word)))
+            self.x, self.y = self.run[-1].x, self.run[-1].y
+            self.e = e if e is not None else self.e
+            self.feedrate = feedrate
+            return
+
+        self.flush(output)
+        self.track(line)
+        output.append(line + newline)
+        self.stats['lines_out'] += 1
+
+    def track(self, line):
+        # position, E, feedrate and modes after a line that is passed through
+        code = line.split(';', 1)[0].split()
+        if not code:
+            return
+        if code[0] in ('G90', 'G91'):
+            self.relative = code[0] == 'G91'
+        elif code[0] == 'M83':
+            self.relative = True
+        elif code[0] == 'M82':
+            self.relative = False
+        words = dict(WORD.findall(' '.join(code[1:])))
+        if code[0] in ('G0', 'G1', 'G2', 'G3') and not self.relative:
+            self.x = float(words.get('X', self.x))
+            self.y = float(words.get('Y', self.y))
+            self.e = float(words.get('E', self.e))
+            self.feedrate = float(words['F']) if 'F' in words else self.feedrate
+        elif code[0] == 'G92' and 'E' in words:
+            self.e = float(words['E'])
+
+    def flush(self, output):
+        if not self.run:
+            return
+        moves = self.merge_collinear(self.run) if self.merge else self.run
+        lines = self.fit_arcs(moves) if self.arcs else [self.line(move) for move in moves]
+        output.append(''.join(lines))
+        self.stats['lines_out'] += len(lines)
+        self.run = []
+
+    def start_of(self, moves, index):
+        # point and E before moves[index]
+        if index == 0:
+            return self.run_start
+        previous = moves[index - 1]
+        return previous.x, previous.y, previous.e if previous.e is not None else self.run_start[2]
+
+    def rate(self, moves, index):
+        # E per mm of a move, None for a travel or a move without length
+        start_x, start_y, start_e = self.start_of(moves, index)
+        move = moves[index]
+        length = math.hypot(move.x - start_x, move.y - start_y)
+        if move.e is None or length == 0:
+            return None
+        return (move.e - start_e) / length
+
+    def same_rate(self, a, b):
+        # E text has 4 decimals, so rates are compared with some slack
+        if a is None or b is None:
+            return a is None and b is None
+        return abs(a - b) <= self.rate_tolerance * max(abs(a), abs(b)) + 1e-6
+
+    def merge_collinear(self, moves):
+        merged = []
+        i = 0
+        while i < len(moves):
+            start_x, start_y, _ = self.start_of(moves, i)
+            reference = None
+            j = i - 1
+            while j + 1 < len(moves) and self.mergeable(moves, i, j + 1, start_x, start_y, reference):
+                j += 1
+                reference = self.rate(moves, j) if reference is None else reference
+            j = max(j, i)
+            if j > i:
+                self.stats['merged'] += j - i
+                merged.append(self.joined(moves[i], moves[j]))
+            else:
+                merged.append(moves[i])
+            i = j + 1
+        return merged
+
+    def mergeable(self, moves, first, last, start_x, start_y, reference):
+        # moves[first:last + 1] lie on one straight line, head the same way and extrude at the reference rate
+        end = moves[last]
+        length = math.hypot(end.x - start_x, end.y - start_y)
+        rate = self.rate(moves, last)
+        if end.e is not None and rate is None and end.e != self.start_of(moves, last)[2]:
+            # extrusion without movement is never merged
+            return False
+        if rate is not None and reference is not None and not self.same_rate(rate, reference):
+            return False
+        if length == 0:
+            return all(move.x == start_x and move.y == start_y for move in moves[first:last + 1])
+        direction_x, direction_y = (end.x - start_x) / length, (end.y - start_y) / length
+        along = 0.0
+        for move in moves[first:last + 1]:
+            offset_x, offset_y = move.x - start_x, move.y - start_y
+            if abs(offset_x * direction_y - offset_y * direction_x) > self.tolerance:
+                return False
+            position = offset_x * direction_x + offset_y * direction_y
+            if position < along - self.tolerance:
+                return False
+            along = max(along, position)
+        return True
+
+    @staticmethod
+    def joined(first, last):
+        # last move carrying the first move's feedrate word, which may be the one setting the feedrate
+        x_word, y_word, e_word, f_word = last.words
+        return Move(last.x, last.y, last.e, last.feedrate, (x_word, y_word, e_word, first.words[3] or f_word))
+
+    def fit_arcs(self, moves):
+        lines = []
+        i = 0
+        while i < len(moves):
+            end = self.longest_arc(moves, i)
+            if end is None:
+                lines.append(self.line(moves[i]))
+                i += 1
+                continue
+            lines.append(self.arc_line(moves, i, end))
+            self.stats['arcs'] += 1
+            self.stats['merged'] += end - i
+            i = end + 1
+        return lines
+
+    def longest_arc(self, moves, first):
+        # index of the last move of the longest arc starting at moves[first], or None
+        best = None
+        last = first + self.min_arc_moves - 1
+        while last < len(moves) and self.arc_fits(moves, first, last):
+            best = last
+            last += 1
+        return best
+
+    def arc_fits(self, moves, first, last):
+        points = [self.start_of(moves, first)[:2]] + [(move.x, move.y) for move in moves[first:last + 1]]
+        first_rate = self.rate(moves, first)
+        turn_sign = 0
+        for k in range(1, len(points) - 1):
+            (ax, ay), (bx, by), (cx, cy) = points[k - 1], points[k], points[k + 1]
+            cross = (bx - ax) * (cy - by) - (by - ay) * (cx - bx)
+            dot = (bx - ax) * (cx - bx) + (by - ay) * (cy - by)
+            turn = math.atan2(cross, dot)
+            if turn == 0 or abs(turn) > self.max_turn or (turn_sign and (turn > 0) != (turn_sign > 0)):
+                return False
+            turn_sign = turn
+        for index in range(first, last + 1):
+            if not self.same_rate(self.rate(moves, index), first_rate):
+                return False
+        center = circle_center(points[0], points[len(points) // 2], points[-1])
+        if center is None:
+            return False
+        radius = math.hypot(points[0][0] - center[0], points[0][1] - center[1])
+        # every vertex and every chord midpoint has to be within tolerance of the arc
+        for (ax, ay), (bx, by) in zip(points, points[1:]):
+            for px, py in ((bx, by), ((ax + bx) / 2, (ay + by) / 2)):
+                if abs(math.hypot(px - center[0], py - center[1]) - radius) > self.tolerance:
+                    return False
+        # and the arc may not sweep a full turn
+        return sum(abs(angle_between(a, b, center)) for a, b in zip(points, points[1:])) < 2 * math.pi
+
+    def arc_line(self, moves, first, last):
+        start_x, start_y, _ = self.start_of(moves, first)
+        points = [(start_x, start_y)] + [(move.x, move.y) for move in moves[first:last + 1]]
+        center_x, center_y = circle_center(points[0], points[len(points) // 2], points[-1])
+        (ax, ay), (bx, by) = points[0], points[1]
+        # the centre left of the direction of travel is a counter clockwise arc
+        counter_clockwise = (bx - ax) * (center_y - ay) - (by - ay) * (center_x - ax) > 0
+        end = self.joined(moves[first], moves[last])
+        x_word, y_word, e_word, f_word = end.words
+        return f'{"G3" if counter_clockwise else "G2"}{x_word}{y_word} I{round(center_x - start_x, 4)} ' \
+               f'J{round(center_y - start_y, 4)}{e_word or ""}{f_word or ""}\n'
+
+    @staticmethod
+    def line(move):
+        return 'G1' + ''.join(word for word in move.words if word) + '\n'
+
+
+def circle_center(a, b, c):
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < 1e-12:
+        return None
+    a2, b2, c2 = a[0] ** 2 + a[1] ** 2, b[0] ** 2 + b[1] ** 2, c[0] ** 2 + c[1] ** 2
+    return ((a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d,
+            (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d)
+
+
+def angle_between(a, b, center):
+    return math.atan2((a[0] - center[0]) * (b[1] - center[1]) - (a[1] - center[1]) * (b[0] - center[0]),
+                      (a[0] - center[0]) * (b[0] - center[0]) + (a[1] - center[1]) * (b[1] - center[1]))
+
+
+def extrusion_totals(text):
+    # filament pushed between G92 E resets, in absolute E mode the last E before every reset and at the end
+    totals = []
+    e = 0.0
+    start = 0.0
+    for line in text.split('\n'):
+        code = line.split(';', 1)[0].split()
+        if not code:
+            continue
+        words = dict(WORD.findall(' '.join(code[1:])))
+        if code[0] == 'G92' and 'E' in words:
+            totals.append(round(e - start, 4))
+            e = start = float(words['E'])
+        elif code[0] in ('G0', 'G1', 'G2', 'G3') and 'E' in words:
+            e = float(words['E'])
+    totals.append(round(e - start, 4))
+    return totals
+
+
+def optimize(text, **options):
+    optimizer = Optimizer(**options)
+    return ''.join(optimizer.iter_chunks([text])), optimizer.stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge collinear moves and fit arcs in pressure advance gcode')
+    parser.add_argument('input', nargs='?', help='gcode file, or generate from --settings')
+    parser.add_argument('-o', '--output', default='pa_test_optimized.gcode')
+    parser.add_argument('--settings', default='settings.json')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='mm a merged move or arc may deviate')
+    parser.add_argument('--no-arcs', action='store_true')
+    args = parser.parse_args()
+
+    if args.input is not None:
+        with open(args.input, 'r') as input_file:
+            original = input_file.read()
+    else:
+        with open(args.settings, 'r') as json_file:
+            original = GCodeGenerator.generate_from_settings(json.load(json_file))
+    optimized, optimize_stats = optimize(original, arcs=not args.no_arcs, tolerance=args.tolerance)
+    with open(args.output, 'w') as output_file:
+        output_file.write(optimized)
+    print(f'{optimize_stats["lines_in"]} -> {optimize_stats["lines_out"]} lines, {len(original.encode())} -> '
+          f'{len(optimized.encode())} bytes, {optimize_stats["merged"]} moves merged into others, '
+          f'{optimize_stats["arcs"]} arcs')
+    if extrusion_totals(original) != extrusion_totals(optimized):
+        raise SystemExit('extrusion changed')
@@ -0,0 +1,280 @@
+import argparse
+import json
+import re
+import struct
+import zlib
+
+import numpy as np
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# channels of every png colour type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+PNM_HEADER_NUMBER = re.compile(rb'(?:\s|#[^\n]*\n)*(\d+)')
+LUMA = np.array([0.299, 0.587, 0.114])
+# fraction of a band at each of its ends that is not scored
+EDGE_MARGIN = 0.05
+# weights of the neighbouring values in the smoothed score, the value itself counts most so a single clean value
+# still comes out lowest
+SMOOTHING = np.array([1.0, 2.0, 1.0])
+# a best value this close to either end of the range may lie outside it
+EDGE_FRACTION = 0.05
+# the lowest of many smoothed noise values lies about this many standard deviations under their median
+SIGNIFICANCE_FLOOR = 4.0
+
+
+def read_image(path):
+    # grey values 0..1 of a png or a pgm/ppm, rows top to bottom
+    with open(path, 'rb') as image_file:
+        data = image_file.read()
+    if data.startswith(PNG_SIGNATURE):
+        return read_png(data)
+    if data[:2] in (b'P2', b'P3', b'P5', b'P6'):
+        return read_pnm(data)
+    raise ValueError(f'{path} is not a png, pgm or ppm, convert the photo first')
+
+
+def read_png(data):
+    # 8 and 16 bit, non interlaced, any colour type
+    position = len(PNG_SIGNATURE)
+    header = None
+    palette = None
+    compressed = []
+    while position + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        position += length + 12
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif kind == b'PLTE':
+            palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        elif kind == b'IDAT':
+            compressed.append(body)
+        elif kind == b'IEND':
+            break
+    if header is None or not compressed:
+        raise ValueError('png without image data')
+    width, height, depth, color_type, _, _, interlace = header
+    if interlace or depth not in (8, 16) or color_type not in PNG_CHANNELS or (color_type == 3 and depth != 8):
+        raise ValueError(f'only 8 and 16 bit non interlaced png is supported, got depth {depth}, colour type '
+                         f'{color_type}, interlace {interlace}')
+
+    channels = PNG_CHANNELS[color_type]
+    pixel_bytes = channels * depth // 8
+    raw = np.frombuffer(zlib.decompress(b''.join(compressed)), dtype=np.uint8)
+    raw = raw[:height * (1 + width * pixel_bytes)].reshape(height, 1 + width * pixel_bytes)
+    pixels = unfilter(raw[:, 0], raw[:, 1:].reshape(height, width, pixel_bytes))
+    if color_type == 3:
+        return grey(palette[pixels[..., 0]] / 255.0)
+    if depth == 16:
+        return grey((pixels[..., 0::2].astype(np.uint16) << 8 | pixels[..., 1::2]) / 65535.0)
+    return grey(pixels / 255.0)
+
+
+def unfilter(filters, data):
+    # undo the png row filters. Sub, Average and Paeth depend on the pixel to the left and Up on the pixel above, so
+    # the pixels are reconstructed one anti diagonal at a time, every pixel of a diagonal only needs the two before
+    height, width, pixel_bytes = data.shape
+    # one row and column of zeros above and left of the image
+    output = np.zeros((height + 1, width + 1, pixel_bytes), dtype=np.int16)
+    filtered = data.astype(np.int16)
+    for diagonal in range(height + width - 1):
+        y = np.arange(max(0, diagonal - width + 1), min(height, diagonal + 1))
+        x = diagonal - y
+        left = output[y + 1, x]
+        up = output[y, x + 1]
+        up_left = output[y, x]
+        kind = filters[y][:, None]
+        estimate = left + up - up_left
+        distance_left = np.abs(estimate - left)
+        distance_up = np.abs(estimate - up)
+        distance_up_left = np.abs(estimate - up_left)
+        paeth = np.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                         np.where(distance_up <= distance_up_left, up, up_left))
+        predictor = np.select([kind == 1, kind == 2, kind == 3, kind == 4], [left, up, (left + up) // 2, paeth], 0)
+        output[y + 1, x + 1] = (filtered[y, x] + predictor) & 255
+    return output[1:, 1:].astype(np.uint8)
+
+
+def read_pnm(data):
+    # binary (P5, P6) and ascii (P2, P3) pgm and ppm, 8 or 16 bit
+    channels = 3 if data[:2] in (b'P3', b'P6') else 1
+    position = 2
+    numbers = []
+    for _ in range(3):
+        match = PNM_HEADER_NUMBER.match(data, position)
+        if match is None:
+            raise ValueError('broken pgm/ppm header')
+        numbers.append(int(match.group(1)))
+        position = match.end()
+    width, height, maximum = numbers
+    count = width * height * channels
+    if data[:2] in (b'P5', b'P6'):
+        values = np.frombuffer(data, dtype='>u2' if maximum > 255 else np.uint8, count=count, offset=position + 1)
+    else:
+        values = np.array(data[position:].split()[:count], dtype=float)
+    return grey(values.reshape(height, width, channels) / maximum)
+
+
+def grey(values):
+    # height x width grey image from 1 to 4 channels, alpha is ignored
+    if values.shape[2] < 3:
+        return values[..., 0].astype(float)
+    return values[..., :3] @ LUMA
+
+
+def otsu_threshold(values, bins=256):
+    histogram, edges = np.histogram(values, bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(histogram)
+    mean = np.cumsum(histogram * centers)
+    below = weight[:-1]
+    above = weight[-1] - below
+    between = (mean[-1] * below - mean[:-1] * weight[-1]) ** 2 / np.maximum(below * above, 1)
+    return centers[np.argmax(between)]
+
+
+def locate_tower(image):
+    # (left, top, right, bottom) in pixels: top is the top of the tower, bottom the bed and left and right the ends
+    # of the test wall, which is narrower than the base. The tower is the part that stands out from the photo border
+    border = np.concatenate((image[0], image[-1], image[:, 0], image[:, -1]))
+    difference = np.abs(image - np.median(border))
+    mask = difference > otsu_threshold(difference)
+    row_count = mask.sum(1)
+    rows = np.flatnonzero(row_count > 0.5 * np.percentile(row_count, 90))
+    if len(rows) < 2:
+        raise ValueError('no tower found in the photo, pass its box')
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+    # the wall is measured over the upper part, clear of the base
+    column_count = mask[top:top + max(int((bottom - top) * 0.8), 1)].sum(0)
+    columns = np.flatnonzero(column_count > 0.5 * column_count.max())
+    return int(columns[0]), top, int(columns[-1]) + 1, bottom
+
+
+def box_mean(values, radius):
+    # mean over a window of 2 * radius + 1 columns, windows are cut short at the ends
+    columns = values.shape[1]
+    cumulative = np.concatenate((np.zeros((len(values), 1)), np.cumsum(values, 1)), 1)
+    index = np.arange(columns)
+    low = np.maximum(index - radius, 0)
+    high = np.minimum(index + radius + 1, columns)
+    return (cumulative[:, high] - cumulative[:, low]) / (high - low)
+
+
+def row_band_scores(image, box, bands, mirror=False):
+    # defect score of every row of the box and every band: how much the wall varies along the band, around its speed
+    # transitions and in between. A band printed with the right pressure advance has even lines and scores lowest
+    left, top, right, bottom = box
+    wall = image[top:bottom, left:right]
+    columns = right - left
+    band_width = columns / bands
+    # variation along x with the slow changes of the lighting taken out, relative to the brightness of the row
+    energy = (wall - box_mean(wall, max(int(band_width / 8), 1))) ** 2 / (wall.mean(1, keepdims=True) ** 2 + 1e-12)
+    # the band ends are left out, a transition there belongs to both bands and the tower ends to the background
+    margin = max(int(band_width * EDGE_MARGIN), 1)
+    scores = np.zeros((len(wall), bands))
+    for band in range(bands):
+        # band 0 is at the +x end of the tower, on the right of the photo unless mirror
+        low = int(round((band if mirror else bands - band - 1) * band_width))
+        high = int(round((band + 1 if mirror else bands - band) * band_width))
+        scores[:, band] = energy[:, low + margin:max(high - margin, low + margin + 1)].mean(1)
+    # every band against its own typical score so lighting along x does not favour one band
+    return scores / (np.median(scores, 0) + 1e-12)
+
+
+def smooth_scores(values, kernel):
+    # weighted mean of the values that are not nan around each value
+    valid = ~np.isnan(values)
+    total = np.convolve(np.where(valid, values, 0.0), kernel, 'same')
+    weight = np.convolve(valid.astype(float), kernel, 'same')
+    return np.divide(total, weight, out=np.full(len(values), np.nan), where=weight > 0)
+
+
+def detect_pa(image, pa_map, box=None, mirror=False):
+    # pressure advance of the band with the most even lines in a photo of the tower taken straight
+    # from the front (-y), the +x end on the right unless mirror. Returns a dict with the value, a confidence from 0
+    # to 1, the layer, band and height it was found at and the score of every value
+    box = locate_tower(image) if box is None else tuple(int(value) for value in box)
+    left, top, right, bottom = box
+    layer_z = np.asarray(pa_map['layer_z'])
+    band_pa = np.asarray(pa_map['band_pa'])
+    base = pa_map['base_layer_count']
+    bands = pa_map['bands']
+    test_layers = len(band_pa)
+    if test_layers == 0 or right - left < 8 * bands or bottom - top < 2:
+        raise ValueError('the tower in the photo is too small to analyse')
+
+    # rows to layers, from the bed at the bottom of the box to the top of the last layer
+    row = np.arange(top, bottom)
+    z = (bottom - row - 0.5) / (bottom - top) * layer_z[-1]
+    test_layer = np.searchsorted(layer_z, z) - base
+    shown = (test_layer >= 0) & (test_layer < test_layers)
+    scores = row_band_scores(image, box, bands, mirror)[shown]
+    index = (test_layer[shown][:, None] * bands + np.arange(bands)).ravel()
+
+    # mean score of every printed value in print order, the values rise with the index
+    total = np.bincount(index, scores.ravel(), test_layers * bands)
+    count = np.bincount(index, minlength=test_layers * bands)
+    score = np.divide(total, count, out=np.full(len(total), np.nan), where=count > 0)
+    smooth = smooth_scores(score, SMOOTHING)
+    if np.all(np.isnan(smooth)):
+        raise ValueError('no test layers in the photo')
+    best = int(np.nanargmin(smooth))
+
+    # how far the dip reaches below the typical score, in standard deviations of the smoothed noise. The noise of a
+    # single score comes from the differences between neighbours, which a slow trend or a single dip hardly moves
+    noise = 1.4826 * np.nanmedian(np.abs(np.diff(score))) / np.sqrt(2)
+    spread = noise * np.sqrt(np.sum(SMOOTHING ** 2)) / np.sum(SMOOTHING) + 1e-12
+    significance = max(np.nanmedian(smooth) - smooth[best], 0.0) / spread
+    confidence = max(1 - SIGNIFICANCE_FLOOR / significance, 0.0) if significance > 0 else 0.0
+    confidence *= np.count_nonzero(count) / len(count)
+    warnings = []
+    if best < EDGE_FRACTION * len(score) or best >= (1 - EDGE_FRACTION) * len(score) - 1:
+        confidence *= 0.5
+        warnings.append('the best value is at the end of the range, print again with a range around it')
+    if np.count_nonzero(count) < len(count):
+        warnings.append(f'{len(count) - np.count_nonzero(count)} of {len(count)} values have no pixel rows, '
+                        f'use a sharper or closer photo')
+
+    layer = best // bands + base
+    # middle of the layer above the base, the height the pa calculator reads back as this layer
+    base_top = layer_z[base - 1] if base > 0 else 0.0
+    bottom = layer_z[layer - 1] if layer > 0 else 0.0
+    return {
+        'pa': float(band_pa.ravel()[best]),
+        'confidence': float(confidence),
+        'significance': float(significance),
+        'layer': int(layer),
+        'band': best % bands + 1,
+        'z': float(layer_z[layer]),
+        'height': float((bottom + layer_z[layer]) / 2 - base_top),
+        'box': list(box),
+        'warnings': warnings,
+        'scores': [[float(pa), None if np.isnan(value) else float(value)]
+                   for pa, value in zip(band_pa.ravel(), smooth)]
+    }
+
+
+def load_pa_map(path):
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the best pressure advance in a photo of the printed tower')
+    parser.add_argument('photo', help='png, pgm or ppm taken straight from the front, tower upright')
+    parser.add_argument('--map', default='pa_test.pa.json', help='layer map written when the gcode was generated')
+    parser.add_argument('--box', default=None, help='left,top,right,bottom of the tower in pixels, found if not given')
+    parser.add_argument('--mirror', action='store_true', help='the photo shows the +x end of the tower on the left')
+    parser.add_argument('--json', action='store_true', help='print the whole result with the score of every value')
+    args = parser.parse_args()
+
+    result = detect_pa(read_image(args.photo), load_pa_map(args.map),
+                       [int(value) for value in args.box.split(',')] if args.box else None, args.mirror)
+    if args.json:
+        print(json.dumps(result, indent=4))
+    else:
+        print(f'pressure advance {result["pa"]:.4f}, confidence {result["confidence"]:.2f}, '
+              f'layer {result["layer"] + 1} band {result["band"]}, {result["height"]:.2f} mm above the base')
+        for warning in result['warnings']:
+            print(warning)
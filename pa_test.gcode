@@ -1,16 +1,16 @@
 ; --------------------
 ;     gcode header    
 ; --------------------
-G90 ; set absolute coordinates 
-M82 ; set absolute extruder moves 
-M106 S0 ; turn off part cooling fan 
-M190 S80 ; set and wait for bed temp 
-G28 U Y X Z ; home all axes 
-G10 P0 S240 ; set extruder temp 
-M109 S240 ; wait for extruder temp 
-T0 ; select tool 
-M703 ; load filament configs 
-M572 D0 S0.0 
+G90 ; set absolute coordinates
+M82 ; set absolute extruder moves
+M106 S0 ; turn off part cooling fan
+M190 S80 ; set and wait for bed temp
+G28 U Y X Z ; home all axes
+G10 P0 S240 ; set extruder temp
+M109 S240 ; wait for extruder temp
+T0 ; select tool
+M703 ; load filament configs
+M572 D0 S0.0
 
 ; --------------------
 ;    gcode generated  
@@ -901,8 +901,8 @@ G1 X200.0 Y149.8 E10.018 F900
 ; --------------------
 ;     gcode footer    
 ; --------------------
-M140 S0 ; turn off bed 
-G10 P0 R0 S0 ; set extruder temp 
-T-1 ; omitted if tool_index = -1 
-G91 G1 Z5 F3000 ; move extruder up 5 
-G1 X0 Y0 F3000 
+M140 S0 ; turn off bed
+G10 P0 R0 S0 ; set extruder temp
+T-1 ; omitted if tool_index = -1
+G91 G1 Z5 F3000 ; move extruder up 5
+G1 X0 Y0 F3000
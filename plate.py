@@ -0,0 +1,248 @@
+import argparse
+import copy
+import json
+import math
+
+from gcode_generator import GCodeGenerator
+from preflight import PreflightError, preflight_problems
+from sinks import FileSink
+from toolpath import BASE_PERIMETERS, LAYER_CHANGE_FEEDRATE, TRAVEL, bed_center, build_toolpath, format_band_runs, \
+    stamp_band_runs
+
+
+# settings every tower of a plate must share, layers are printed together so their heights have to line up
+SHARED_SETTINGS = (
+    ('extrusion_settings', 'first_layer_height'),
+    ('extrusion_settings', 'other_layer_height'),
+    ('printer_settings', 'bed_min_x'),
+    ('printer_settings', 'bed_max_x'),
+    ('printer_settings', 'bed_min_y'),
+    ('printer_settings', 'bed_max_y')
+)
+
+
+class Tower:
+    def __init__(self, settings, center):
+        self.settings = settings
+        self.center = center
+        self.tool = settings['printer_settings']['tool_index'][0]
+        self.toolpath = build_toolpath(settings, center)
+        self.bodies = {}
+
+    def layer_start(self, layer):
+        # where the nozzle has to be before the first move of a layer, the end of the tower's own previous layer
+        if layer == 0:
+            return self.center
+        end = self.toolpath.layer_offsets[layer] - 1
+        return float(self.toolpath.x[end]), float(self.toolpath.y[end])
+
+    def layer_end(self, layer):
+        end = self.toolpath.layer_offsets[layer + 1] - 1
+        return float(self.toolpath.x[end]), float(self.toolpath.y[end])
+
+    def layer_text(self, layer):
+        body = self.toolpath.layer_body[layer]
+        if body not in self.bodies:
+            self.bodies[body] = format_band_runs(self.toolpath, body)
+        return stamp_band_runs(self.toolpath, self.bodies[body], layer, self.tool)
+
+
+def tower_settings(base, overrides):
+    # copy of base with {"group.setting": value} overrides applied
+    settings = copy.deepcopy(base)
+    for key, value in overrides.items():
+        group, name = key.split('.', 1)
+        if group not in settings or name not in settings[group]:
+            raise KeyError(f'unknown setting {key}')
+        settings[group][name][0] = value
+    return settings
+
+
+def footprint(settings):
+    # half width and half depth of a tower including its base perimeters and line width
+    extrusion_width = settings['printer_settings']['nozzle_diameter'][0]
+    margin = extrusion_width * (BASE_PERIMETERS + 0.5)
+    return settings['object_settings']['width'][0] / 2 + margin, margin
+
+
+def layout(towers_settings, spacing=10.0):
+    # centres of the towers packed in rows, the whole plate centred on the bed, raises ValueError if it does not fit
+    printer = towers_settings[0]['printer_settings']
+    bed_width = printer['bed_max_x'][0] - printer['bed_min_x'][0]
+    bed_depth = printer['bed_max_y'][0] - printer['bed_min_y'][0]
+
+    rows = [[]]
+    row_width = 0.0
+    for index, settings in enumerate(towers_settings):
+        half_width, _ = footprint(settings)
+        if rows[-1] and row_width + spacing + 2 * half_width > bed_width:
+            rows.append([])
+            row_width = 0.0
+        row_width += (spacing if rows[-1] else 0.0) + 2 * half_width
+        rows[-1].append(index)
+
+    row_depths = [max(2 * footprint(towers_settings[i])[1] for i in row) for row in rows]
+    plate_depth = sum(row_depths) + spacing * (len(rows) - 1)
+    if plate_depth > bed_depth:
+        raise ValueError(f'{len(towers_settings)} towers need {plate_depth:.1f} mm of bed depth, '
+                         f'only {bed_depth:.1f} mm available')
+
+    center_x, center_y = bed_center(towers_settings[0])
+    centers = [None] * len(towers_settings)
+    y = center_y + plate_depth / 2
+    for row, row_depth in zip(rows, row_depths):
+        widths = [2 * footprint(towers_settings[i])[0] for i in row]
+        if max(widths) > bed_width:
+            raise ValueError(f'tower {row[0] + 1} is wider than the bed')
+        x = center_x - (sum(widths) + spacing * (len(row) - 1)) / 2
+        for index, width in zip(row, widths):
+            centers[index] = (x + width / 2, y - row_depth / 2)
+            x += width + spacing
+        y -= row_depth + spacing
+
+    for index, (settings, (x, y)) in enumerate(zip(towers_settings, centers)):
+        half_width, half_depth = footprint(settings)
+        if x - half_width < printer['bed_min_x'][0] or x + half_width > printer['bed_max_x'][0] or \
+                y - half_depth < printer['bed_min_y'][0] or y + half_depth > printer['bed_max_y'][0]:
+            raise ValueError(f'tower {index + 1} does not fit inside the bed limits')
+    return centers
+
+
+def check_shared_settings(towers_settings):
+    for group, name in SHARED_SETTINGS:
+        values = {settings[group][name][0] for settings in towers_settings}
+        if len(values) > 1:
+            raise ValueError(f'all towers of a plate need the same {group}.{name}, got {sorted(values)}')
+
+
+def distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def order_layer(towers, layer, tool, position):
+    # visiting order of the towers printing this layer: the current tool first so a layer costs one tool change
+    # per extra tool, then the nearest tool, and within a tool always the nearest tower
+    groups = {}
+    for index, tower in enumerate(towers):
+        if layer < tower.toolpath.layer_count:
+            groups.setdefault(tower.tool, []).append(index)
+    order = []
+    while groups:
+        if tool not in groups:
+            tool = min(groups, key=lambda candidate: min(distance(position, towers[i].layer_start(layer))
+                                                         for i in groups[candidate]))
+        remaining = groups.pop(tool)
+        while remaining:
+            index = min(remaining, key=lambda i: distance(position, towers[i].layer_start(layer)))
+            remaining.remove(index)
+            order.append(index)
+            position = towers[index].layer_end(layer)
+    return order
+
+
+def iter_plate_layers(towers, stats):
+    tool = towers[0].tool
+    # the start gcode waits for the first tool, every other tool is waited for when it is first selected
+    heated = {tool}
+    position = towers[0].center
+    # layer heights match across towers, so the tallest tower has the z of every layer
+    tallest = max(towers, key=lambda tower: tower.toolpath.layer_count).toolpath
+    for layer in range(tallest.layer_count):
+        z = round(float(tallest.layer_z[layer]), 4)
+        chunk = [f'\n; -> layer nr={layer + 1}\nG1 Z{z} F{LAYER_CHANGE_FEEDRATE}\n']
+        for index in order_layer(towers, layer, tool, position):
+            tower = towers[index]
+            toolpath = tower.toolpath
+            chunk.append(f'; tower {index + 1}\n')
+            if tower.tool != tool:
+                tool = tower.tool
+                stats['tool_changes'] += 1
+                chunk.append(f'T{tool}\n')
+                if tool not in heated:
+                    heated.add(tool)
+                    chunk.append(f'M116 P{tool} ; wait for extruder temp\n')
+            chunk.append('G92 E0\n')
+            if layer >= toolpath.base_layer_count:
+                chunk.append(f'M572 D{tool} S{round(float(toolpath.layer_pa[layer]), 4)}\n')
+            start = tower.layer_start(layer)
+            first_move = toolpath.layer_offsets[layer]
+            if toolpath.speed[first_move] != TRAVEL:
+                # the layer continues from where the tower's previous layer ended, get there without extruding
+                chunk.append(f'G1 X{round(start[0], 4)} Y{round(start[1], 4)} F{toolpath.feedrates[TRAVEL] * 60}\n')
+                stats['travel_mm'] += distance(position, start)
+            else:
+                stats['travel_mm'] += distance(position, (float(toolpath.x[first_move]),
+                                                          float(toolpath.y[first_move])))
+            chunk.append(tower.layer_text(layer))
+            position = tower.layer_end(layer)
+        yield ''.join(chunk)
+
+
+def iter_plate_chunks(towers_settings, spacing=10.0, stats=None):
+    # gcode of every tower on one plate, the start and end gcode come from the first tower, the other tools are
+    # heated at the start and turned off at the end
+    check_shared_settings(towers_settings)
+    centers = layout(towers_settings, spacing)
+    towers = [Tower(settings, center) for settings, center in zip(towers_settings, centers)]
+    problems = []
+    for number, tower in enumerate(towers, 1):
+        problems += [dict(found, tower=number, message=f'tower {number}: {found["message"]}')
+                     for found in preflight_problems(tower.toolpath, tower.settings)]
+    if problems:
+        raise PreflightError(problems)
+    stats = {} if stats is None else stats
+    stats.update({'towers': len(towers), 'centers': centers, 'tool_changes': 0, 'travel_mm': 0.0})
+
+    first = towers_settings[0]
+    other_tools = {}
+    for tower in towers:
+        if tower.tool != towers[0].tool:
+            other_tools.setdefault(tower.tool, tower.settings)
+    yield GCodeGenerator.header(first)
+    for tool, settings in other_tools.items():
+        yield f'G10 P{tool} S{settings["filament_settings"]["first_layer_extruder_temp"][0]} ; set extruder temp\n'
+
+    yield '; --------------------\n' \
+          ';    gcode generated  \n' \
+          ';     plate towers    \n' \
+          '; --------------------\n'
+    yield from iter_plate_layers(towers, stats)
+    yield '\n'
+
+    for tool in other_tools:
+        yield f'G10 P{tool} R0 S0 ; set extruder temp\n'
+    yield GCodeGenerator.footer(first)
+
+
+def generate_plate(towers_settings, output_path=None, spacing=10.0):
+    # returns the gcode and the layout stats, writes the gcode when output_path is given
+    stats = {}
+    gcode = ''.join(iter_plate_chunks(towers_settings, spacing, stats))
+    if output_path is not None:
+        with FileSink(output_path) as sink:
+            sink.write(gcode)
+    return gcode, stats
+
+
+def load_plate(path, base_settings):
+    # plate file: {"spacing": 10, "towers": [{"printer_settings.tool_index": 1, ...}, ...]}
+    with open(path, 'r') as json_file:
+        plate = json.load(json_file)
+    return [tower_settings(base_settings, overrides) for overrides in plate['towers']], plate.get('spacing', 10.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Several pressure advance towers with their own tool on one plate')
+    parser.add_argument('plate', help='plate json with a list of setting overrides per tower')
+    parser.add_argument('--settings', default='settings.json', help='settings the overrides apply to')
+    parser.add_argument('-o', '--output', default='pa_plate.gcode')
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as settings_file:
+        plate_base = json.load(settings_file)
+    plate_towers, plate_spacing = load_plate(args.plate, plate_base)
+    _, plate_stats = generate_plate(plate_towers, args.output, plate_spacing)
+    for tower_nr, (tower_x, tower_y) in enumerate(plate_stats['centers'], 1):
+        print(f'tower {tower_nr}: tool {plate_towers[tower_nr - 1]["printer_settings"]["tool_index"][0]} '
+              f'at X{tower_x:.1f} Y{tower_y:.1f}')
+    print(f'{plate_stats["tool_changes"]} tool changes, {plate_stats["travel_mm"] / 1000:.2f} m travel')
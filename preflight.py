@@ -0,0 +1,171 @@
+import argparse
+import json
+
+import numpy as np
+
+from settings import as_settings
+from toolpath import build_toolpath
+
+
+# an extruded line wider than this many nozzle diameters points at a bad extrusion multiplier
+MAX_LINE_WIDTH = 3.0
+# E changes smaller than this are float noise
+E_TOLERANCE = 1e-9
+
+
+class PreflightError(ValueError):
+    def __init__(self, problems):
+        # problems is a list of dicts from preflight_problems
+        self.problems = problems
+        super().__init__('preflight failed: ' + ', '.join(problem['message'] for problem in problems))
+
+
+def problem(check, message, value=None, limit=None, layer=None, move=None, count=1):
+    # layer and move are indices into the toolpath, count is how many layers have the problem
+    return {'check': check, 'message': message, 'value': None if value is None else float(value),
+            'limit': None if limit is None else float(limit), 'layer': None if layer is None else int(layer),
+            'move': None if move is None else int(move), 'count': int(count)}
+
+
+def body_moves(toolpath):
+    # every move of the distinct layer bodies and the layer it belongs to, the other layers repeat a body exactly
+    # so the per move checks only look at these. A body is the layer its own layer_body points at
+    bodies = np.flatnonzero(toolpath.layer_body == np.arange(toolpath.layer_count))
+    starts = toolpath.layer_offsets[bodies]
+    sizes = toolpath.layer_offsets[bodies + 1] - starts
+    moves = np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+    return bodies, moves, np.repeat(bodies, sizes)
+
+
+def move_extrusion(toolpath, moves, layers):
+    # length in mm and E of the given moves, every layer starts at E0 from where the layer below ended
+    previous = moves - 1
+    previous_x = np.where(moves > 0, toolpath.x[previous], 0.0)
+    previous_y = np.where(moves > 0, toolpath.y[previous], 0.0)
+    length = np.hypot(toolpath.x[moves] - previous_x, toolpath.y[moves] - previous_y)
+    first = moves == toolpath.layer_offsets[layers]
+    e = toolpath.e[moves] - np.where(first, 0.0, toolpath.e[previous])
+    return length, e
+
+
+def move_flow(toolpath, moves, layers, filament_area):
+    # mm^3/s and line width in mm of the given moves, 0 for travels and moves without length
+    length, e = move_extrusion(toolpath, moves, layers)
+    printing = toolpath.extrude[moves] & (length > 0)
+    volume_per_mm = np.divide(e * filament_area, length, out=np.zeros(len(moves)), where=printing)
+    speed = np.asarray(toolpath.feedrates, dtype=float)[toolpath.speed[moves]]
+    return volume_per_mm * speed, volume_per_mm / toolpath.layer_height[layers]
+
+
+def layer_flow(toolpath, filament_area):
+    # highest volumetric flow of every layer in mm^3/s
+    bodies, moves, layers = body_moves(toolpath)
+    flow, _ = move_flow(toolpath, moves, layers, filament_area)
+    sizes = toolpath.layer_offsets[bodies + 1] - toolpath.layer_offsets[bodies]
+    body_flow = np.maximum.reduceat(flow, np.cumsum(sizes) - sizes)
+    return body_flow[np.searchsorted(bodies, toolpath.layer_body)]
+
+
+def layer_count_of(toolpath, bodies):
+    # number of layers that repeat any of the given bodies
+    marked = np.zeros(toolpath.layer_count, dtype=bool)
+    marked[bodies] = True
+    return int(np.count_nonzero(marked[toolpath.layer_body]))
+
+
+def bounds_problems(axis, values, layers, low, high):
+    problems = []
+    if np.isnan(values).any():
+        first = np.flatnonzero(np.isnan(values))[0]
+        problems.append(problem('bounds', f'{axis} is not a number in layer {layers[first] + 1}', layer=layers[first]))
+    if np.nanmax(values) > high:
+        first = np.argmax(values > high)
+        problems.append(problem('bounds', f'{axis} reaches {np.nanmax(values):.3f} in layer {layers[first] + 1}, the '
+                                          f'bed ends at {high:g}', np.nanmax(values), high, layers[first]))
+    if np.nanmin(values) < low:
+        first = np.argmax(values < low)
+        problems.append(problem('bounds', f'{axis} reaches {np.nanmin(values):.3f} in layer {layers[first] + 1}, the '
+                                          f'bed starts at {low:g}', np.nanmin(values), low, layers[first]))
+    return problems
+
+
+def preflight_problems(toolpath, settings, max_volumetric_flow=None):
+    # everything that would make the tower unprintable, as a list of problem dicts, empty when it is fine.
+    # max_volumetric_flow overrides printer_settings.max_volumetric_flow, 0 skips the flow check
+    settings = as_settings(settings)
+    printer = settings.printer_settings
+    derived = settings.derived()
+    max_flow = printer.max_volumetric_flow if max_volumetric_flow is None else max_volumetric_flow
+    bodies, moves, layers = body_moves(toolpath)
+
+    # bed bounds, x and y of the distinct bodies and z of every layer
+    problems = bounds_problems('x', toolpath.x[moves], layers, printer.bed_min_x, printer.bed_max_x)
+    problems += bounds_problems('y', toolpath.y[moves], layers, printer.bed_min_y, printer.bed_max_y)
+    z = toolpath.layer_z
+    if np.nanmax(z) > printer.bed_max_z:
+        above = np.flatnonzero(z > printer.bed_max_z)
+        problems.append(problem('bounds', f'z reaches {np.nanmax(z):.3f} in layer {above[0] + 1}, the printer ends at '
+                                          f'{printer.bed_max_z:g}', np.nanmax(z), printer.bed_max_z, above[0],
+                                count=len(above)))
+
+    # every layer above the one below
+    steps = np.diff(z, prepend=0.0)
+    not_rising = np.flatnonzero(~(steps > 0))
+    if len(not_rising):
+        layer = not_rising[0]
+        problems.append(problem('z', f'layer {layer + 1} at z {z[layer]:.4f} is not above the layer below', z[layer],
+                                layer=layer, count=len(not_rising)))
+
+    # extrusion
+    length, e = move_extrusion(toolpath, moves, layers)
+    extrude = toolpath.extrude[moves]
+    checks = (
+        (~np.isfinite(toolpath.e[moves]), 'E is not a number'),
+        (extrude & (e < -E_TOLERANCE), 'E goes backwards'),
+        (~extrude & (np.abs(e) > E_TOLERANCE), 'a travel move changes E'),
+        (extrude & (length == 0) & (e > E_TOLERANCE), 'filament is pushed without moving')
+    )
+    for bad, message in checks:
+        if bad.any():
+            first = np.argmax(bad)
+            problems.append(problem('extrusion', f'{message} in layer {layers[first] + 1}', layer=layers[first],
+                                    move=moves[first], count=layer_count_of(toolpath, layers[bad])))
+
+    flow, width = move_flow(toolpath, moves, layers, derived.filament_area)
+    max_width = MAX_LINE_WIDTH * printer.nozzle_diameter
+    too_wide = width > max_width
+    if too_wide.any():
+        first = np.argmax(too_wide)
+        problems.append(problem('extrusion', f'lines in layer {layers[first] + 1} are {np.max(width):.2f} mm wide, '
+                                             f'more than {MAX_LINE_WIDTH:g} nozzle diameters, check the extrusion '
+                                             f'multipliers', np.max(width), max_width,
+                                layers[first], moves[first], layer_count_of(toolpath, layers[too_wide])))
+
+    if max_flow > 0:
+        flows = layer_flow(toolpath, derived.filament_area)
+        over = np.flatnonzero(flows > max_flow)
+        if len(over):
+            problems.append(problem('flow', f'{len(over)} layers need up to {np.max(flows):.1f} mm^3/s from layer '
+                                            f'{over[0] + 1}, more than max_volumetric_flow {max_flow:g}',
+                                    np.max(flows), max_flow, over[0], count=len(over)))
+    return problems
+
+
+def check_toolpath(toolpath, settings, max_volumetric_flow=None):
+    # raises PreflightError listing every problem
+    problems = preflight_problems(toolpath, settings, max_volumetric_flow)
+    if problems:
+        raise PreflightError(problems)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a tower against the bed, the hotend flow and sane extrusion')
+    parser.add_argument('settings', nargs='?', default='settings.json')
+    parser.add_argument('--max-flow', type=float, default=None, help='mm^3/s, overrides the printer setting')
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as json_file:
+        checked_settings = json.load(json_file)
+    found = preflight_problems(build_toolpath(checked_settings), checked_settings, args.max_flow)
+    print(json.dumps(found, indent=4) if found else 'no problems')
+    raise SystemExit(1 if found else 0)
@@ -38,6 +38,18 @@ layer0_z = layer_height
 
 
 from math import *
+import sys
+
+output = []
+
+def emit(text):
+    output.append(text)
+    output.append("\n")
+
+def flush():
+    # one write per batch of lines instead of one per move
+    sys.stdout.write("".join(output))
+    output.clear()
 
 
 def extrusion_volume_to_length(volume):
@@ -52,7 +64,7 @@ curr_z = layer0_z
 curr_e = 0
 
 # start gcode
-print(f"""
+emit(f"""
 M82                             ; set extruder to absolute mode
 G28 X Y U Z
 M140 S{first_layer_bed_temp}    ; set bed temp
@@ -72,13 +84,13 @@ G92 E0
 """)
 
 # goto z height
-print("G1 X%.3f Y%.3f Z%.3f F%.0f" % (curr_x, curr_y, curr_z, travel_speed * 60))
+emit("G1 X%.3f Y%.3f Z%.3f F%.0f" % (curr_x, curr_y, curr_z, travel_speed * 60))
 
 def up():
     global curr_z, curr_e
     curr_z += layer_height
-    print("G1 Z%.3f" % curr_z)
-    print("G92 E0")
+    emit("G1 Z%.3f" % curr_z)
+    emit("G92 E0")
     curr_e = 0
 
 def line(x,y,speed,extrusion_multiplier=1.0):
@@ -88,15 +100,15 @@ def line(x,y,speed,extrusion_multiplier=1.0):
     curr_y += y
     if speed > 0:
         curr_e += extrusion_for_length(length) * extrusion_multiplier
-        print("G1 X%.3f Y%.3f E%.4f F%.0f" % (curr_x, curr_y, curr_e, speed * 60))
+        emit("G1 X%.3f Y%.3f E%.4f F%.0f" % (curr_x, curr_y, curr_e, speed * 60))
     else:
-        print("G1 X%.3f Y%.3f F%.0f" % (curr_x, curr_y, travel_speed * 60))
+        emit("G1 X%.3f Y%.3f F%.0f" % (curr_x, curr_y, travel_speed * 60))
 
 def goto(x,y):
     global curr_x, curr_y
     curr_x = x + offset_x
     curr_y = y + offset_y
-    print("G1 X%.3f Y%.3f" %(curr_x, curr_y))
+    emit("G1 X%.3f Y%.3f" %(curr_x, curr_y))
 
 line(-object_width/2,0,0)
 
@@ -113,7 +125,7 @@ for l in range(2):
     layer_height = other_layer_height
     up()
     goto(-object_width/2,0)
-print(f"""
+emit(f"""
 M140 S{bed_temp} ; set bed temp
 M104 S{e0_temp} ; set extruder temp
 """)
@@ -124,9 +136,9 @@ space = segment - pattern_width
 for l in range(layers):
     pressure_advance = (l / (layers * 1.0)) * (pressure_advance_max-pressure_advance_min) + pressure_advance_min;
     
-    print("; layer %d, pressure advance: %.3f" %(l, pressure_advance))
+    emit("; layer %d, pressure advance: %.3f" %(l, pressure_advance))
     
-    print("M572 D0 S%.3f" % pressure_advance)
+    emit("M572 D0 S%.3f" % pressure_advance)
     
     for i in range(num_patterns):
         line(space/2, 0, fast_speed)
@@ -142,8 +154,9 @@ for l in range(layers):
     
     line(0,-extrusion_width,fast_speed)
     up()
+    flush()
     
-print("""
+emit("""
 M140 S0
 M104 S0
 T-1
@@ -153,4 +166,4 @@ G90
 G1 X0 Y0 F3000
 G1 Z200 F1000
 """)
-
+flush()
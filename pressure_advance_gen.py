@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import sys
+
+# only the standard library is imported up front, the generator (and numpy) is loaded by generate and by the preflight
+# part of check and tkinter only by the gui, so argument errors, --help and check --settings-only return quickly
+
+COMMANDS = ('generate', 'check', 'gui')
+DEFAULT_SETTINGS_PATH = 'settings.json'
+
+
+def parse_overrides(assignments):
+    # ['group.name=value', ...] as {'group.name': 'value'}
+    overrides = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition('=')
+        if not separator or '.' not in key:
+            raise ValueError(f'--set expects group.name=value, got {assignment!r}')
+        overrides[key.strip()] = value
+    return overrides
+
+
+def load_settings(path=None, assignments=()):
+    # settings.json shaped dict from the file (the built in defaults when no path is given and there is no
+    # settings.json here) with the --set overrides parsed by the type of their setting
+    from settings import Settings, field_types, parse_text
+
+    if path is None and not os.path.exists(DEFAULT_SETTINGS_PATH):
+        settings = Settings().to_dict()
+    else:
+        with open(path or DEFAULT_SETTINGS_PATH, 'r') as json_file:
+            settings = Settings.from_dict(json.load(json_file), check=False).to_dict()
+    types = field_types()
+    for key, text in parse_overrides(assignments).items():
+        group, name = key.split('.', 1)
+        if name not in types.get(group, {}):
+            raise ValueError(f'unknown setting {key}')
+        settings[group][name][0] = parse_text(text, types[group][name])
+    return settings
+
+
+def generate(settings, output, cache_directory=None, stages=None, pa_map_path=None):
+    from gcode_generator import GCodeGenerator
+
+    if output == '-':
+        from sinks import StdoutSink
+        GCodeGenerator.stream(settings, StdoutSink(), stages=stages)
+        if pa_map_path is not None:
+            GCodeGenerator.write_pa_map(settings, pa_map_path)
+        return
+    cache = None
+    if cache_directory is not None and stages is None:
+        from cache import GCodeCache
+        cache = GCodeCache(cache_directory)
+    GCodeGenerator.generate_to_file(settings, output, cache, stages=stages, pa_map_path=pa_map_path)
+
+
+def write_report(stages, report_path, profile_path):
+    # the stage table goes to stderr so it never mixes with gcode on stdout
+    from instrumentation import format_report
+
+    report = stages.report()
+    print(format_report(report), file=sys.stderr)
+    if report_path is not None:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=4)
+            report_file.write('\n')
+    if profile_path is not None:
+        stages.dump_profile(profile_path)
+
+
+def problem_messages(error):
+    from settings import SettingsError
+
+    if isinstance(error, SettingsError):
+        return [f'{key}: {message}' for key, message in error.problems]
+    if hasattr(error, 'problems'):
+        return [f'{problem["check"]}: {problem["message"]}' for problem in error.problems]
+    return [f'error: {error}']
+
+
+def check(settings, preflight=True):
+    # messages of every problem, empty when the settings can be generated. preflight also builds the toolpath and
+    # checks it against the bed, the hotend flow and sane extrusion, which loads numpy
+    from settings import Settings, SettingsError
+
+    try:
+        Settings.from_dict(settings)
+    except SettingsError as error:
+        return problem_messages(error)
+    if not preflight:
+        return []
+    from preflight import preflight_problems
+    from toolpath import build_toolpath
+    try:
+        toolpath = build_toolpath(settings)
+    except ValueError as error:
+        return problem_messages(error)
+    return [f'{problem["check"]}: {problem["message"]}' for problem in preflight_problems(toolpath, settings)]
+
+
+def run_gui():
+    try:
+        import tkinter
+        from pressure_advance_gui import Window
+    except ImportError as error:
+        raise SystemExit(f'the gui needs tkinter: {error}')
+    try:
+        Window(1405, 950, 'PA Generator')
+    except tkinter.TclError as error:
+        raise SystemExit(f'cannot open the gui: {error}')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Pressure advance calibration tower generator, generate is the default command')
+    commands = parser.add_subparsers(dest='command')
+
+    def add_settings_arguments(command):
+        command.add_argument('--settings', default=None,
+                             help=f'settings json, defaults to {DEFAULT_SETTINGS_PATH} or the built in defaults')
+        command.add_argument('--set', dest='overrides', action='append', default=[], metavar='GROUP.NAME=VALUE',
+                             help='override one setting, can be repeated')
+
+    generate_command = commands.add_parser('generate', help='write the gcode')
+    add_settings_arguments(generate_command)
+    generate_command.add_argument('-o', '--output', default='-', help='output file, - for stdout (default)')
+    generate_command.add_argument('--cache', default=None, help='reuse generated gcode from this cache directory')
+    generate_command.add_argument('--stages', action='store_true',
+                                  help='print time, moves and bytes of every generation stage, skips the cache')
+    generate_command.add_argument('--report', default=None, help='also write the stage report as json to this file')
+    generate_command.add_argument('--memory', action='store_true', help='add peak memory per stage (slower)')
+    generate_command.add_argument('--cprofile', default=None, help='capture a cProfile of the run to this file')
+    generate_command.add_argument('--pa-map', default=None,
+                                  help='also write the layer map pa_detect.py reads a photo of the tower with')
+
+    check_command = commands.add_parser('check', help='validate the settings and the toolpath and print the resolved '
+                                                      'values')
+    add_settings_arguments(check_command)
+    check_command.add_argument('--quiet', action='store_true', help='only report problems')
+    check_command.add_argument('--settings-only', action='store_true',
+                               help='only validate the setting values, skip the preflight check of the toolpath')
+
+    commands.add_parser('gui', help='open the settings window')
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'generate')
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'gui':
+        run_gui()
+        return 0
+
+    try:
+        settings = load_settings(args.settings, args.overrides)
+    except (OSError, ValueError) as error:
+        raise SystemExit(f'error: {error}')
+
+    if args.command == 'check':
+        problems = check(settings, not args.settings_only)
+        for message in problems:
+            print(message, file=sys.stderr)
+        if not problems and not args.quiet:
+            print(json.dumps(settings, indent=4))
+        return 1 if problems else 0
+
+    stages = None
+    if args.stages or args.report or args.memory or args.cprofile:
+        from instrumentation import Instrumentation
+        stages = Instrumentation(memory=args.memory, cprofile=args.cprofile is not None)
+    try:
+        generate(settings, args.output, args.cache, stages, args.pa_map)
+    except ValueError as error:
+        # SettingsError and PreflightError list every problem
+        for message in problem_messages(error):
+            print(message, file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # the reader of stdout went away, e.g. piped into head
+        sys.stderr.close()
+        return 1
+    if stages is not None:
+        write_report(stages, args.report, args.cprofile)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
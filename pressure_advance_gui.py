@@ -1,64 +1,18 @@
-import math
-from tkinter import ttk
+from tkinter import filedialog, ttk
 import tkinter as tk
+import copy
 import json
+import os
+import queue
+import threading
+import time
 
-
-settings_reference = {
-    'printer_settings': {
-        'bed_min_x': (0, 'Bed minimum x in mm, usually 0'),
-        'bed_max_x': (300, 'Bed maximum x in mm, usually width of bed'),
-        'bed_min_y': (0, 'Bed minimum y in mm, usually 0'),
-        'bed_max_y': (300, 'Bed maximum x in mm, usually depth of bed'),
-        'bed_max_z': (300, 'Bed maximum z in mm'),
-        'homing_axes': ('X Y Z U', 'Axes to home'),
-        'tool_index': (-1, '-1 If not a tool changer, otherwise tool number to use'),
-        'nozzle_diameter': (0.4, 'Diameter of nozzle in mm')
-    },
-    'filament_settings': {
-        'first_layer_extruder_temp': (220, 'Extruder temperature in C for first layer'),
-        'other_layer_extruder_temp': (210, 'Extruder temperature'),
-        'first_layer_bed_temp': (60, 'Bed temperature in C for first layer'),
-        'other_layer_bed_temp': (60, 'Bed temperature in C'),
-        'filament_diameter': (1.75, 'Diameter of filament in mm')
-    },
-    'extrusion_settings': {
-        'first_layer_extrusion_multiplier': (2.0, 'Extrusion multiplier for first layer'),
-        'other_layer_extrusion_multiplier': (1.0, 'Extrusion multiplier'),
-        'first_layer_height': (0.35, 'First layer height in mm'),
-        'other_layer_height': (0.2, 'Layer height in mm')
-    },
-    'speed_settings': {
-        'travel_speed': (200, 'Travel speed in mm/s'),
-        'first_layer_speed': (15, 'First layer speed in mm/s'),
-        'slow_speed': (15, 'Slowest print move during calibration in mm/s'),
-        'fast_speed': (100, 'Fastest print move during calibration in mm/s')
-    },
-    'object_settings': {
-        'width': (100, 'Object width in mm'),
-        'height': (15, 'Object height in mm')
-    },
-    'pressure_advance_settings': {
-        'start': (0.0, 'Pressure advance starting value'),
-        'finish': (0.3, 'Pressure advance final value')
-    },
-    'start_gcode_default':
-        'G90 ; set absolute coordinates\n'
-        'M82 ; set absolute extruder moves\n'
-        'M106 S0 ; turn off part cooling fan\n'
-        'M140 S[filament_settings.first_layer_bed_temp] ; set bed temp\n'
-        'M190 S[filament_settings.first_layer_bed_temp] ; wait for bed temp\n'
-        'M104 S[filament_settings.first_layer_extruder_temp] ; set extruder temp\n'
-        'M109 S[filament_settings.first_layer_extruder_temp] ; wait for extruder temp\n'
-        'G28 [printer_settings.homing_axes]\n'
-        'T[tool_index] ; omitted if tool_index = -1\n',
-    'end_gcode_default':
-        'M140 S0 ; turn off bed\n'
-        'M104 S0 ; turn off extruder\n'
-        'T-1 ; omitted if tool_index = -1\n'
-        'G91 G1 Z5 F3000 ; move extruder up 5\n'
-        'G1 X0 Y0 F3000\n'
-}
+from cache import GCodeCache
+from gcode_generator import GCodeGenerator, GenerationCancelled
+from pa_detect import detect_pa, load_pa_map, read_image
+from preview import preview_segments
+from settings import Settings, field_types, parse_text
+from toolpath import band_pressure_advance, build_toolpath
 
 
 # https://www.daniweb.com/programming/software-development/code/484591/a-tooltip-class-for-tkinter
@@ -93,6 +47,11 @@ class Window:
         # load settings
         self.settings = self.load_settings()
         self.settings_entries = {}
+        self.gcode_cache = GCodeCache()
+        self.generation_thread = None
+        self.generation_cancel = threading.Event()
+        self.generation_events = queue.Queue()
+        self.preview_pending = None
 
         # create window
         self.root = tk.Tk()
@@ -127,6 +86,7 @@ class Window:
                     entry = self.settings_entries[setting_group][setting][1]
                     entry.insert(tk.END, str(self.settings[setting_group][setting][0]))
                     entry.grid(row=i, column=1)
+                    entry.bind('<KeyRelease>', self.schedule_preview)
                     CreateToolTip(label, text=f'{setting_group}.{setting}')
                     CreateToolTip(entry, text=self.settings[setting_group][setting][1])
                     i += 1
@@ -158,6 +118,23 @@ class Window:
         self.gcode_frame.grid_columnconfigure(0, weight=1)
         self.gcode_frame.grid(row=0, column=1, rowspan=2, sticky=tk.NSEW, padx=10, pady=10)
 
+        # toolpath preview
+        self.preview_frame = tk.Frame(self.root, highlightthickness=1, highlightcolor='black',
+                                      highlightbackground='black')
+        tk.Label(self.preview_frame, text='Preview (front)').grid(row=0, column=0, sticky=tk.W)
+        self.preview_color = tk.StringVar(value='pa')
+        tk.Radiobutton(self.preview_frame, text='PA', variable=self.preview_color, value='pa',
+                       command=self.schedule_preview).grid(row=0, column=1)
+        tk.Radiobutton(self.preview_frame, text='Speed', variable=self.preview_color, value='speed',
+                       command=self.schedule_preview).grid(row=0, column=2)
+        self.preview_canvas = tk.Canvas(self.preview_frame, width=400, background='white', highlightthickness=0)
+        self.preview_canvas.grid(row=1, column=0, columnspan=3, sticky=tk.NSEW)
+        self.preview_canvas.bind('<Configure>', self.schedule_preview)
+
+        self.preview_frame.grid_rowconfigure(1, weight=1)
+        self.preview_frame.grid_columnconfigure(0, weight=1)
+        self.preview_frame.grid(row=0, column=2, rowspan=2, sticky=tk.NSEW, padx=10, pady=10)
+
         # pa calculator
         self.pressure_advance_assist = tk.Frame(self.root, highlightthickness=1, highlightcolor='black',
                                                 highlightbackground='black')
@@ -169,14 +146,21 @@ class Window:
         self.height_entry = tk.Entry(self.pressure_advance_assist)
         self.height_entry.grid(row=2, column=1, sticky=tk.NSEW)
 
-        tk.Label(self.pressure_advance_assist, text='PA Value: ').grid(row=3, column=0, sticky=tk.NSEW)
+        tk.Label(self.pressure_advance_assist, text='Band (1 at +X):').grid(row=3, column=0, sticky=tk.NSEW)
+        self.band_entry = tk.Entry(self.pressure_advance_assist)
+        self.band_entry.insert(tk.END, '1')
+        self.band_entry.grid(row=3, column=1, sticky=tk.NSEW)
+
+        tk.Label(self.pressure_advance_assist, text='PA Value: ').grid(row=4, column=0, sticky=tk.NSEW)
         self.pa_entry = tk.Entry(self.pressure_advance_assist)
-        self.pa_entry.grid(row=3, column=1, sticky=tk.NSEW)
+        self.pa_entry.grid(row=4, column=1, sticky=tk.NSEW)
 
         tk.Button(self.pressure_advance_assist, text='Calculate', command=self.calculate_pa_from_height)\
-            .grid(row=5, column=0, columnspan=2, sticky=tk.NSEW)
+            .grid(row=6, column=0, columnspan=2, sticky=tk.NSEW)
+        tk.Button(self.pressure_advance_assist, text='From Photo', command=self.calculate_pa_from_photo)\
+            .grid(row=7, column=0, columnspan=2, sticky=tk.NSEW)
 
-        self.pressure_advance_assist.grid_rowconfigure(4, weight=1)
+        self.pressure_advance_assist.grid_rowconfigure(5, weight=1)
         self.pressure_advance_assist.grid_columnconfigure(0, weight=1)
         self.pressure_advance_assist.grid(row=1, column=0, stick=tk.NSEW, padx=10, pady=10)
 
@@ -187,35 +171,127 @@ class Window:
         self.save_settings_button.grid(row=0, column=0, sticky=tk.NSEW)
 
         self.generate_gcode_button = tk.Button(self.actions_frame, text='Generate GCode',
-                                               command=lambda: GCodeGenerator.generate(self))
+                                               command=self.start_generation)
         self.generate_gcode_button.grid(row=0, column=1, sticky=tk.NSEW)
 
+        self.cancel_button = tk.Button(self.actions_frame, text='Cancel', state=tk.DISABLED,
+                                       command=self.generation_cancel.set)
+        self.cancel_button.grid(row=0, column=2, sticky=tk.NSEW)
+
+        self.progress_bar = ttk.Progressbar(self.actions_frame, mode='determinate')
+        self.progress_bar.grid(row=1, column=0, columnspan=2, sticky=tk.NSEW)
+        self.status_label = tk.Label(self.actions_frame, text='', anchor=tk.W)
+        self.status_label.grid(row=1, column=2, sticky=tk.NSEW)
+
         self.actions_frame.grid_columnconfigure((0, 1), weight=1)
-        self.actions_frame.grid(row=2, column=0, columnspan=2, sticky=tk.EW, padx=10, pady=10)
+        self.actions_frame.grid(row=2, column=0, columnspan=3, sticky=tk.EW, padx=10, pady=10)
 
         # show window
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
         self.root.mainloop()
 
+    def close(self):
+        self.generation_cancel.set()
+        self.root.destroy()
+
+    def schedule_preview(self, event=None):
+        # redraw once typing pauses instead of on every key
+        if self.preview_pending is not None:
+            self.root.after_cancel(self.preview_pending)
+        self.preview_pending = self.root.after(150, self.draw_preview)
+
+    def draw_preview(self):
+        self.preview_pending = None
+        canvas = self.preview_canvas
+        canvas.delete('all')
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        self.update_settings()
+        try:
+            toolpath = build_toolpath(self.settings)
+        except (ArithmeticError, KeyError, TypeError, ValueError) as error:
+            canvas.create_text(width // 2, height // 2, text=f'No preview: {error}', width=width - 20)
+            return
+        for x0, y0, x1, y1, color in preview_segments(toolpath, width, height, self.preview_color.get()):
+            canvas.create_line(x0, y0, x1, y1, fill=color)
+        canvas.create_text(width - 10, 10, anchor=tk.NE,
+                           text=f'{toolpath.layer_count} layers, {toolpath.move_count} moves')
+
+    def start_generation(self, output_path='pa_test.gcode'):
+        # the worker gets its own copy of the settings, edits made while it runs apply to the next run
+        if self.generation_thread is not None and self.generation_thread.is_alive():
+            return
+        self.update_settings()
+        settings = copy.deepcopy(self.settings)
+        self.generation_cancel.clear()
+        self.generate_gcode_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress_bar.config(value=0, maximum=1)
+        self.status_label.config(text='Generating')
+        self.generation_thread = threading.Thread(target=self.run_generation, args=(settings, output_path),
+                                                  daemon=True)
+        self.generation_thread.start()
+        self.root.after(50, self.poll_generation)
+
+    def run_generation(self, settings, output_path):
+        # worker thread, talks to the window only through generation_events
+        def on_layer(done, total):
+            if self.generation_cancel.is_set():
+                raise GenerationCancelled()
+            self.generation_events.put(('progress', done, total))
+
+        start = time.perf_counter()
+        try:
+            GCodeGenerator.generate_to_file(settings, output_path, self.gcode_cache, on_layer,
+                                            pa_map_path=os.path.splitext(output_path)[0] + '.pa.json')
+            self.generation_events.put(('done', output_path, time.perf_counter() - start))
+        except GenerationCancelled:
+            self.generation_events.put(('cancelled',))
+        except Exception as error:
+            self.generation_events.put(('error', f'{type(error).__name__}: {error}'))
+
+    def poll_generation(self):
+        finished = False
+        while True:
+            try:
+                event = self.generation_events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == 'progress':
+                self.progress_bar.config(value=event[1], maximum=event[2])
+                self.status_label.config(text=f'Layer {event[1]}/{event[2]}')
+                continue
+            finished = True
+            if event[0] == 'done':
+                self.progress_bar.config(value=1, maximum=1)
+                self.status_label.config(text=f'Wrote {event[1]} in {event[2]:.2f} s')
+            elif event[0] == 'cancelled':
+                self.progress_bar.config(value=0)
+                self.status_label.config(text='Cancelled')
+            else:
+                self.status_label.config(text=event[1])
+        if finished:
+            self.generate_gcode_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+        else:
+            self.root.after(50, self.poll_generation)
+
     @staticmethod
     def load_settings():
+        # settings added since the file was saved show up with their defaults
         with open('settings.json', 'r') as json_file:
-            settings = json.load(json_file)
+            settings = Settings.from_dict(json.load(json_file), check=False).to_dict()
         return settings
 
     def update_settings(self):
+        # entries are parsed by the type of their setting, text that is not a valid value is kept so validation can
+        # point at it
+        types = field_types()
         for setting_group in self.settings.keys():
             if setting_group not in ('start_gcode_default', 'end_gcode_default'):
                 for setting in self.settings[setting_group].keys():
-                    try:
-                        self.settings[setting_group][setting][0] = int(
-                            self.settings_entries[setting_group][setting][1].get())
-                    except ValueError:
-                        try:
-                            self.settings[setting_group][setting][0] = float(
-                                self.settings_entries[setting_group][setting][1].get())
-                        except ValueError:
-                            self.settings[setting_group][setting][0] = \
-                                self.settings_entries[setting_group][setting][1].get()
+                    self.settings[setting_group][setting][0] = parse_text(
+                        self.settings_entries[setting_group][setting][1].get(),
+                        types.get(setting_group, {}).get(setting, float))
             else:
                 self.settings[setting_group] = str(self.settings_entries[setting_group].get('1.0', 'end-1c'))
 
@@ -230,159 +306,34 @@ class Window:
             height = float(height)
         except ValueError:
             height = -1
-        pa = self.settings['pressure_advance_settings']['start'][0] + \
-            (self.settings['pressure_advance_settings']['finish'][0] -
-             self.settings['pressure_advance_settings']['start'][0]) * \
-            (height / self.settings['object_settings']['height'][0])
-        pa = round(pa, 4)
+        try:
+            band = int(self.band_entry.get())
+        except ValueError:
+            band = 1
+        try:
+            pa = round(band_pressure_advance(self.settings, height, band), 4)
+        except ValueError as error:
+            pa = str(error)
         self.pa_entry.delete(0, tk.END)
         self.pa_entry.insert(tk.END, pa)
 
-
-class GCodeGenerator:
-    x = 0.0
-    y = 0.0
-    e = 0.0
-    z = 0.0
-    current_layer_height = 0.0
-    current_layer_nr = 0
-
-    @staticmethod
-    def generate(window):
-        window.update_settings()
-        settings = window.settings
-
-        file = open('pa_test.gcode', 'w')
-
-        # write start gcode to file
-        file.write('; --------------------\n')
-        file.write(';     gcode header    \n')
-        file.write('; --------------------\n')
-        for line in settings['start_gcode_default'].split('\n'):
-            new_line = GCodeGenerator.process_line(line, settings)
-            file.write(new_line)
-        file.write('\n')
-
-        # generate model footer
-        file.write('; --------------------\n')
-        file.write(';    gcode generated  \n')
-        file.write(';      model base     \n')
-        file.write('; --------------------\n')
-
-        object_width = settings['object_settings']['width'][0]
-        extrusion_width = settings['printer_settings']['nozzle_diameter'][0]
-
-        for z in range(3):
-            file.write(f'\n; -> layer nr={z+1}\n')
-            file.write(GCodeGenerator.next_layer(window.settings))
-            file.write(GCodeGenerator.move(-object_width / 2, 0, 'travel_speed', window.settings))
-            file.write(GCodeGenerator.move(object_width / 2, 0, 'first_layer_speed', window.settings, extrude=True))
-            for i in range(1, 10):
-                file.write(GCodeGenerator.move(object_width / 2 + extrusion_width * i, -extrusion_width * i,
-                                               'first_layer_speed', window.settings, extrude=True))
-                file.write(GCodeGenerator.move(object_width / 2 + extrusion_width * i, extrusion_width * i,
-                                               'first_layer_speed', window.settings, extrude=True))
-                file.write(GCodeGenerator.move(-object_width / 2 - extrusion_width * i, extrusion_width * i,
-                                               'first_layer_speed', window.settings, extrude=True))
-                file.write(GCodeGenerator.move(-object_width / 2 - extrusion_width * i, -extrusion_width * i,
-                                               'first_layer_speed', window.settings, extrude=True))
-        file.write('\n')
-
-        # generate model test area
-        file.write('; --------------------\n')
-        file.write(';    gcode generated  \n')
-        file.write(';       model top     \n')
-        file.write('; --------------------\n')
-
-        layer_count = int(settings['object_settings']['height'][0] /
-                          settings['extrusion_settings']['other_layer_height'][0])
-        for z in range(layer_count):
-            file.write(f'\n; -> layer nr={z+4}\n')
-            file.write(GCodeGenerator.next_layer(settings))
-            pa_value = (settings['pressure_advance_settings']['finish'][0] -
-                        settings['pressure_advance_settings']['start'][0]) * z / (layer_count - 1)
-            file.write(f'M572 D{settings["printer_settings"]["tool_index"][0]} S{round(pa_value, 4)}\n')
-            file.write(
-                GCodeGenerator.move(object_width / 2, extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-            file.write(
-                GCodeGenerator.move(object_width / 4, extrusion_width / 2, 'fast_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(0, extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                -object_width / 4, extrusion_width / 2, 'fast_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                -object_width / 2, extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                -object_width / 2, -extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                -object_width / 4, -extrusion_width / 2, 'fast_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(0, -extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                object_width / 4, -extrusion_width / 2, 'fast_speed', window.settings, extrude=True))
-            file.write(GCodeGenerator.move(
-                object_width / 2, -extrusion_width / 2, 'slow_speed', window.settings, extrude=True))
-
-        file.write('\n')
-
-        # write end gcode to file
-        file.write('; --------------------\n')
-        file.write(';     gcode footer    \n')
-        file.write('; --------------------\n')
-        for line in settings['end_gcode_default'].split('\n'):
-            new_line = GCodeGenerator.process_line(line, settings)
-            file.write(new_line)
-
-        file.close()
-
-    @staticmethod
-    def process_line(line, settings):
-        new_line = ''
-        for word in line.split(' '):
-            if word.find('[') != -1 and word.find(']') != -1:
-                settings_key = word[word.find('[')+1:word.find(']')]
-                setting_value = settings
-                for level in settings_key.split('.'):
-                    setting_value = setting_value[level]
-                setting_value = setting_value[0]
-
-                new_line += f'{word[:word.find("[")]}{setting_value}{word[word.find("]")+1:]} '
-            else:
-                new_line += f'{word} '
-        new_line = f'{new_line}\n'
-        return new_line
-
-    @staticmethod
-    def move(x, y, feedrate, settings, extrude=False):
-        x += (settings['printer_settings']['bed_max_x'][0] - settings['printer_settings']['bed_min_x'][0]) / 2
-        y += (settings['printer_settings']['bed_max_y'][0] - settings['printer_settings']['bed_min_y'][0]) / 2
-        if type(feedrate) is str:
-            feedrate = settings['speed_settings'][feedrate][0]
-        if extrude:
-            extrusion_length = (math.sqrt(math.pow(GCodeGenerator.x - x, 2) + math.pow(GCodeGenerator.y - y, 2)) *
-                                settings['printer_settings']['nozzle_diameter'][0] *
-                                GCodeGenerator.current_layer_height) / \
-                               (math.pow(settings['filament_settings']['filament_diameter'][0], 2) *
-                                math.pi * 0.25)
-            extrusion_length *= settings['extrusion_settings']['first_layer_extrusion_multiplier'][0] if \
-                GCodeGenerator.current_layer_nr == 1 else \
-                settings['extrusion_settings']['other_layer_extrusion_multiplier'][0]
-            GCodeGenerator.x = x
-            GCodeGenerator.y = y
-            GCodeGenerator.e += extrusion_length
-            return f'G1 X{round(x, 4)} Y{round(y, 4)} E{round(GCodeGenerator.e, 4)} F{feedrate*60}\n'
-        else:
-            GCodeGenerator.x = x
-            GCodeGenerator.y = y
-            return f'G1 X{round(x, 4)} Y{round(y, 4)} F{feedrate*60}\n'
-
-    @staticmethod
-    def next_layer(settings):
-        GCodeGenerator.e = 0
-        GCodeGenerator.current_layer_nr += 1
-        GCodeGenerator.current_layer_height = settings['extrusion_settings']['first_layer_height'][0] if \
-            GCodeGenerator.current_layer_nr == 1 else settings['extrusion_settings']['other_layer_height'][0]
-        GCodeGenerator.z += GCodeGenerator.current_layer_height
-        return f'G92 E0\nG1 Z{round(GCodeGenerator.z, 4)} F{6000}\n'
+    def calculate_pa_from_photo(self, map_path='pa_test.pa.json'):
+        # photo of the printed tower from the front, the layer map is written next to the gcode when it is generated
+        photo_path = filedialog.askopenfilename(title='Photo of the tower', filetypes=[
+            ('Images', '*.png *.pgm *.ppm'), ('All files', '*')])
+        if not photo_path:
+            return
+        try:
+            result = detect_pa(read_image(photo_path), load_pa_map(map_path))
+        except (OSError, ValueError) as error:
+            self.status_label.config(text=f'{type(error).__name__}: {error}')
+            return
+        for entry, value in ((self.height_entry, round(result['height'], 2)), (self.band_entry, result['band']),
+                             (self.pa_entry, round(result['pa'], 4))):
+            entry.delete(0, tk.END)
+            entry.insert(tk.END, value)
+        self.status_label.config(text=' '.join([f'Confidence {result["confidence"]:.2f}'] + result['warnings']))
 
 
 if __name__ == '__main__':
-    Window(985, 925, 'PA Generator')
+    Window(1405, 950, 'PA Generator')
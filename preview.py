@@ -0,0 +1,91 @@
+import math
+
+import numpy as np
+
+from toolpath import FAST, FIRST_LAYER, SLOW, TRAVEL
+
+
+BASE_COLOR = '#9a9a9a'
+SPEED_COLORS = {FIRST_LAYER: '#9a9a9a', SLOW: '#2060d0', FAST: '#e03020'}
+# low to high pressure advance
+PA_RAMP = ((0.13, 0.33, 0.85), (0.15, 0.7, 0.3), (0.95, 0.75, 0.1), (0.85, 0.15, 0.1))
+PA_STEPS = 32
+
+
+def ramp_color(fraction):
+    position = min(max(fraction, 0.0), 1.0) * (len(PA_RAMP) - 1)
+    low = min(int(position), len(PA_RAMP) - 2)
+    weight = position - low
+    red, green, blue = (a + (b - a) * weight for a, b in zip(PA_RAMP[low], PA_RAMP[low + 1]))
+    return f'#{int(red * 255):02x}{int(green * 255):02x}{int(blue * 255):02x}'
+
+
+def move_colors(toolpath, moves, layers, color_by):
+    # colour table and the colour index of the given moves, by pressure advance step or by speed
+    if color_by == 'speed':
+        palette = [SPEED_COLORS.get(speed, BASE_COLOR) for speed in range(max(SPEED_COLORS) + 1)]
+        return palette, toolpath.speed[moves].astype(np.intp)
+
+    palette = [BASE_COLOR] + [ramp_color(step / (PA_STEPS - 1)) for step in range(PA_STEPS)]
+    pa = toolpath.band_pa[layers, toolpath.band[moves]]
+    test = ~np.isnan(pa)
+    colors = np.zeros(len(pa), dtype=np.intp)
+    tested = toolpath.band_pa[toolpath.base_layer_count:]
+    if test.any():
+        low, high = np.min(tested), np.max(tested)
+        steps = np.round((pa[test] - low) / (high - low) * (PA_STEPS - 1)) if high > low else 0
+        colors[test] = 1 + np.asarray(steps, dtype=np.intp)
+    return palette, colors
+
+
+def preview_segments(toolpath, width, height, color_by='pa', margin=10, max_segments=6000):
+    # front view of the extruding moves as (x0, y0, x1, y1, colour) canvas lines, x across and z up, each axis
+    # stretched to fill the canvas; at most one layer per pixel row is drawn and runs of the same colour are merged
+    # per pixel, so the line count depends on the canvas size and not on the layer count. Lines are ordered back to
+    # front, the pass nearest the viewer is drawn last
+    move_layer = np.repeat(np.arange(toolpath.layer_count), np.diff(toolpath.layer_offsets))
+    extruding = np.flatnonzero(toolpath.speed != TRAVEL)
+    extruding = extruding[extruding > 0]
+    if len(extruding) == 0 or width <= 2 * margin or height <= 2 * margin:
+        return []
+
+    start_x = toolpath.x[extruding - 1]
+    end_x = toolpath.x[extruding]
+    low_x = min(start_x.min(), end_x.min())
+    span_x = max(max(start_x.max(), end_x.max()) - low_x, 1e-9)
+    top_z = float(toolpath.layer_z[-1])
+    scale_x = (width - 2 * margin) / span_x
+    scale_z = (height - 2 * margin) / max(top_z, 1e-9)
+
+    # the highest layer of every pixel row
+    layer_rows = np.round(height - margin - toolpath.layer_z * scale_z).astype(np.intp)
+    step = 1
+    while True:
+        rows = layer_rows // step * step
+        _, last = np.unique(rows[::-1], return_index=True)
+        shown = np.zeros(toolpath.layer_count, dtype=bool)
+        shown[toolpath.layer_count - 1 - last] = True
+
+        moves = extruding[shown[move_layer[extruding]]]
+        palette, color = move_colors(toolpath, moves, move_layer[moves], color_by)
+        x0 = np.round(margin + (toolpath.x[moves - 1] - low_x) * scale_x).astype(np.intp)
+        x1 = np.round(margin + (toolpath.x[moves] - low_x) * scale_x).astype(np.intp)
+        row = rows[move_layer[moves]]
+        # depth in 1/1000 mm, larger is further from the viewer
+        depth = np.round(toolpath.y[moves] * 1000).astype(np.intp)
+
+        # merge consecutive moves of one layer, pass and colour that continue each other
+        breaks = np.flatnonzero((np.diff(row) != 0) | (np.diff(depth) != 0) | (np.diff(color) != 0) |
+                                (x0[1:] != x1[:-1])) + 1
+        starts = np.concatenate(([0], breaks))
+        left = np.minimum.reduceat(np.minimum(x0, x1), starts)
+        right = np.maximum.reduceat(np.maximum(x0, x1), starts)
+        segments = np.unique(np.stack((-depth[starts], row[starts], left, right, color[starts]), 1), axis=0)
+        if len(segments) <= max_segments:
+            break
+        step *= math.ceil(len(segments) / max_segments)
+
+    # a one pixel segment is still drawn
+    right = np.maximum(segments[:, 3], segments[:, 2] + 1)
+    return [(int(a), int(row), int(b), int(row), palette[c])
+            for row, a, b, c in zip(segments[:, 1], segments[:, 2], right, segments[:, 4])]
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import random
+import re
+import select
+import termios
+import threading
+import time
+import tty
+
+from gcode_generator import GCodeGenerator
+
+
+RESEND = re.compile(rb'(?:resend|rs)[: ]\s*N?(\d+)', re.IGNORECASE)
+LINE = re.compile(rb'^N(-?\d+) (.*)\*(\d+)$')
+
+
+def checksum(data):
+    # reprap checksum, xor of every byte of 'N<nr> <command>'
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
+def numbered_line(number, command):
+    line = f'N{number} {command}'.encode()
+    return line + f'*{checksum(line)}\n'.encode()
+
+
+def iter_commands(chunks):
+    # printable commands of a chunk stream, without comments and blank lines
+    for chunk in chunks:
+        for line in chunk.split('\n'):
+            command = line.split(';', 1)[0].strip()
+            if command:
+                yield command
+
+
+class SerialPort:
+    # raw posix tty, enough for usb serial adapters and pseudo terminals
+    def __init__(self, path, baudrate=115200):
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attributes = termios.tcgetattr(self.fd)
+        speed = getattr(termios, f'B{baudrate}', None)
+        if speed is not None:
+            attributes[4] = attributes[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attributes)
+        self.buffer = b''
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def readline(self, timeout=None):
+        # one line without the line ending, None on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b'\n' not in self.buffer:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return None
+            data = os.read(self.fd, 4096)
+            if not data:
+                raise EOFError('serial port closed')
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.rstrip(b'\r')
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SerialSender:
+    # sends numbered, checksummed lines and keeps up to window of them unacknowledged in the printer buffer,
+    # the printer answers every received line with exactly one ok, resend requests rewind to the requested line
+    def __init__(self, port, window=4, timeout=10.0, history_size=1024):
+        self.port = port
+        self.window = window
+        self.timeout = timeout
+        self.history_size = history_size
+        self.stats = {}
+
+    def send_settings(self, settings, on_progress=None):
+        # streams the tower straight from the generator, lines go out while later layers are still generated
+        return self.send(GCodeGenerator.iter_chunks(settings), on_progress)
+
+    def send(self, chunks, on_progress=None):
+        commands = iter_commands(chunks)
+        history = {}
+        next_number = 0
+        highest_number = -1
+        in_flight = 0
+        ignore_resends = 0
+        resend_target = None
+        occupancy_total = 0
+        sent = 0
+        resends = 0
+        exhausted = False
+        start = time.perf_counter()
+        self.stats = {'lines': 0, 'sent': 0, 'resends': 0, 'seconds': 0.0, 'lines_per_second': 0.0,
+                      'max_buffer': 0, 'mean_buffer': 0.0}
+
+        while True:
+            # keep the printer buffer full
+            while in_flight < self.window:
+                if next_number > highest_number:
+                    if exhausted:
+                        break
+                    command = 'M110 N0' if next_number == 0 else next(commands, None)
+                    if command is None:
+                        exhausted = True
+                        break
+                    history[next_number] = numbered_line(next_number, command)
+                    history.pop(next_number - self.history_size, None)
+                    highest_number = next_number
+                self.port.write(history[next_number])
+                next_number += 1
+                in_flight += 1
+                sent += 1
+                occupancy_total += in_flight
+                self.stats['max_buffer'] = max(self.stats['max_buffer'], in_flight)
+            if in_flight == 0:
+                break
+
+            response = self.port.readline(self.timeout)
+            if response is None:
+                raise TimeoutError(f'printer did not answer within {self.timeout}s, {in_flight} lines unacknowledged')
+            if response.startswith(b'!!') or response.lower().startswith(b'error:printer halted'):
+                raise RuntimeError(f'printer halted: {response.decode(errors="replace")}')
+
+            resend = RESEND.search(response)
+            if resend is not None:
+                number = int(resend.group(1))
+                if ignore_resends and number == resend_target:
+                    # lines already sent behind the bad one are rejected with the same request
+                    ignore_resends -= 1
+                elif number in history and number < next_number:
+                    ignore_resends = next_number - number - 1
+                    resend_target = next_number = number
+                    resends += 1
+                else:
+                    raise RuntimeError(f'printer requested line {number} which is no longer available')
+            elif response.startswith(b'ok'):
+                in_flight -= 1
+                self.stats['lines'] = highest_number
+                if on_progress is not None:
+                    on_progress(self.stats)
+
+        elapsed = time.perf_counter() - start
+        self.stats.update({
+            'lines': highest_number, 'sent': sent, 'resends': resends, 'seconds': elapsed,
+            'lines_per_second': highest_number / elapsed if elapsed else 0.0,
+            'mean_buffer': occupancy_total / sent if sent else 0.0
+        })
+        return self.stats
+
+
+class FakePrinter:
+    # marlin style firmware on a pseudo terminal, checks numbering and checksums, corrupts a share of the
+    # received lines on purpose to exercise resends and acknowledges after command_time seconds
+    def __init__(self, error_rate=0.0, command_time=0.0, seed=0):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.error_rate = error_rate
+        self.command_time = command_time
+        self.random = random.Random(seed)
+        self.commands = []
+        self.errors = 0
+        self.last_number = -1
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def reply(self, text):
+        os.write(self.master, text.encode() + b'\n')
+
+    def handle(self, line):
+        match = LINE.match(line)
+        expected = self.last_number + 1
+        if match is None:
+            self.reply(f'Error:No Line Number with checksum, Last Line: {self.last_number}')
+        elif checksum(line[:line.rindex(b'*')]) != int(match.group(3)) or self.random.random() < self.error_rate:
+            self.errors += 1
+            self.reply(f'Error:checksum mismatch, Last Line: {self.last_number}')
+        elif match.group(2).startswith(b'M110'):
+            self.last_number = int(match.group(1))
+            self.reply('ok')
+            return
+        elif int(match.group(1)) != expected:
+            self.reply(f'Error:Line Number is not Last Line Number+1, Last Line: {self.last_number}')
+        else:
+            self.last_number = expected
+            self.commands.append(match.group(2).decode())
+            if self.command_time:
+                time.sleep(self.command_time)
+            self.reply('ok')
+            return
+        self.reply(f'Resend: {expected}')
+        self.reply('ok')
+
+    def run(self):
+        buffer = b''
+        while self.running:
+            if not select.select([self.master], [], [], 0.05)[0]:
+                continue
+            try:
+                buffer += os.read(self.master, 4096)
+            except OSError:
+                break
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self.handle(line.rstrip(b'\r'))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a pressure advance tower and stream it to a printer')
+    parser.add_argument('port', nargs='?', help='serial device, e.g. /dev/ttyACM0')
+    parser.add_argument('--settings', default='settings.json', help='settings json file')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--window', type=int, default=4, help='unacknowledged lines kept in the printer buffer')
+    parser.add_argument('--fake', action='store_true', help='stream to a simulated printer instead of a port')
+    args = parser.parse_args()
+    if args.port is None and not args.fake:
+        parser.error('a port or --fake is required')
+
+    with open(args.settings, 'r') as json_file:
+        tower_settings = json.load(json_file)
+    fake_printer = FakePrinter(error_rate=0.01) if args.fake else None
+    serial_port = SerialPort(fake_printer.path if args.fake else args.port, args.baud)
+    try:
+        print(json.dumps(SerialSender(serial_port, args.window).send_settings(tower_settings), indent=4))
+    finally:
+        serial_port.close()
+        if fake_printer is not None:
+            fake_printer.close()
@@ -0,0 +1,259 @@
+from dataclasses import dataclass, field, fields
+import math
+
+
+class SettingsError(ValueError):
+    def __init__(self, problems):
+        # problems is a list of ('group.name', message)
+        self.problems = problems
+        super().__init__('invalid settings: ' + ', '.join(f'{key} {message}' for key, message in problems))
+
+
+def setting(default, description, unit='', minimum=None, above=None):
+    # a settings field, minimum is inclusive and above exclusive
+    return field(default=default, metadata={'description': description, 'unit': unit, 'minimum': minimum,
+                                            'above': above})
+
+
+@dataclass(slots=True)
+class PrinterSettings:
+    bed_min_x: float = setting(0, 'Bed minimum x in mm, usually 0', 'mm')
+    bed_max_x: float = setting(300, 'Bed maximum x in mm, usually width of bed', 'mm')
+    bed_min_y: float = setting(0, 'Bed minimum y in mm, usually 0', 'mm')
+    bed_max_y: float = setting(300, 'Bed maximum x in mm, usually depth of bed', 'mm')
+    bed_max_z: float = setting(300, 'Bed maximum z in mm', 'mm')
+    homing_axes: str = setting('X Y Z U', 'Axes to home')
+    tool_index: int = setting(-1, '-1 If not a tool changer, otherwise tool number to use', minimum=-1)
+    nozzle_diameter: float = setting(0.4, 'Diameter of nozzle in mm', 'mm', above=0)
+    # profiles saved before this setting existed have no limit, the shipped settings.json sets one
+    max_volumetric_flow: float = setting(0, 'Most plastic the hotend can melt in mm^3/s, 0 skips the check', 'mm^3/s',
+                                         minimum=0)
+
+
+@dataclass(slots=True)
+class FilamentSettings:
+    first_layer_extruder_temp: float = setting(220, 'Extruder temperature in C for first layer', 'C', minimum=0)
+    other_layer_extruder_temp: float = setting(210, 'Extruder temperature', 'C', minimum=0)
+    first_layer_bed_temp: float = setting(60, 'Bed temperature in C for first layer', 'C', minimum=0)
+    other_layer_bed_temp: float = setting(60, 'Bed temperature in C', 'C', minimum=0)
+    filament_diameter: float = setting(1.75, 'Diameter of filament in mm', 'mm', above=0)
+
+
+@dataclass(slots=True)
+class ExtrusionSettings:
+    first_layer_extrusion_multiplier: float = setting(2.0, 'Extrusion multiplier for first layer', minimum=0)
+    other_layer_extrusion_multiplier: float = setting(1.0, 'Extrusion multiplier', minimum=0)
+    first_layer_height: float = setting(0.35, 'First layer height in mm', 'mm', above=0)
+    other_layer_height: float = setting(0.2, 'Layer height in mm', 'mm', above=0)
+
+
+@dataclass(slots=True)
+class SpeedSettings:
+    travel_speed: float = setting(200, 'Travel speed in mm/s', 'mm/s', above=0)
+    first_layer_speed: float = setting(15, 'First layer speed in mm/s', 'mm/s', above=0)
+    slow_speed: float = setting(15, 'Slowest print move during calibration in mm/s', 'mm/s', above=0)
+    fast_speed: float = setting(100, 'Fastest print move during calibration in mm/s', 'mm/s', above=0)
+
+
+@dataclass(slots=True)
+class ObjectSettings:
+    width: float = setting(100, 'Object width in mm', 'mm', above=0)
+    height: float = setting(15, 'Object height in mm', 'mm', minimum=0)
+
+
+@dataclass(slots=True)
+class PressureAdvanceSettings:
+    start: float = setting(0.0, 'Pressure advance starting value', 's', minimum=0)
+    finish: float = setting(0.3, 'Pressure advance final value', 's', minimum=0)
+    bands: int = setting(1, 'Pressure advance values per layer, each printed in its own band along x', minimum=1)
+
+
+GROUPS = (
+    ('printer_settings', PrinterSettings),
+    ('filament_settings', FilamentSettings),
+    ('extrusion_settings', ExtrusionSettings),
+    ('speed_settings', SpeedSettings),
+    ('object_settings', ObjectSettings),
+    ('pressure_advance_settings', PressureAdvanceSettings)
+)
+TEMPLATE_KEYS = ('start_gcode_default', 'end_gcode_default')
+
+DEFAULT_START_GCODE = \
+    'G90 ; set absolute coordinates\n' \
+    'M82 ; set absolute extruder moves\n' \
+    'M106 S0 ; turn off part cooling fan\n' \
+    'M140 S[filament_settings.first_layer_bed_temp] ; set bed temp\n' \
+    'M190 S[filament_settings.first_layer_bed_temp] ; wait for bed temp\n' \
+    'M104 S[filament_settings.first_layer_extruder_temp] ; set extruder temp\n' \
+    'M109 S[filament_settings.first_layer_extruder_temp] ; wait for extruder temp\n' \
+    'G28 [printer_settings.homing_axes]\n' \
+    'T[tool_index] ; omitted if tool_index = -1\n'
+DEFAULT_END_GCODE = \
+    'M140 S0 ; turn off bed\n' \
+    'M104 S0 ; turn off extruder\n' \
+    'T-1 ; omitted if tool_index = -1\n' \
+    'G91 G1 Z5 F3000 ; move extruder up 5\n' \
+    'G1 X0 Y0 F3000\n'
+
+
+@dataclass(slots=True)
+class Derived:
+    # values the toolpath needs, worked out once per generation
+    bed_center_x: float  # mm
+    bed_center_y: float  # mm
+    extrusion_width: float  # mm
+    filament_area: float  # mm^2
+    first_layer_e_per_mm: float  # mm of filament per mm of first layer line
+    other_layer_e_per_mm: float  # mm of filament per mm of line
+    feedrates: tuple  # mm/s of travel, first layer, slow and fast moves
+    test_area_layer_count: int
+    bands: int
+
+
+@dataclass(slots=True)
+class Settings:
+    printer_settings: PrinterSettings = field(default_factory=PrinterSettings)
+    filament_settings: FilamentSettings = field(default_factory=FilamentSettings)
+    extrusion_settings: ExtrusionSettings = field(default_factory=ExtrusionSettings)
+    speed_settings: SpeedSettings = field(default_factory=SpeedSettings)
+    object_settings: ObjectSettings = field(default_factory=ObjectSettings)
+    pressure_advance_settings: PressureAdvanceSettings = field(default_factory=PressureAdvanceSettings)
+    start_gcode_default: str = DEFAULT_START_GCODE
+    end_gcode_default: str = DEFAULT_END_GCODE
+    # description of every 'group.name' as found in the loaded file, written back on save
+    descriptions: dict = field(default_factory=dict)
+
+    @staticmethod
+    def from_dict(values, check=True):
+        # from the settings.json shape, {group: {name: [value, description]}}, missing settings get their default.
+        # A value of the wrong type is kept as it is so it is written back unchanged, validate reports it
+        settings = Settings()
+        for group_name, group_class in GROUPS:
+            group = getattr(settings, group_name)
+            for setting_field in fields(group_class):
+                entry = values.get(group_name, {}).get(setting_field.name)
+                if entry is None:
+                    continue
+                value = coerce(entry[0], setting_field.type)
+                setattr(group, setting_field.name, entry[0] if value is None else value)
+                if len(entry) > 1:
+                    settings.descriptions[f'{group_name}.{setting_field.name}'] = entry[1]
+        for key in TEMPLATE_KEYS:
+            if key in values:
+                setattr(settings, key, values[key])
+        if check:
+            problems = settings.validate()
+            if problems:
+                raise SettingsError(problems)
+        return settings
+
+    def to_dict(self):
+        # the settings.json shape
+        values = {}
+        for group_name, group_class in GROUPS:
+            group = getattr(self, group_name)
+            values[group_name] = {}
+            for setting_field in fields(group_class):
+                key = f'{group_name}.{setting_field.name}'
+                values[group_name][setting_field.name] = [
+                    getattr(group, setting_field.name),
+                    self.descriptions.get(key, setting_field.metadata['description'])
+                ]
+        for key in TEMPLATE_KEYS:
+            values[key] = getattr(self, key)
+        return values
+
+    def validate(self):
+        problems = []
+        for group_name, group_class in GROUPS:
+            group = getattr(self, group_name)
+            for setting_field in fields(group_class):
+                value = getattr(group, setting_field.name)
+                key = f'{group_name}.{setting_field.name}'
+                minimum, above = setting_field.metadata['minimum'], setting_field.metadata['above']
+                if coerce(value, setting_field.type) is None:
+                    problems.append((key, f'must be {type_name(setting_field.type)}, got {value!r}'))
+                elif minimum is not None and value < minimum:
+                    problems.append((key, f'must be at least {minimum}'))
+                elif above is not None and value <= above:
+                    problems.append((key, f'must be more than {above}'))
+        printer = self.printer_settings
+        bad = {key for key, _ in problems}
+        if not bad & {'printer_settings.bed_min_x', 'printer_settings.bed_max_x'} and \
+                printer.bed_max_x <= printer.bed_min_x:
+            problems.append(('printer_settings.bed_max_x', 'must be more than bed_min_x'))
+        if not bad & {'printer_settings.bed_min_y', 'printer_settings.bed_max_y'} and \
+                printer.bed_max_y <= printer.bed_min_y:
+            problems.append(('printer_settings.bed_max_y', 'must be more than bed_min_y'))
+        return problems
+
+    def derived(self):
+        printer = self.printer_settings
+        extrusion = self.extrusion_settings
+        speed = self.speed_settings
+        filament_area = math.pow(self.filament_settings.filament_diameter, 2) * math.pi * 0.25
+        extrusion_width = printer.nozzle_diameter
+        return Derived(
+            (printer.bed_min_x + printer.bed_max_x) / 2,
+            (printer.bed_min_y + printer.bed_max_y) / 2,
+            extrusion_width,
+            filament_area,
+            extrusion_width * extrusion.first_layer_height / filament_area * extrusion.first_layer_extrusion_multiplier,
+            extrusion_width * extrusion.other_layer_height / filament_area * extrusion.other_layer_extrusion_multiplier,
+            (speed.travel_speed, speed.first_layer_speed, speed.slow_speed, speed.fast_speed),
+            int(self.object_settings.height / extrusion.other_layer_height),
+            self.pressure_advance_settings.bands
+        )
+
+
+def coerce(value, value_type):
+    # value as value_type or None, floats keep an int as written so it saves and renders the same way
+    if isinstance(value, bool):
+        return None
+    if value_type is str:
+        return value if isinstance(value, str) else None
+    if value_type is int:
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value if isinstance(value, int) else None
+    return value if isinstance(value, (int, float)) and math.isfinite(value) else None
+
+
+def parse_text(text, value_type):
+    # a value typed into the gui, numbers that do not parse are kept as text and reported by validation
+    text = text.strip() if value_type is not str else text
+    if value_type is str:
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text) if value_type is float else text
+    except ValueError:
+        return text
+
+
+def type_name(value_type):
+    return {int: 'a whole number', float: 'a number', str: 'text'}[value_type]
+
+
+def as_settings(settings):
+    # Settings from a Settings or a settings.json shaped dict
+    return settings if isinstance(settings, Settings) else Settings.from_dict(settings)
+
+
+def field_types():
+    # {group: {name: int, float or str}}
+    return {group_name: {setting_field.name: setting_field.type for setting_field in fields(group_class)}
+            for group_name, group_class in GROUPS}
+
+
+# defaults and descriptions of every setting
+settings_reference = {
+    group_name: {setting_field.name: (setting_field.default, setting_field.metadata['description'])
+                 for setting_field in fields(group_class)}
+    for group_name, group_class in GROUPS
+}
+settings_reference['start_gcode_default'] = DEFAULT_START_GCODE
+settings_reference['end_gcode_default'] = DEFAULT_END_GCODE
@@ -0,0 +1,120 @@
+import gzip
+import io
+import socket
+import sys
+
+
+class Sink:
+    # collects gcode chunks and hands them to the destination in large batched writes
+    buffer_size = 64 * 1024
+
+    def __init__(self, buffer_size=None):
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        self.bytes_written = 0
+
+    def write(self, chunk):
+        self.pending.append(chunk)
+        self.pending_size += len(chunk)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+        self.flush()
+
+    def flush(self):
+        if self.pending:
+            data = ''.join(self.pending)
+            self.pending = []
+            self.pending_size = 0
+            self.bytes_written += len(data.encode())
+            self.write_raw(data)
+
+    def write_raw(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FileSink(Sink):
+    def __init__(self, path, buffer_size=None):
+        super().__init__(buffer_size)
+        self.file = open(path, 'w')
+
+    def write_raw(self, data):
+        self.file.write(data)
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class StdoutSink(Sink):
+    def write_raw(self, data):
+        sys.stdout.write(data)
+
+    def close(self):
+        super().close()
+        sys.stdout.flush()
+
+
+class GzipSink(Sink):
+    def __init__(self, path_or_file, compresslevel=6, buffer_size=None):
+        super().__init__(buffer_size)
+        if isinstance(path_or_file, (bytes, str)) or hasattr(path_or_file, '__fspath__'):
+            self.file = gzip.open(path_or_file, 'wb', compresslevel=compresslevel)
+        else:
+            self.file = gzip.GzipFile(fileobj=path_or_file, mode='wb', compresslevel=compresslevel)
+
+    def write_raw(self, data):
+        self.file.write(data.encode())
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class SocketSink(Sink):
+    # takes a connected socket or a (host, port) address to connect to
+    def __init__(self, connection, buffer_size=None):
+        super().__init__(buffer_size)
+        self.owns_socket = not isinstance(connection, socket.socket)
+        self.socket = socket.create_connection(connection) if self.owns_socket else connection
+
+    def write_raw(self, data):
+        self.socket.sendall(data.encode())
+
+    def close(self):
+        super().close()
+        if self.owns_socket:
+            self.socket.close()
+
+
+class BufferSink(Sink):
+    def __init__(self, buffer_size=None):
+        super().__init__(buffer_size)
+        self.buffer = io.StringIO()
+
+    def write_raw(self, data):
+        self.buffer.write(data)
+
+    def getvalue(self):
+        self.flush()
+        return self.buffer.getvalue()
+
+
+class NullSink(Sink):
+    # only counts, for measuring generation without any io
+    def write_raw(self, data):
+        pass
@@ -0,0 +1,92 @@
+from functools import lru_cache
+import operator
+import re
+
+from settings import settings_reference
+
+
+PLACEHOLDER = re.compile(r'\[([^\[\]]*)\]')
+CONDITION = re.compile(r';.*\bomitted if\s+([\w.]+)\s*(==|!=|=)\s*(\S+)', re.IGNORECASE)
+COMPARISONS = {'=': operator.eq, '==': operator.eq, '!=': operator.ne}
+
+
+class TemplateError(ValueError):
+    def __init__(self, unknown_keys):
+        self.unknown_keys = unknown_keys
+        super().__init__('unknown settings in gcode template: ' +
+                         ', '.join(f'[{key}] (line {line_nr})' for key, line_nr in unknown_keys))
+
+
+class Template:
+    # a start/end gcode template parsed into format strings, rendering only has to look the settings up
+    def __init__(self, keys, lines):
+        self.keys = keys
+        self.lines = lines
+
+    def render(self, settings):
+        values = [settings[group][name][0] for group, name in self.keys]
+        rendered = []
+        for condition, line in self.lines:
+            if condition is not None:
+                key, compare, expected = condition
+                if compare(normalize(values[key]), expected):
+                    continue
+            rendered.append(line.format(*values))
+        return ''.join(rendered)
+
+
+def resolve_key(key, schema=settings_reference):
+    # 'group.name', or just 'name' when it only exists in one group
+    if '.' in key:
+        group, name = key.split('.', 1)
+        if isinstance(schema.get(group), dict) and name in schema[group]:
+            return group, name
+        return None
+    matches = [(group, key) for group, values in schema.items() if isinstance(values, dict) and key in values]
+    return matches[0] if len(matches) == 1 else None
+
+
+def normalize(value):
+    # compare numbers as numbers, so tool_index = -1 matches -1, -1.0 and '-1'
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+@lru_cache(maxsize=64)
+def compile_template(text):
+    keys = []
+    key_indices = {}
+    unknown_keys = []
+
+    def index_of(key, line_nr):
+        resolved = resolve_key(key)
+        if resolved is None:
+            unknown_keys.append((key, line_nr))
+            return 0
+        if resolved not in key_indices:
+            key_indices[resolved] = len(keys)
+            keys.append(resolved)
+        return key_indices[resolved]
+
+    lines = []
+    for line_nr, line in enumerate(text.split('\n'), 1):
+        condition = None
+        match = CONDITION.search(line)
+        if match is not None:
+            condition = (index_of(match.group(1), line_nr), COMPARISONS[match.group(2)], normalize(match.group(3)))
+
+        # literal braces are escaped, placeholders become positional fields
+        parts = []
+        position = 0
+        for placeholder in PLACEHOLDER.finditer(line):
+            parts.append(line[position:placeholder.start()].replace('{', '{{').replace('}', '}}'))
+            parts.append(f'{{{index_of(placeholder.group(1).strip(), line_nr)}}}')
+            position = placeholder.end()
+        parts.append(line[position:].replace('{', '{{').replace('}', '}}'))
+        lines.append((condition, ''.join(parts) + '\n'))
+
+    if unknown_keys:
+        raise TemplateError(unknown_keys)
+    return Template(tuple(keys), tuple(lines))
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cache
+from cache import GCodeCache
+from gcode_generator import GCodeGenerator
+from settings import Settings
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = GCodeCache(self.directory.name)
+        self.settings = Settings().to_dict()
+        self.settings['object_settings']['height'][0] = 5
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def counts(self):
+        return self.cache.hits, self.cache.partial_hits, self.cache.misses
+
+    def test_miss_then_hit(self):
+        expected = GCodeGenerator.generate_from_settings(self.settings)
+        self.assertEqual(self.cache.generate(self.settings), expected)
+        self.assertEqual(self.cache.generate(self.settings), expected)
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+    def test_writes_the_output_file(self):
+        with tempfile.TemporaryDirectory() as output_directory:
+            path = os.path.join(output_directory, 'pa_test.gcode')
+            for _ in range(2):
+                gcode = self.cache.generate(self.settings, path)
+                with open(path, 'r') as gcode_file:
+                    self.assertEqual(gcode_file.read(), gcode)
+
+    def test_template_change_reuses_the_body(self):
+        self.cache.generate(self.settings)
+        self.settings['end_gcode_default'] += 'M84\n'
+        gcode = self.cache.generate(self.settings)
+        self.assertEqual(gcode, GCodeGenerator.generate_from_settings(self.settings))
+        self.assertEqual(self.counts(), (0, 1, 1))
+
+    def test_setting_change_misses(self):
+        self.cache.generate(self.settings)
+        self.settings['pressure_advance_settings']['finish'][0] = 0.1
+        gcode = self.cache.generate(self.settings)
+        self.assertEqual(gcode, GCodeGenerator.generate_from_settings(self.settings))
+        self.assertEqual(self.counts(), (0, 0, 2))
+
+    def test_same_resolved_settings_hit(self):
+        self.cache.generate(self.settings)
+        # a missing setting is its default, an int setting written as a whole float is the same int and
+        # descriptions do not matter
+        resolved = Settings.from_dict(self.settings).to_dict()
+        del resolved['printer_settings']['max_volumetric_flow']
+        resolved['pressure_advance_settings']['bands'][0] = 1.0
+        resolved['speed_settings']['fast_speed'][1] = 'edited tooltip'
+        self.assertEqual(self.cache.generate(resolved), GCodeGenerator.generate_from_settings(resolved))
+        self.assertEqual(self.counts(), (1, 0, 1))
+
+    def test_float_written_differently_misses(self):
+        # the gcode prints a float setting as written, F6000 and F6000.0, so they are cached apart
+        self.cache.generate(self.settings)
+        self.settings['speed_settings']['fast_speed'][0] = float(self.settings['speed_settings']['fast_speed'][0])
+        self.assertEqual(self.cache.generate(self.settings), GCodeGenerator.generate_from_settings(self.settings))
+        self.assertEqual(self.counts(), (0, 0, 2))
+
+    def test_changed_generator_code_misses(self):
+        self.cache.generate(self.settings)
+        with mock.patch.object(cache, 'GENERATOR_DIGEST', 'other code'):
+            self.cache.generate(self.settings)
+        self.assertEqual(self.counts(), (0, 0, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        first = dict(self.settings, end_gcode_default='; first\n')
+        second = dict(self.settings, end_gcode_default='; second\n')
+        self.cache.generate(first)
+        size = sum(os.path.getsize(os.path.join(self.directory.name, name))
+                   for name in os.listdir(self.directory.name))
+        self.cache.generate(second)
+        # room for the shared body and both files, then first is used again and a third file pushes out second
+        self.cache.max_bytes = 2 * size
+        entries = [os.path.join(self.directory.name, name) for name in os.listdir(self.directory.name)]
+        for age, path in enumerate(sorted(entries, key=os.path.getmtime)):
+            os.utime(path, (1000 + age, 1000 + age))
+        self.cache.generate(first)
+        self.cache.generate(dict(self.settings, end_gcode_default='; third\n'))
+        self.assertEqual(self.counts(), (1, 2, 1))
+        self.assertIsNotNone(self.cache.read(self.cache.keys(first)[0], 'gcode'))
+        self.assertIsNone(self.cache.read(self.cache.keys(second)[0], 'gcode'))
+
+    def test_invalid_settings_raise(self):
+        self.settings['object_settings']['width'][0] = -1
+        with self.assertRaises(ValueError):
+            self.cache.generate(self.settings)
+
+
+if __name__ == '__main__':
+    unittest.main()
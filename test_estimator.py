@@ -0,0 +1,102 @@
+import math
+import unittest
+
+import numpy as np
+
+from estimator import Moves, estimate, estimate_gcode, estimate_moves, max_height_for_budget
+from settings import Settings
+
+# 1000 mm/s^2 and 10 mm/s jerk are the defaults, at 100 mm/s it takes 4.95 mm to get from jerk to full speed
+ACCELERATION = 1000.0
+JERK = 10.0
+
+
+def path(*points, feedrate=6000):
+    # xy moves from 0,0, every one extruding 0.1
+    x, y = np.array(points, dtype=float).T
+    count = len(points)
+    return Moves(x, y, np.zeros(count), np.full(count, 0.1), np.full(count, float(feedrate)), np.zeros(count, int))
+
+
+def trapezoid(length, entry, exit_, speed):
+    # time of one move that reaches speed
+    accelerate = (speed ** 2 - entry ** 2) / (2 * ACCELERATION)
+    decelerate = (speed ** 2 - exit_ ** 2) / (2 * ACCELERATION)
+    return (speed - entry) / ACCELERATION + (speed - exit_) / ACCELERATION + \
+        (length - accelerate - decelerate) / speed
+
+
+class TrapezoidTest(unittest.TestCase):
+    def test_one_long_move(self):
+        # starts and stops at jerk, 4.95 mm up to speed and down again, 90.1 mm cruising
+        result = estimate_moves(path((100, 0)))
+        self.assertAlmostEqual(result['seconds'], 0.09 + 0.09 + 90.1 / 100)
+        self.assertAlmostEqual(result['filament_mm'], 0.1)
+
+    def test_short_move_never_reaches_speed(self):
+        # accelerates to the middle and brakes, peak speed sqrt(2 a l / 2 + jerk^2)
+        peak = math.sqrt(ACCELERATION * 1 + JERK ** 2)
+        self.assertAlmostEqual(estimate_moves(path((1, 0)))['seconds'], 2 * (peak - JERK) / ACCELERATION)
+
+    def test_straight_junction_keeps_speed(self):
+        self.assertAlmostEqual(estimate_moves(path((50, 0), (100, 0)))['seconds'],
+                               estimate_moves(path((100, 0)))['seconds'])
+
+    def test_right_angle_slows_to_the_corner_speed(self):
+        # the velocity changes by speed * sqrt(2) at a right angle, the corner is taken at jerk / sqrt(2)
+        corner = JERK / math.sqrt(2)
+        result = estimate_moves(path((50, 0), (50, 50)))
+        self.assertAlmostEqual(result['seconds'], 2 * trapezoid(50, JERK, corner, 100))
+        np.testing.assert_allclose(result['move_seconds'], [trapezoid(50, JERK, corner, 100)] * 2)
+
+    def test_feedrate(self):
+        self.assertAlmostEqual(estimate_moves(path((100, 0), feedrate=1200))['seconds'], trapezoid(100, JERK, JERK, 20))
+
+    def test_short_moves_are_limited_by_the_distance_left_to_stop(self):
+        # ten 1 mm moves in a line behave like one 10 mm move
+        self.assertAlmostEqual(estimate_moves(path(*[(step, 0) for step in range(1, 11)]))['seconds'],
+                               estimate_moves(path((10, 0)))['seconds'])
+
+    def test_no_moves(self):
+        empty = np.zeros(0)
+        self.assertEqual(estimate_moves(Moves(empty, empty, empty, empty, empty, empty.astype(int)))['seconds'], 0.0)
+
+
+class GCodeTest(unittest.TestCase):
+    def test_modes_and_layers(self):
+        text = 'G90\nM83\nG1 X100 Y0 E0.1 F6000 ; comment\nG1 Z0.2\nG92 E5\nG91\nG1 X-100 E0.1\n'
+        result = estimate_gcode(text)
+        self.assertAlmostEqual(result['filament_mm'], 0.2)
+        # the move up starts the second layer, G91 makes the last move go back to x 0
+        self.assertEqual(len(result['move_seconds']), 3)
+        self.assertEqual(len(result['layer_seconds']), 2)
+        self.assertAlmostEqual(result['layer_seconds'][0], result['move_seconds'][0])
+        self.assertAlmostEqual(result['move_seconds'][2], result['move_seconds'][0])
+
+    def test_absolute_extrusion(self):
+        text = 'M82\nG92 E0\nG1 X10 E1 F600\nG1 X20 E1.5\nG1 X30 E1.2\nG92 E0\nG1 X40 E0.5\n'
+        self.assertAlmostEqual(estimate_gcode(text)['filament_mm'], 2.0)
+
+
+class TowerTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings().to_dict()
+        self.settings['object_settings']['height'][0] = 5
+
+    def test_layer_times_add_up(self):
+        result = estimate(self.settings)
+        self.assertAlmostEqual(result['layer_seconds'].sum(), result['seconds'])
+        self.assertGreater(result['filament_mm'], 0)
+
+    def test_budget(self):
+        budget = estimate(self.settings)['seconds'] * 3
+        height = max_height_for_budget(self.settings, budget)
+        layer_height = self.settings['extrusion_settings']['other_layer_height'][0]
+        self.settings['object_settings']['height'][0] = height
+        self.assertLessEqual(estimate(self.settings)['seconds'], budget)
+        self.settings['object_settings']['height'][0] = height + layer_height
+        self.assertGreater(estimate(self.settings)['seconds'], budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
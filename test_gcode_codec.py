@@ -0,0 +1,105 @@
+import io
+import unittest
+
+from gcode_codec import BLOCK_HEADER, COMPRESSION_DEFLATE, COMPRESSION_LZMA, COMPRESSION_NONE, FILE_HEADER, decode, \
+    decode_meatpack, encode, iter_decode_binary, iter_encode_binary, iter_encode_meatpack, meatpack_lines, report
+from gcode_generator import GCodeGenerator
+from settings import Settings
+
+
+def tower_chunks():
+    settings = Settings().to_dict()
+    settings['object_settings']['height'][0] = 5
+    return list(GCodeGenerator.iter_chunks(settings))
+
+
+class BinaryTest(unittest.TestCase):
+    def round_trip(self, chunks, compression, block_size=64 * 1024):
+        data = b''.join(iter_encode_binary(chunks, compression, block_size))
+        return data, ''.join(iter_decode_binary(io.BytesIO(data)))
+
+    def test_round_trip_every_compression(self):
+        chunks = tower_chunks()
+        for compression in (COMPRESSION_NONE, COMPRESSION_DEFLATE, COMPRESSION_LZMA):
+            for block_size in (64 * 1024, 1000, 7):
+                with self.subTest(compression=compression, block_size=block_size):
+                    _, text = self.round_trip(chunks, compression, block_size)
+                    self.assertEqual(text, ''.join(chunks))
+
+    def test_modes(self):
+        text = ''.join(tower_chunks())
+        for mode in ('text', 'binary', 'binary-lzma'):
+            with self.subTest(mode=mode):
+                self.assertEqual(decode(encode([text], mode), mode), text)
+
+    def test_character_across_a_block_boundary(self):
+        # blocks are cut at byte offsets, the two bytes of the degree sign land in different blocks
+        text = ';' + 'a' * (64 * 1024 - 6) + ' 240°C\n'
+        self.assertEqual(text.encode().index('°'.encode()), 64 * 1024 - 1)
+        for compression in (COMPRESSION_DEFLATE, COMPRESSION_LZMA):
+            with self.subTest(compression=compression):
+                self.assertEqual(self.round_trip([text], compression)[1], text)
+        # every multi byte character split with the smallest blocks
+        text = '; ° € \U0001f600\n' * 5
+        self.assertEqual(self.round_trip([text], COMPRESSION_NONE, 1)[1], text)
+
+    def test_crc_mismatch(self):
+        data = bytearray(self.round_trip(['G1 X1 Y2\n' * 100], COMPRESSION_NONE)[0])
+        data[FILE_HEADER.size + BLOCK_HEADER.size + 3] ^= 1
+        with self.assertRaisesRegex(ValueError, 'corrupted'):
+            list(iter_decode_binary(io.BytesIO(bytes(data))))
+
+    def test_truncated_file(self):
+        data = self.round_trip(['G1 X1 Y2\n' * 100], COMPRESSION_DEFLATE)[0]
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            list(iter_decode_binary(io.BytesIO(data[:-2])))
+
+    def test_not_a_binary_file(self):
+        with self.assertRaises(ValueError):
+            list(iter_decode_binary(io.BytesIO(b'G1 X1 Y2\n')))
+
+
+class MeatPackTest(unittest.TestCase):
+    def round_trip(self, text, no_spaces=True):
+        return decode_meatpack(b''.join(iter_encode_meatpack([text], no_spaces)))
+
+    def executed(self, text):
+        # what the firmware runs, the padding lines are empty
+        return [line for line in text.split('\n') if line]
+
+    def test_tower(self):
+        text = ''.join(tower_chunks())
+        self.assertEqual(self.executed(self.round_trip(text)), list(meatpack_lines([text])))
+
+    def test_odd_and_even_lines_and_comments(self):
+        text = 'G1 X1\nG1 X12\n; only a comment\nM104 S200 ; set temp\n  G92 E0  \n\nG1 X-1.5 Y2 E0.25 F900\n'
+        expected = ['G1X1', 'G1X12', 'M104S200', 'G92E0', 'G1X-1.5Y2E0.25F900']
+        self.assertEqual(list(meatpack_lines([text])), expected)
+        self.assertEqual(self.executed(self.round_trip(text)), expected)
+
+    def test_spaces_kept(self):
+        text = 'G1 X1 E2\nM117 Hello there\n'
+        self.assertEqual(self.executed(self.round_trip(text, no_spaces=False)), ['G1 X1 E2', 'M117 Hello there'])
+        self.assertEqual(self.executed(self.round_trip(text)), ['G1X1E2', 'M117 Hello there'])
+
+    def test_characters_outside_the_table(self):
+        text = 'M117 Tést {x}\nG28 W\n'
+        self.assertEqual(self.executed(self.round_trip(text)), ['M117 Tést {x}', 'G28W'])
+
+    def test_packs_smaller(self):
+        text = ''.join(tower_chunks())
+        self.assertLess(len(encode([text], 'meatpack')), len(text.encode()) * 0.6)
+
+
+class ReportTest(unittest.TestCase):
+    def test_every_mode_is_lossless(self):
+        settings = Settings().to_dict()
+        settings['object_settings']['height'][0] = 5
+        rows = report(settings)
+        self.assertEqual([row['mode'] for row in rows], ['text', 'binary', 'binary-lzma', 'meatpack'])
+        for row in rows:
+            self.assertTrue(row['lossless'], row['mode'])
+
+
+if __name__ == '__main__':
+    unittest.main()
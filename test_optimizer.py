@@ -0,0 +1,133 @@
+import math
+import re
+import unittest
+
+from gcode_generator import GCodeGenerator
+from optimizer import Optimizer, extrusion_totals, optimize
+from settings import Settings
+
+ARC = re.compile(r'^G([23]) X(-?[\d.]+) Y(-?[\d.]+) I(-?[\d.]+) J(-?[\d.]+)')
+
+
+def moves(points, rate=0.05, feedrate=1200, e=0.0):
+    # absolute xy moves from 0,0 over the points, extruding rate per mm
+    lines = ['G92 E0', 'G1 X0 Y0']
+    x = y = 0.0
+    for index, (next_x, next_y) in enumerate(points):
+        e += math.hypot(next_x - x, next_y - y) * rate
+        x, y = next_x, next_y
+        lines.append(f'G1 X{round(x, 4)} Y{round(y, 4)} E{round(e, 4)}' + (f' F{feedrate}' if index == 0 else ''))
+    return '\n'.join(lines) + '\n'
+
+
+def circle(radius, degrees, step):
+    # points on a circle through 0,0 with its centre at 0,radius, counter clockwise
+    return [(radius * math.sin(math.radians(angle)), radius - radius * math.cos(math.radians(angle)))
+            for angle in range(step, degrees + 1, step)]
+
+
+class MergeTest(unittest.TestCase):
+    def test_collinear_moves_merge(self):
+        text = moves([(1, 0), (2, 0), (3.5, 0), (5, 0)])
+        optimized, stats = optimize(text, arcs=False)
+        self.assertEqual(optimized, 'G92 E0\nG1 X0 Y0\nG1 X5 Y0 E0.25 F1200\n')
+        self.assertEqual(stats['merged'], 3)
+        self.assertEqual(extrusion_totals(optimized), extrusion_totals(text))
+
+    def test_feedrate_of_the_first_move_is_kept(self):
+        # the feedrate is only written on the first move, the merged move must still set it
+        text = 'G1 X0 Y0 F9000\nG1 X1 Y1 E0.1 F600\nG1 X2 Y2 E0.2\nG1 X3 Y3 E0.3\nG1 X10 Y10\n'
+        optimized, _ = optimize(text, arcs=False)
+        self.assertEqual(optimized, 'G1 X0 Y0 F9000\nG1 X3 Y3 E0.3 F600\nG1 X10 Y10\n')
+
+    def test_feedrate_change_ends_the_run(self):
+        text = 'G1 X0 Y0\nG1 X1 Y0 E0.05 F1200\nG1 X2 Y0 E0.1\nG1 X3 Y0 E0.15 F3000\nG1 X4 Y0 E0.2\n'
+        optimized, _ = optimize(text, arcs=False)
+        self.assertEqual(optimized, 'G1 X0 Y0\nG1 X2 Y0 E0.1 F1200\nG1 X4 Y0 E0.2 F3000\n')
+
+    def test_extrusion_rate_change_is_not_merged(self):
+        text = 'G1 X0 Y0\nG1 X1 Y0 E0.05 F1200\nG1 X2 Y0 E0.1\nG1 X3 Y0 E0.2\n'
+        optimized, _ = optimize(text, arcs=False)
+        self.assertEqual(optimized, 'G1 X0 Y0\nG1 X2 Y0 E0.1 F1200\nG1 X3 Y0 E0.2\n')
+
+    def test_other_lines_end_the_run(self):
+        text = 'G1 X0 Y0\nG1 X1 Y0 E0.05 F1200\nM572 S0.04\nG1 X2 Y0 E0.1\nG1 Z0.4\nG1 X3 Y0 E0.15\n'
+        self.assertEqual(optimize(text)[0], text)
+
+    def test_turning_back_is_not_merged(self):
+        text = 'G1 X0 Y0\nG1 X2 Y0 F1200\nG1 X1 Y0\n'
+        self.assertEqual(optimize(text, arcs=False)[0], text)
+
+    def test_relative_extrusion_is_left_alone(self):
+        text = 'M83\nG1 X1 Y0 E0.05 F1200\nG1 X2 Y0 E0.05\n'
+        self.assertEqual(optimize(text)[0], text)
+
+    def test_chunk_boundaries(self):
+        text = moves([(1, 0), (2, 0), (3, 0)] + circle(10, 90, 5))
+        optimizer = Optimizer()
+        chunks = [text[start:start + 11] for start in range(0, len(text), 11)]
+        self.assertEqual(''.join(optimizer.iter_chunks(chunks)), optimize(text)[0])
+
+    def test_tower_extrusion_is_unchanged(self):
+        settings = Settings().to_dict()
+        settings['object_settings']['height'][0] = 5
+        text = GCodeGenerator.generate_from_settings(settings)
+        optimized, stats = optimize(text)
+        self.assertEqual(extrusion_totals(optimized), extrusion_totals(text))
+        self.assertLessEqual(stats['lines_out'], stats['lines_in'])
+
+
+class ArcTest(unittest.TestCase):
+    def check_arc(self, points, tolerance=0.01):
+        # one arc ending on the last point, every point and chord midpoint within tolerance of it
+        text = moves(points)
+        optimized, stats = optimize(text, tolerance=tolerance)
+        arcs = [ARC.match(line) for line in optimized.split('\n') if ARC.match(line)]
+        self.assertEqual(len(arcs), 1, optimized)
+        self.assertEqual(stats['arcs'], 1)
+        self.assertEqual(extrusion_totals(optimized), extrusion_totals(text))
+        _, end_x, end_y, i, j = (float(value) for value in arcs[0].groups())
+        self.assertEqual((end_x, end_y), tuple(round(value, 4) for value in points[-1]))
+        radius = math.hypot(i, j)
+        self.assertAlmostEqual(math.hypot(end_x - i, end_y - j), radius, delta=tolerance)
+        previous = (0, 0)
+        for point in points:
+            for x, y in (point, ((previous[0] + point[0]) / 2, (previous[1] + point[1]) / 2)):
+                self.assertLessEqual(abs(math.hypot(x - i, y - j) - radius), tolerance)
+            previous = point
+        return arcs[0]
+
+    def test_counter_clockwise(self):
+        arc = self.check_arc(circle(10, 90, 5))
+        self.assertEqual(arc.group(1), '3')
+        self.assertAlmostEqual(float(arc.group(5)), 10, delta=0.01)
+
+    def test_clockwise(self):
+        arc = self.check_arc([(x, -y) for x, y in circle(20, 60, 3)])
+        self.assertEqual(arc.group(1), '2')
+
+    def test_coarse_circle_needs_a_looser_tolerance(self):
+        # 10 degree segments on a 10mm radius bow 0.038mm away from the arc
+        points = circle(10, 90, 10)
+        self.assertEqual(optimize(moves(points))[1]['arcs'], 0)
+        self.check_arc(points, 0.05)
+
+    def test_bumpy_curve_is_not_an_arc(self):
+        points = [(x, y + (0.05 if index % 2 else 0)) for index, (x, y) in enumerate(circle(10, 90, 5))]
+        self.assertEqual(optimize(moves(points))[1]['arcs'], 0)
+
+    def test_full_circle_is_not_one_arc(self):
+        # the arc stops short of the start point and the moves left over close the circle
+        text = moves(circle(10, 360, 5))
+        optimized, stats = optimize(text)
+        self.assertEqual(stats['arcs'], 1)
+        self.assertNotIn(' X-0.0 Y0.0 I', optimized)
+        self.assertEqual(optimized.split('\n')[-2], text.split('\n')[-2])
+        self.assertEqual(extrusion_totals(optimized), extrusion_totals(text))
+
+    def test_too_few_moves(self):
+        self.assertEqual(optimize(moves(circle(10, 15, 5)))[1]['arcs'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+from pa_detect import PNG_SIGNATURE, detect_pa, locate_tower, read_image
+from settings import Settings
+from toolpath import build_toolpath, pa_map
+
+BACKGROUND = 0.15
+WALL = 0.6
+# pixels per mm and space around the tower
+SCALE = 8
+MARGIN = 60
+VALLEY = 10
+
+
+def tower_map(bands, height=40):
+    settings = Settings().to_dict()
+    settings['object_settings']['height'][0] = height
+    settings['pressure_advance_settings']['bands'][0] = bands
+    return pa_map(build_toolpath(settings), settings['object_settings']['width'][0])
+
+
+def render_tower(tower, clean, style='transitions', defect=0.3, noise=0.02, mirror=False, graded=False, seed=0):
+    # grey front view of the tower, every test layer and band except clean = (test layer, band) shows a defect:
+    # 'transitions' bulges where the speed changes, 'ripple' uneven lines along the whole band. graded defects grow
+    # over the VALLEY values next to the clean one like a real print, otherwise every other value is equally bad
+    rng = np.random.default_rng(seed)
+    layer_z = np.array(tower['layer_z'])
+    base = tower['base_layer_count']
+    bands = tower['bands']
+    columns = int(tower['width'] * SCALE)
+    rows = int(round(layer_z[-1] * SCALE))
+    image = BACKGROUND + rng.normal(0, noise, (rows + 2 * MARGIN, columns + 4 * MARGIN))
+    left, top = 2 * MARGIN, MARGIN
+    for row in range(rows):
+        z = (rows - row - 0.5) / rows * layer_z[-1]
+        layer = int(np.searchsorted(layer_z, z))
+        line = WALL + rng.normal(0, noise, columns)
+        if layer < base:
+            # the base sticks out on both sides
+            image[top + row, left - MARGIN // 2:left + columns + MARGIN // 2] = WALL + \
+                rng.normal(0, noise, columns + MARGIN)
+            continue
+        for band in range(bands):
+            if (layer - base, band) == clean:
+                continue
+            index = (layer - base) * bands + band
+            strength = defect * (min(abs(index - clean[0] * bands - clean[1]) / VALLEY, 1) if graded else 1)
+            # band 0 at the +x end, on the right unless mirror
+            start = (band if mirror else bands - band - 1) * columns // bands
+            width = columns // bands
+            if style == 'ripple':
+                line[start:start + width] += strength / 2 * np.sin(np.arange(width) * 0.9 + layer)
+            else:
+                for point in range(1, 4):
+                    column = start + point * width // 4
+                    line[column - 3:column + 3] += strength * (1 if point % 2 else -1)
+        image[top + row, left:left + columns] = line
+    return np.clip(image, 0, 1), (left, top, left + columns, top + rows)
+
+
+def write_png(path, pixels):
+    # 8 bit rgb png, the rows cycle through the five filter types
+    height, width, _ = pixels.shape
+    raw = pixels.astype(np.int16)
+    left = np.concatenate((np.zeros((height, 1, 3), np.int16), raw[:, :-1]), 1)
+    up = np.concatenate((np.zeros((1, width, 3), np.int16), raw[:-1]), 0)
+    up_left = np.concatenate((np.zeros((height, 1, 3), np.int16), up[:, :-1]), 1)
+    estimate = left + up - up_left
+    paeth = np.where((np.abs(estimate - left) <= np.abs(estimate - up)) &
+                     (np.abs(estimate - left) <= np.abs(estimate - up_left)), left,
+                     np.where(np.abs(estimate - up) <= np.abs(estimate - up_left), up, up_left))
+    predictors = (0, left, up, (left + up) // 2, paeth)
+    rows = b''.join(bytes([row % 5]) + ((raw[row] - predictors[row % 5][row] if row % 5 else raw[row]) & 255)
+                    .astype(np.uint8).tobytes() for row in range(height))
+
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+    with open(path, 'wb') as png_file:
+        png_file.write(PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+                       chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class DetectTest(unittest.TestCase):
+    def check_detected(self, bands, clean, least_confidence=0.5, steps=0, **render):
+        # steps is how many values next to the clean one are also accepted
+        tower = tower_map(bands)
+        image, box = render_tower(tower, clean, **render)
+        result = detect_pa(image, tower, mirror=render.get('mirror', False))
+        self.assertEqual(tuple(result['box']), box)
+        found = (result['layer'] - tower['base_layer_count']) * bands + result['band'] - 1
+        self.assertLessEqual(abs(found - clean[0] * bands - clean[1]), steps, result)
+        self.assertEqual(result['pa'], np.ravel(tower['band_pa'])[found])
+        self.assertGreater(result['confidence'], least_confidence)
+        return result
+
+    def test_one_band(self):
+        self.check_detected(1, (30, 0))
+
+    def test_several_bands(self):
+        for bands, clean in ((2, (25, 1)), (4, (11, 2))):
+            with self.subTest(bands=bands):
+                self.check_detected(bands, clean)
+
+    def test_mirrored_photo(self):
+        self.check_detected(3, (20, 0), mirror=True)
+
+    def test_uneven_lines(self):
+        for bands, clean in ((1, (40, 0)), (3, (15, 2))):
+            with self.subTest(bands=bands):
+                self.check_detected(bands, clean, style='ripple')
+
+    def test_noisy_photo(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.check_detected(2, (30, 0), 0.2, defect=0.25, noise=0.06, seed=seed)
+
+    def test_defects_grow_away_from_the_best_value(self):
+        for bands, clean in ((1, (55, 0)), (2, (18, 1))):
+            with self.subTest(bands=bands):
+                self.check_detected(bands, clean, 0.2, 1, graded=True)
+
+    def test_best_value_at_the_end_of_the_range(self):
+        result = self.check_detected(1, (1, 0), 0.2)
+        self.assertEqual(len(result['warnings']), 1)
+        self.assertLessEqual(result['confidence'], 0.5)
+
+    def test_no_clean_value_has_no_confidence(self):
+        tower = tower_map(2)
+        image, box = render_tower(tower, None, defect=0.0)
+        self.assertLess(detect_pa(image, tower, box)['confidence'], 0.2)
+
+    def test_height_reads_back_as_the_same_layer(self):
+        result = self.check_detected(1, (30, 0))
+        height = Settings().extrusion_settings.other_layer_height
+        self.assertEqual(int(round(result['height'], 2) / height), 30)
+
+    def test_locate_tower(self):
+        image, box = render_tower(tower_map(1), (10, 0))
+        self.assertEqual(locate_tower(image), box)
+
+
+class ReadImageTest(unittest.TestCase):
+    def test_png_every_filter(self):
+        pixels = np.random.default_rng(1).integers(0, 256, (23, 17, 3))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photo.png')
+            write_png(path, pixels)
+            np.testing.assert_allclose(read_image(path), pixels / 255.0 @ np.array([0.299, 0.587, 0.114]))
+
+    def test_pgm(self):
+        pixels = np.random.default_rng(2).integers(0, 256, (9, 13)).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photo.pgm')
+            with open(path, 'wb') as pgm_file:
+                pgm_file.write(b'P5\n# comment\n13 9\n255\n' + pixels.tobytes())
+            np.testing.assert_allclose(read_image(path), pixels / 255.0)
+
+    def test_unknown_format(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photo.jpg')
+            with open(path, 'wb') as jpeg_file:
+                jpeg_file.write(b'\xff\xd8\xff\xe0')
+            with self.assertRaises(ValueError):
+                read_image(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
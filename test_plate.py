@@ -0,0 +1,99 @@
+import re
+import unittest
+
+from plate import footprint, generate_plate, layout, tower_settings
+from settings import Settings
+from toolpath import build_toolpath
+
+
+def plate_towers(*overrides):
+    base = Settings().to_dict()
+    base['object_settings']['height'][0] = 3
+    return [tower_settings(base, dict({'object_settings.width': 40}, **tower)) for tower in overrides]
+
+
+def layer_towers(gcode):
+    # tower numbers in printing order of every layer
+    return [[int(number) for number in re.findall(r'; tower (\d+)\n', layer)]
+            for layer in gcode.split('; -> layer nr=')[1:]]
+
+
+class LayoutTest(unittest.TestCase):
+    def test_towers_do_not_overlap(self):
+        towers = plate_towers(*({'object_settings.width': width} for width in (40, 80, 25, 60, 40, 100, 30)))
+        centers = layout(towers, spacing=10)
+        boxes = [(x - footprint(settings)[0], y - footprint(settings)[1], x + footprint(settings)[0],
+                  y + footprint(settings)[1]) for settings, (x, y) in zip(towers, centers)]
+        for box in boxes:
+            self.assertTrue(0 <= box[0] and box[2] <= 300 and 0 <= box[1] and box[3] <= 300, box)
+        # more than one row, and every pair of towers at least the spacing apart in x or y
+        self.assertGreater(len({y for _, y in centers}), 1)
+        for first in range(len(boxes)):
+            for second in range(first + 1, len(boxes)):
+                a, b = boxes[first], boxes[second]
+                gap = max(b[0] - a[2], a[0] - b[2], b[1] - a[3], a[1] - b[3])
+                self.assertGreaterEqual(gap, 10 - 1e-9, (first, second))
+
+    def test_plate_centred_on_the_bed(self):
+        centers = layout(plate_towers({}, {}))
+        self.assertAlmostEqual(sum(x for x, _ in centers) / 2, 150)
+        self.assertAlmostEqual(centers[0][1], 150)
+
+    def test_too_many_towers(self):
+        with self.assertRaisesRegex(ValueError, 'bed depth'):
+            layout(plate_towers(*[{}] * 100))
+
+    def test_tower_wider_than_the_bed(self):
+        with self.assertRaisesRegex(ValueError, 'wider than the bed'):
+            layout(plate_towers({}, {'object_settings.width': 320}))
+
+    def test_shared_settings(self):
+        with self.assertRaisesRegex(ValueError, 'other_layer_height'):
+            generate_plate(plate_towers({}, {'extrusion_settings.other_layer_height': 0.3}))
+
+
+class ToolTest(unittest.TestCase):
+    def test_one_tool_change_per_extra_tool_and_layer(self):
+        tools = (0, 1, 0, 1, 2)
+        gcode, stats = generate_plate(plate_towers(*({'printer_settings.tool_index': tool} for tool in tools)))
+        layers = layer_towers(gcode)
+        tool = 0
+        for order in layers:
+            self.assertEqual(sorted(order), [1, 2, 3, 4, 5])
+            used = [tools[number - 1] for number in order]
+            # the layer starts with the tool left from the layer below and never comes back to a tool
+            self.assertEqual(used[0], tool)
+            self.assertEqual(len(used) - sum(a == b for a, b in zip(used, used[1:])), 3)
+            tool = used[-1]
+        self.assertEqual(stats['tool_changes'], 2 * len(layers))
+        # the start and end gcode select the first tool themselves
+        layers_gcode = gcode[gcode.index('; -> layer nr=1\n'):gcode.rindex('; tower')]
+        self.assertEqual(len(re.findall(r'\nT\d+\n', layers_gcode)), stats['tool_changes'])
+
+    def test_every_other_tool_is_waited_for_once_before_it_prints(self):
+        gcode, _ = generate_plate(plate_towers({'printer_settings.tool_index': 0}, {'printer_settings.tool_index': 1},
+                                               {'printer_settings.tool_index': 2}, {'printer_settings.tool_index': 1}))
+        for tool in (1, 2):
+            self.assertEqual(gcode.count(f'M116 P{tool} '), 1)
+            heat = gcode.index(f'G10 P{tool} S')
+            select = gcode.index(f'\nT{tool}\n') + 1
+            wait = gcode.index(f'M116 P{tool} ')
+            self.assertLess(heat, select)
+            # nothing between selecting the tool and waiting for it
+            self.assertEqual(gcode[select:wait].count('\n'), 1)
+        self.assertNotIn('M116 P0', gcode)
+
+    def test_towers_of_different_height(self):
+        # the first tower is the shorter one, z comes from the tower that still prints
+        towers = plate_towers({'object_settings.height': 1}, {'object_settings.height': 3})
+        gcode, _ = generate_plate(towers)
+        layer_z = [float(z) for z in re.findall(r'\nG1 Z([\d.]+) F', gcode)]
+        self.assertEqual(layer_z, [round(float(z), 4) for z in build_toolpath(towers[1]).layer_z])
+        # the short tower stops after its last layer
+        short_layers = build_toolpath(towers[0]).layer_count
+        self.assertEqual([len(order) for order in layer_towers(gcode)],
+                         [2] * short_layers + [1] * (len(layer_z) - short_layers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+import numpy as np
+
+from preflight import PreflightError, check_toolpath, preflight_problems
+from settings import Settings
+from toolpath import build_toolpath
+
+
+class PreflightTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings().to_dict()
+        self.settings['object_settings']['height'][0] = 5
+        self.toolpath = build_toolpath(self.settings)
+
+    def problems(self, check, **changes):
+        # problems of the tower, checked against the settings with changes = {'group.name': value}
+        settings = Settings.from_dict(self.settings).to_dict()
+        for key, value in changes.items():
+            group, name = key.split('.')
+            settings[group][name][0] = value
+        return [found for found in preflight_problems(self.toolpath, settings) if found['check'] == check]
+
+    def first_layer_move(self, extrude):
+        # the travel to the start of the first layer or its first extruding move after that
+        moves = np.flatnonzero(self.toolpath.extrude[:self.toolpath.layer_offsets[1]] == extrude)
+        return int(moves[0])
+
+    def assert_message(self, problems, message):
+        self.assertTrue(any(message in found['message'] for found in problems), problems)
+
+    def test_default_tower_is_fine(self):
+        self.assertEqual(preflight_problems(self.toolpath, self.settings), [])
+        check_toolpath(self.toolpath, self.settings)
+
+    def test_off_the_bed(self):
+        for key, value, message in (('printer_settings.bed_max_x', 10, 'x reaches'),
+                                    ('printer_settings.bed_min_x', 200, 'x reaches'),
+                                    ('printer_settings.bed_max_y', 10, 'y reaches'),
+                                    ('printer_settings.bed_min_y', 200, 'y reaches')):
+            with self.subTest(key=key):
+                problems = self.problems('bounds', **{key: value})
+                self.assertEqual(len(problems), 1)
+                self.assert_message(problems, message)
+                self.assertEqual(problems[0]['limit'], value)
+
+    def test_too_tall(self):
+        problems = self.problems('bounds', **{'printer_settings.bed_max_z': 1})
+        self.assert_message(problems, 'z reaches')
+        self.assertEqual(problems[0]['count'], np.count_nonzero(self.toolpath.layer_z > 1))
+
+    def test_layer_not_rising(self):
+        self.toolpath.layer_z[5] = self.toolpath.layer_z[4]
+        problems = self.problems('z')
+        self.assertEqual(problems[0]['layer'], 5)
+        self.assert_message(problems, 'layer 6 at z')
+
+    def test_extrusion(self):
+        for extrude, change, message in ((True, 'backwards', 'E goes backwards'),
+                                         (True, 'nan', 'E is not a number'),
+                                         (False, 'push', 'a travel move changes E'),
+                                         (True, 'still', 'filament is pushed without moving')):
+            with self.subTest(message=message):
+                self.setUp()
+                move = self.first_layer_move(extrude)
+                if change == 'backwards':
+                    self.toolpath.e[move] = self.toolpath.e[move - 1] - 1
+                elif change == 'nan':
+                    self.toolpath.e[move] = np.nan
+                elif change == 'push':
+                    self.toolpath.e[move] = 1
+                else:
+                    self.toolpath.x[move] = self.toolpath.x[move - 1]
+                    self.toolpath.y[move] = self.toolpath.y[move - 1]
+                problems = self.problems('extrusion')
+                self.assert_message(problems, message)
+                found = [found for found in problems if message in found['message']][0]
+                self.assertEqual((found['layer'], found['move']), (0, move))
+
+    def test_repeated_layers_are_counted(self):
+        # a bad move in a repeated body counts every layer that prints it
+        layer = int(self.toolpath.layer_body[-1])
+        move = int(self.toolpath.layer_offsets[layer]) + 1
+        self.toolpath.e[move] = np.nan
+        problems = self.problems('extrusion')
+        self.assertEqual(problems[0]['count'], np.count_nonzero(self.toolpath.layer_body == layer))
+
+    def test_lines_too_wide(self):
+        self.settings['extrusion_settings']['other_layer_extrusion_multiplier'][0] = 5
+        self.toolpath = build_toolpath(self.settings)
+        problems = self.problems('extrusion')
+        self.assert_message(problems, 'check the extrusion multipliers')
+        self.assertEqual(problems[0]['count'], self.toolpath.layer_count - 1)
+
+    def test_flow(self):
+        self.assertEqual(self.problems('flow', **{'printer_settings.max_volumetric_flow': 0}), [])
+        problems = self.problems('flow', **{'printer_settings.max_volumetric_flow': 0.5})
+        self.assert_message(problems, 'more than max_volumetric_flow 0.5')
+        self.assertEqual(problems[0]['count'], self.toolpath.layer_count)
+        # the argument overrides the setting
+        self.assertEqual(preflight_problems(self.toolpath, self.settings, 0.5)[0]['check'], 'flow')
+
+    def test_raises_every_problem(self):
+        self.settings['printer_settings']['bed_max_z'][0] = 1
+        self.settings['printer_settings']['max_volumetric_flow'][0] = 0.5
+        with self.assertRaises(PreflightError) as raised:
+            check_toolpath(self.toolpath, self.settings)
+        self.assertEqual([found['check'] for found in raised.exception.problems], ['bounds', 'flow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
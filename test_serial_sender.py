@@ -0,0 +1,40 @@
+import unittest
+
+from gcode_generator import GCodeGenerator
+from serial_sender import FakePrinter, SerialPort, SerialSender, iter_commands
+from settings import Settings
+
+
+class SerialSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings().to_dict()
+        self.settings['object_settings']['height'][0] = 5
+        self.expected = list(iter_commands(GCodeGenerator.iter_chunks(self.settings)))
+
+    def send(self, error_rate, window):
+        printer = FakePrinter(error_rate=error_rate, seed=window)
+        port = SerialPort(printer.path)
+        try:
+            stats = SerialSender(port, window, timeout=5.0).send_settings(self.settings)
+        finally:
+            port.close()
+            printer.close()
+        return printer, stats
+
+    def test_printer_receives_every_command_in_order(self):
+        for error_rate in (0.0, 0.05, 0.2):
+            for window in (1, 4, 16):
+                with self.subTest(error_rate=error_rate, window=window):
+                    printer, stats = self.send(error_rate, window)
+                    self.assertEqual(printer.commands, self.expected)
+                    self.assertEqual(stats['lines'], len(self.expected))
+                    self.assertLessEqual(stats['max_buffer'], window)
+                    if error_rate == 0:
+                        self.assertEqual(stats['resends'], 0)
+                    else:
+                        self.assertGreater(printer.errors, 0)
+                        self.assertGreater(stats['resends'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
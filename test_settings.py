@@ -0,0 +1,62 @@
+import json
+import os
+import unittest
+
+from settings import Settings, SettingsError, parse_text
+
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')
+
+
+class SettingsTest(unittest.TestCase):
+    def setUp(self):
+        with open(SETTINGS_PATH, 'r') as json_file:
+            self.values = json.load(json_file)
+
+    def test_round_trip(self):
+        self.assertEqual(Settings.from_dict(self.values).to_dict(), self.values)
+
+    def test_missing_settings_get_their_default(self):
+        del self.values['printer_settings']['max_volumetric_flow']
+        del self.values['pressure_advance_settings']
+        settings = Settings.from_dict(self.values)
+        self.assertEqual(settings.printer_settings.max_volumetric_flow, 0)
+        self.assertEqual(settings.pressure_advance_settings.bands, 1)
+
+    def test_whole_float_for_an_int_setting(self):
+        self.values['pressure_advance_settings']['bands'][0] = 3.0
+        self.assertEqual(Settings.from_dict(self.values).pressure_advance_settings.bands, 3)
+
+    def test_bad_values_are_all_reported(self):
+        self.values['speed_settings']['fast_speed'][0] = 'fast'
+        self.values['pressure_advance_settings']['bands'][0] = 2.5
+        self.values['object_settings']['width'][0] = 0
+        self.values['printer_settings']['bed_max_y'][0] = -1
+        with self.assertRaises(SettingsError) as raised:
+            Settings.from_dict(self.values)
+        self.assertEqual([key for key, _ in raised.exception.problems],
+                         ['speed_settings.fast_speed', 'object_settings.width', 'pressure_advance_settings.bands',
+                          'printer_settings.bed_max_y'])
+
+    def test_unchecked_keeps_bad_values(self):
+        # the gui and the command line load without checking and must write a bad value back as it was
+        self.values['speed_settings']['fast_speed'][0] = 'fast'
+        self.values['printer_settings']['bed_max_x'][0] = None
+        settings = Settings.from_dict(self.values, check=False)
+        self.assertEqual(settings.to_dict(), self.values)
+        self.assertEqual([key for key, _ in settings.validate()],
+                         ['printer_settings.bed_max_x', 'speed_settings.fast_speed'])
+
+    def test_bed_centre(self):
+        self.values['printer_settings']['bed_min_x'][0] = -100
+        self.values['printer_settings']['bed_max_x'][0] = 200
+        self.assertEqual(Settings.from_dict(self.values).derived().bed_center_x, 50)
+
+    def test_parse_text(self):
+        self.assertEqual(parse_text(' 100 ', float), 100)
+        self.assertEqual(parse_text('0.5', float), 0.5)
+        self.assertEqual(parse_text('2.5', int), '2.5')
+        self.assertEqual(parse_text('abc', float), 'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
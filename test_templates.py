@@ -0,0 +1,53 @@
+import unittest
+
+from settings import Settings
+from templates import TemplateError, compile_template
+
+
+def render(template, **printer):
+    settings = Settings().to_dict()
+    for name, value in printer.items():
+        settings['printer_settings'][name][0] = value
+    return compile_template(template).render(settings)
+
+
+class TemplateTest(unittest.TestCase):
+    def test_placeholders(self):
+        # a name alone or with its group
+        filament = Settings().filament_settings
+        self.assertEqual(render('M104 S[first_layer_extruder_temp]\nM140 S[filament_settings.first_layer_bed_temp]'),
+                         f'M104 S{filament.first_layer_extruder_temp}\nM140 S{filament.first_layer_bed_temp}\n')
+
+    def test_literal_braces(self):
+        self.assertEqual(render('M117 {x} [ nozzle_diameter ]'), 'M117 {x} 0.4\n')
+
+    def test_omitted_if_equal(self):
+        template = 'T[tool_index] ; omitted if tool_index = -1\nG28'
+        # compared as numbers
+        for tool in (-1, -1.0, '-1'):
+            with self.subTest(tool=tool):
+                self.assertEqual(render(template, tool_index=tool), 'G28\n')
+        self.assertEqual(render(template, tool_index=0), 'T0 ; omitted if tool_index = -1\nG28\n')
+
+    def test_omitted_if_not_equal(self):
+        template = 'G28 [homing_axes] ; omitted if homing_axes != XYZ\nG1 X0\n'
+        self.assertEqual(render(template, homing_axes='XYZ'), 'G28 XYZ ; omitted if homing_axes != XYZ\nG1 X0\n\n')
+        self.assertEqual(render(template, homing_axes='XY'), 'G1 X0\n\n')
+
+    def test_omitted_if_double_equal(self):
+        self.assertEqual(render('G10 P1 ; Omitted If printer_settings.tool_index == 1', tool_index=1), '')
+
+    def test_unknown_keys(self):
+        with self.assertRaises(TemplateError) as raised:
+            compile_template('G28\nM104 S[hotend_temp]\nT0 ; omitted if extruder = 0\nG1 [printer_settings.speed]')
+        self.assertEqual(raised.exception.unknown_keys,
+                         [('hotend_temp', 2), ('extruder', 3), ('printer_settings.speed', 4)])
+        self.assertIn('[hotend_temp] (line 2)', str(raised.exception))
+
+    def test_compiled_once(self):
+        template = 'M104 S[first_layer_extruder_temp] ; compiled once\n'
+        self.assertIs(compile_template(template), compile_template(template))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from gcode_generator import GCodeGenerator
+from settings import Settings
+from uploader import LocalUploadServer, Printer, upload_all
+
+
+KINDS = ('rrf', 'moonraker', 'octoprint')
+# the name each kind stores the upload under on the stand-in server
+STORED_NAMES = {'rrf': '0%3A/gcodes/pa_test.gcode', 'moonraker': 'pa_test.gcode', 'octoprint': 'pa_test.gcode'}
+
+
+class UploadTest(unittest.TestCase):
+    def setUp(self):
+        self.settings = Settings().to_dict()
+        self.gcode = GCodeGenerator.generate_from_settings(self.settings).encode()
+
+    def upload(self, fail_requests=0, chunked=None):
+        async def run():
+            servers = [await LocalUploadServer(fail_requests).start() for _ in KINDS]
+            printers = [Printer(kind, server.url, kind, password='secret' if kind == 'rrf' else None,
+                                chunked=chunked) for kind, server in zip(KINDS, servers)]
+            try:
+                summary = await upload_all(printers, 'pa_test.gcode',
+                                           lambda: GCodeGenerator.iter_chunks(self.settings), retries=2)
+            finally:
+                for server in servers:
+                    await server.close()
+            return summary, servers
+        return asyncio.run(run())
+
+    def check_received(self, summary, servers):
+        self.assertEqual(summary['failed'], 0, summary)
+        for kind, server, result in zip(KINDS, servers, summary['uploads']):
+            self.assertTrue(result['ok'], result)
+            self.assertEqual(server.files[STORED_NAMES[kind]], self.gcode, kind)
+
+    def test_every_kind_receives_the_generated_gcode(self):
+        summary, servers = self.upload()
+        self.check_received(summary, servers)
+        for result in summary['uploads']:
+            self.assertEqual(result['attempts'], 1)
+
+    def test_sized_upload(self):
+        # every kind sends a content length instead of chunks
+        summary, servers = self.upload(chunked=False)
+        self.check_received(summary, servers)
+
+    def test_failed_upload_is_retried_on_the_same_connection(self):
+        summary, servers = self.upload(fail_requests=1)
+        self.check_received(summary, servers)
+        for result in summary['uploads']:
+            self.assertEqual(result['attempts'], 2)
+        # one connection per host, kept alive through the rrf login, the 503 and the retry
+        self.assertEqual(summary['connections'], len(KINDS))
+        for server in servers:
+            self.assertEqual(server.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import numpy as np
+
+from settings import as_settings
+
+
+BASE_LAYER_COUNT = 3
+BASE_PERIMETERS = 9
+LAYER_CHANGE_FEEDRATE = 6000
+
+# speed index of every move, resolved against speed_settings
+SPEED_KEYS = ('travel_speed', 'first_layer_speed', 'slow_speed', 'fast_speed')
+TRAVEL, FIRST_LAYER, SLOW, FAST = range(len(SPEED_KEYS))
+
+
+class Toolpath:
+    # every move of the model as flat arrays, layer i owns moves layer_offsets[i]:layer_offsets[i+1]
+    def __init__(self, x, y, e, speed, extrude, layer_offsets, layer_z, layer_height, layer_pa, feedrates,
+                 base_layer_count, layer_body=None, band=None, band_pa=None):
+        self.x = x
+        self.y = y
+        self.e = e
+        self.speed = speed
+        self.extrude = extrude
+        self.layer_offsets = layer_offsets
+        self.layer_z = layer_z
+        self.layer_height = layer_height
+        self.layer_pa = layer_pa
+        self.feedrates = feedrates
+        self.base_layer_count = base_layer_count
+        # layer_body[i] is the earlier layer whose moves layer i repeats exactly, or i itself
+        self.layer_body = np.arange(len(layer_z)) if layer_body is None else layer_body
+        # pressure advance band of every move, band_pa[i, b] is the value of band b in layer i
+        self.band = np.zeros(len(x), dtype=np.int8) if band is None else band
+        self.band_pa = layer_pa[:, None] if band_pa is None else band_pa
+
+    @property
+    def bands(self):
+        return self.band_pa.shape[1]
+
+    @property
+    def layer_count(self):
+        return len(self.layer_z)
+
+    @property
+    def move_count(self):
+        return len(self.x)
+
+    @property
+    def feedrate(self):
+        # mm/min of every move
+        return np.array([feedrate * 60 for feedrate in self.feedrates], dtype=float)[self.speed]
+
+    def layer_slice(self, layer):
+        return slice(self.layer_offsets[layer], self.layer_offsets[layer + 1])
+
+
+def test_area_layer_count(settings):
+    return as_settings(settings).derived().test_area_layer_count
+
+
+def base_layer_moves(object_width, extrusion_width):
+    # one base layer: travel to the left edge, a centre line, then concentric rectangles around it
+    i = np.arange(1, BASE_PERIMETERS + 1)
+    outer = object_width / 2 + extrusion_width * i
+    inner = -object_width / 2 - extrusion_width * i
+    x = np.concatenate(([-object_width / 2, object_width / 2], np.stack((outer, outer, inner, inner), 1).ravel()))
+    y = np.concatenate(([0, 0], np.stack((-extrusion_width * i, extrusion_width * i, extrusion_width * i,
+                                           -extrusion_width * i), 1).ravel()))
+    speed = np.full(len(x), FIRST_LAYER, dtype=np.int8)
+    speed[0] = TRAVEL
+    return x, y, speed
+
+
+def test_area_layer_moves(object_width, extrusion_width, bands=1):
+    # one test area layer: a line out and back one extrusion width over, split in bands along x that each hold a
+    # fast/slow/fast/slow pattern
+    points = object_width * (0.5 - np.arange(4 * bands + 1) / (4 * bands))
+    x = np.concatenate((points, points[::-1]))
+    y = np.repeat([extrusion_width / 2, -extrusion_width / 2], len(points))
+    speed = np.array(([SLOW] + [FAST, SLOW] * 2 * bands) * 2, dtype=np.int8)
+    return x, y, speed
+
+
+def test_area_move_bands(bands):
+    # band of every test area move, the way back passes the bands in reverse order
+    out = np.concatenate(([0], np.repeat(np.arange(bands), 4)))
+    back = np.concatenate(([bands - 1], np.repeat(np.arange(bands)[::-1], 4)))
+    return np.concatenate((out, back)).astype(np.int8)
+
+
+def band_pressure_advance(settings, height, band=1):
+    # pressure advance printed at height mm above the base in band (1 is the +x end), as generated
+    settings = as_settings(settings)
+    derived = settings.derived()
+    layer_count, bands = derived.test_area_layer_count, derived.bands
+    layer = min(max(int(height / settings.extrusion_settings.other_layer_height), 0), layer_count - 1)
+    band = min(max(int(band), 1), bands) - 1
+    pa = settings.pressure_advance_settings
+    return pa.start + (pa.finish - pa.start) * (layer * bands + band) / max(layer_count * bands - 1, 1)
+
+
+def layer_extrusion(x, y, speed, start, e_per_mm):
+    # cumulative E of one layer from E0, start is where the nozzle is before the first move
+    previous_x = np.concatenate(([start[0]], x[:-1]))
+    previous_y = np.concatenate(([start[1]], y[:-1]))
+    length = np.sqrt((previous_x - x) ** 2 + (previous_y - y) ** 2)
+    segment_e = length * e_per_mm
+    segment_e[speed == TRAVEL] = 0.0
+    return np.cumsum(segment_e)
+
+
+def bed_center(settings):
+    derived = as_settings(settings).derived()
+    return derived.bed_center_x, derived.bed_center_y
+
+
+def build_toolpath(settings, center=None):
+    # settings is a Settings or a settings.json shaped dict, center is where the tower goes on the bed, the bed
+    # centre unless given
+    settings = as_settings(settings)
+    derived = settings.derived()
+    extrusion = settings.extrusion_settings
+    object_width = settings.object_settings.width
+    extrusion_width = derived.extrusion_width
+    first_height = extrusion.first_layer_height
+    other_height = extrusion.other_layer_height
+    other_e_per_mm = derived.other_layer_e_per_mm
+
+    layer_count = derived.test_area_layer_count
+    if layer_count == 1:
+        raise ValueError('object height must span at least two test layers')
+
+    base = base_layer_moves(object_width, extrusion_width)
+    bands = derived.bands
+    test = test_area_layer_moves(object_width, extrusion_width, bands)
+    center_x, center_y = (derived.bed_center_x, derived.bed_center_y) if center is None else center
+    for x, y, _ in (base, test):
+        x += center_x
+        y += center_y
+    base_end = (base[0][-1], base[1][-1])
+    test_end = (test[0][-1], test[1][-1])
+
+    # only the first base and first test layer start from a different place than the layer below, every other
+    # layer repeats its predecessor exactly, so the move math runs for four layers and the rest is stamped
+    runs = [
+        (base, (0.0, 0.0), first_height, derived.first_layer_e_per_mm, 1),
+        (base, base_end, other_height, other_e_per_mm, BASE_LAYER_COUNT - 1),
+        (test, base_end, other_height, other_e_per_mm, min(layer_count, 1)),
+        (test, test_end, other_height, other_e_per_mm, max(layer_count - 1, 0))
+    ]
+    runs = [run for run in runs if run[4] > 0]
+    x = np.concatenate([np.tile(moves[0], count) for moves, _, _, _, count in runs])
+    y = np.concatenate([np.tile(moves[1], count) for moves, _, _, _, count in runs])
+    speed = np.concatenate([np.tile(moves[2], count) for moves, _, _, _, count in runs])
+    e = np.concatenate([np.tile(layer_extrusion(*moves, start, e_per_mm), count)
+                        for moves, start, _, e_per_mm, count in runs])
+
+    run_counts = np.array([run[4] for run in runs])
+    layer_body = np.repeat(np.cumsum(run_counts) - run_counts, run_counts)
+    layer_sizes = np.repeat([len(run[0][0]) for run in runs], run_counts)
+    layer_offsets = np.concatenate(([0], np.cumsum(layer_sizes)))
+    layer_height = np.repeat([run[2] for run in runs], run_counts).astype(float)
+    band = np.zeros(len(x), dtype=np.int8)
+    band[layer_offsets[BASE_LAYER_COUNT]:] = np.tile(test_area_move_bands(bands), layer_count)
+
+    # values rise band by band and layer by layer from start to finish
+    pa = settings.pressure_advance_settings
+    band_pa = np.full((len(layer_height), bands), np.nan)
+    band_pa[BASE_LAYER_COUNT:] = pa.start + (pa.finish - pa.start) * \
+        np.arange(layer_count * bands).reshape(layer_count, bands) / max(layer_count * bands - 1, 1)
+
+    return Toolpath(x, y, e, speed, speed != TRAVEL, layer_offsets, np.cumsum(layer_height), layer_height,
+                    band_pa[:, 0], derived.feedrates, BASE_LAYER_COUNT, layer_body, band, band_pa)
+
+
+def pa_map(toolpath, object_width):
+    # what photo analysis needs to turn a place on the tower into the value it was printed with: the z of every layer
+    # and the M572 value of every test layer and band as written
+    base = toolpath.base_layer_count
+    return {
+        'width': object_width,
+        'base_layer_count': base,
+        'bands': toolpath.bands,
+        'layer_z': [round(z, 4) for z in toolpath.layer_z.tolist()],
+        'band_pa': [[round(pa, 4) for pa in row] for row in toolpath.band_pa[base:].tolist()]
+    }
+
+
+def format_numbers(values):
+    # str(round(value, 4)) of every value, each distinct value is only formatted once
+    unique, inverse = np.unique(values, return_inverse=True)
+    text = np.array([str(round(value, 4)) for value in unique.tolist()], dtype=object)
+    return text[inverse.ravel()]
+
+
+def format_moves(toolpath, moves=slice(None)):
+    # one G1 line per move
+    x = format_numbers(toolpath.x[moves])
+    y = format_numbers(toolpath.y[moves])
+    e = format_numbers(toolpath.e[moves])
+    feedrate = np.array([f' F{feedrate * 60}\n' for feedrate in toolpath.feedrates], dtype=object)
+    feedrate = feedrate[toolpath.speed[moves]]
+    position = 'G1 X' + x + ' Y' + y
+    return np.where(toolpath.extrude[moves], position + ' E' + e + feedrate, position + feedrate)
+
+
+def format_band_runs(toolpath, layer):
+    # text of a layer's moves as (band, text) runs of consecutive moves in the same band
+    moves = toolpath.layer_slice(layer)
+    lines = format_moves(toolpath, moves).tolist()
+    band = toolpath.band[moves]
+    starts = np.flatnonzero(np.diff(band, prepend=-1))
+    ends = np.append(starts[1:], len(lines))
+    return [(int(band[first]), ''.join(lines[first:last])) for first, last in zip(starts, ends)]
+
+
+def stamp_band_runs(toolpath, runs, layer, tool_index):
+    # layer body with the pressure advance switched before every band after the first, which the header sets
+    text = [runs[0][1]]
+    for band, run in runs[1:]:
+        text.append(f'M572 D{tool_index} S{round(float(toolpath.band_pa[layer, band]), 4)}\n')
+        text.append(run)
+    return ''.join(text)
+
+
+def iter_layers(toolpath, tool_index, start=0, stop=None):
+    # full text of every layer, each distinct layer body is formatted once and stamped under the per layer
+    # header with the layer change and the pressure advance values
+    stop = toolpath.layer_count if stop is None else stop
+    bodies = {}
+    for layer in range(start, stop):
+        body = toolpath.layer_body[layer]
+        if body not in bodies:
+            bodies[body] = format_band_runs(toolpath, body)
+        header = f'\n; -> layer nr={layer + 1}\nG92 E0\nG1 Z{round(float(toolpath.layer_z[layer]), 4)} ' \
+                 f'F{LAYER_CHANGE_FEEDRATE}\n'
+        if layer >= toolpath.base_layer_count:
+            header += f'M572 D{tool_index} S{round(float(toolpath.layer_pa[layer]), 4)}\n'
+        yield header + stamp_band_runs(toolpath, bodies[body], layer, tool_index)
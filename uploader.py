@@ -0,0 +1,341 @@
+from urllib.parse import quote, urlsplit
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from gcode_generator import GCodeGenerator
+
+
+class HttpError(Exception):
+    def __init__(self, status, reason, body=b''):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        super().__init__(f'{status} {reason}')
+
+
+class Printer:
+    # kind is 'rrf' (RepRapFirmware web server), 'moonraker' or 'octoprint'
+    def __init__(self, name, url, kind='rrf', api_key=None, password=None, chunked=None):
+        self.name = name
+        self.url = url
+        self.kind = kind
+        self.api_key = api_key
+        self.password = password
+        # the rrf web server wants a content length, so its upload is sized with one extra generation pass
+        self.chunked = kind != 'rrf' if chunked is None else chunked
+        address = urlsplit(url)
+        self.host = address.hostname
+        self.port = address.port or 80
+
+    @staticmethod
+    def from_dict(values):
+        return Printer(**values)
+
+
+class HttpConnection:
+    # one keep-alive http/1.1 connection, request bodies are written as they are produced
+    def __init__(self, host, port, reader, writer):
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+        self.reusable = True
+
+    @staticmethod
+    async def open(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return HttpConnection(host, port, reader, writer)
+
+    async def request(self, method, path, headers=None, body=None, content_length=None):
+        # body is None, bytes or an iterable of bytes, without a content_length an iterable is sent chunked
+        headers = dict(headers or {})
+        headers['Host'] = f'{self.host}:{self.port}'
+        if isinstance(body, bytes):
+            headers['Content-Length'] = str(len(body))
+        elif body is not None and content_length is not None:
+            headers['Content-Length'] = str(content_length)
+        elif body is not None:
+            headers['Transfer-Encoding'] = 'chunked'
+        self.writer.write(f'{method} {path} HTTP/1.1\r\n'.encode() +
+                          ''.join(f'{key}: {value}\r\n' for key, value in headers.items()).encode() + b'\r\n')
+
+        if isinstance(body, bytes):
+            self.writer.write(body)
+        elif body is not None:
+            chunked = 'Transfer-Encoding' in headers
+            for data in body:
+                if not data:
+                    continue
+                self.writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+                await self.writer.drain()
+            if chunked:
+                self.writer.write(b'0\r\n\r\n')
+        await self.writer.drain()
+        self.requests += 1
+        return await self.read_response()
+
+    async def read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by printer')
+        version, status, *reason = status_line.decode('latin-1').split(' ', 2)
+        headers = await read_headers(self.reader)
+        body = await read_body(self.reader, headers)
+        self.reusable = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        status = int(status)
+        if status >= 400:
+            raise HttpError(status, ''.join(reason).strip(), body)
+        return status, headers, body
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    # idle connections per host, reused across requests, retries and uploads
+    def __init__(self):
+        self.idle = {}
+        self.opened = 0
+
+    async def acquire(self, host, port):
+        connections = self.idle.get((host, port), [])
+        while connections:
+            connection = connections.pop()
+            if not connection.reader.at_eof():
+                return connection
+            connection.close()
+        self.opened += 1
+        return await HttpConnection.open(host, port)
+
+    def release(self, connection, healthy=True):
+        if healthy and connection.reusable:
+            self.idle.setdefault((connection.host, connection.port), []).append(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle = {}
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        key, value = line.decode('latin-1').split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+
+
+async def read_body(reader, headers):
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await reader.readline()
+                return body
+            body += await reader.readexactly(size)
+            await reader.readline()
+    return await reader.readexactly(int(headers.get('content-length', 0)))
+
+
+def upload_request(printer, filename, chunk_source):
+    # path, headers and a factory for the encoded body parts of an upload to printer
+    def encoded():
+        return (chunk.encode() for chunk in chunk_source())
+
+    if printer.kind == 'rrf':
+        return f'/rr_upload?name={quote("0:/gcodes/" + filename)}', {}, encoded
+
+    boundary = uuid.uuid4().hex
+    fields = {'root': 'gcodes'} if printer.kind == 'moonraker' else {}
+    preamble = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                       for name, value in fields.items())
+    preamble += f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n' \
+                f'Content-Type: application/octet-stream\r\n\r\n'
+    epilogue = f'\r\n--{boundary}--\r\n'
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    if printer.api_key is not None:
+        headers['X-Api-Key'] = printer.api_key
+    path = '/server/files/upload' if printer.kind == 'moonraker' else '/api/files/local'
+
+    def multipart():
+        yield preamble.encode()
+        yield from encoded()
+        yield epilogue.encode()
+    return path, headers, multipart
+
+
+async def upload(printer, filename, chunk_source, pool, retries=3, retry_delay=0.5, timeout=60.0):
+    # uploads one file, retrying connection failures and server errors, returns the timing of the upload
+    result = {'name': printer.name, 'url': printer.url, 'ok': False, 'status': None, 'attempts': 0, 'bytes': 0,
+              'seconds': 0.0, 'error': None}
+    path, headers, body = upload_request(printer, filename, chunk_source)
+    content_length = None if printer.chunked else sum(len(data) for data in body())
+    start = time.perf_counter()
+
+    def counted(parts):
+        for data in parts:
+            result['bytes'] += len(data)
+            yield data
+
+    for attempt in range(retries + 1):
+        result['attempts'] = attempt + 1
+        connection = None
+        try:
+            connection = await asyncio.wait_for(pool.acquire(printer.host, printer.port), timeout)
+            if printer.kind == 'rrf' and printer.password is not None:
+                await asyncio.wait_for(connection.request('GET', f'/rr_connect?password={quote(printer.password)}'),
+                                       timeout)
+            result['bytes'] = 0
+            status, _, _ = await asyncio.wait_for(
+                connection.request('POST', path, headers, counted(body()), content_length), timeout)
+            pool.release(connection)
+            result.update({'ok': True, 'status': status, 'error': None})
+            break
+        except (HttpError, ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+            if connection is not None:
+                # an error response was read completely, the connection can serve the retry
+                pool.release(connection, healthy=isinstance(error, HttpError))
+            result['status'] = error.status if isinstance(error, HttpError) else None
+            result['error'] = f'{type(error).__name__}: {error}'
+            if isinstance(error, HttpError) and error.status < 500:
+                break
+            if attempt < retries:
+                await asyncio.sleep(retry_delay * 2 ** attempt)
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+async def upload_all(printers, filename, chunk_source, retries=3, timeout=60.0):
+    # pushes the same file to every printer at once, chunk_source returns a fresh chunk iterator per call
+    pool = ConnectionPool()
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(upload(printer, filename, chunk_source, pool, retries, timeout=timeout)
+                                         for printer in printers))
+    finally:
+        pool.close()
+    return {'uploads': results, 'failed': sum(not result['ok'] for result in results),
+            'connections': pool.opened, 'seconds': time.perf_counter() - start}
+
+
+def upload_settings(printers, settings, filename='pa_test.gcode', retries=3, timeout=60.0):
+    return asyncio.run(upload_all(printers, filename, lambda: GCodeGenerator.iter_chunks(settings), retries, timeout))
+
+
+class LocalUploadServer:
+    # stand-in for rrf, moonraker and octoprint upload endpoints on localhost, keeps the received files and can
+    # answer the first fail_requests uploads with 503 to exercise retries
+    def __init__(self, fail_requests=0):
+        self.fail_requests = fail_requests
+        self.files = {}
+        self.connections = 0
+        self.requests = []
+        self.clients = {}
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    async def close(self):
+        self.server.close()
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(*self.clients)
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = await read_headers(reader)
+                body = await read_body(reader, headers)
+                self.requests.append((method, target, headers))
+                status, response = self.respond(method, target, headers, body)
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(response)}\r\n\r\n'.encode() + response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.pop(asyncio.current_task(), None)
+            writer.close()
+
+    def respond(self, method, target, headers, body):
+        path = target.split('?', 1)[0]
+        if path == '/rr_connect':
+            return '200 OK', b'{"err":0}'
+        if method != 'POST' or path not in ('/rr_upload', '/server/files/upload', '/api/files/local'):
+            return '404 Not Found', b'{}'
+        if self.fail_requests > 0:
+            self.fail_requests -= 1
+            return '503 Service Unavailable', b'{}'
+
+        if path == '/rr_upload':
+            name = target.split('name=', 1)[1].split('&', 1)[0]
+            self.files[name] = body
+            return '200 OK', b'{"err":0}'
+        boundary = headers['content-type'].split('boundary=', 1)[1].encode()
+        for part in body.split(b'--' + boundary):
+            head, _, content = part.partition(b'\r\n\r\n')
+            if b'filename="' in head:
+                name = head.split(b'filename="', 1)[1].split(b'"', 1)[0].decode()
+                self.files[name] = content[:-2]
+        return '201 Created', b'{"done":true}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a pressure advance tower and upload it to printers')
+    parser.add_argument('printers', nargs='?', help='json list of {"name", "url", "kind", "api_key", "password"}')
+    parser.add_argument('--settings', default='settings.json', help='settings json file')
+    parser.add_argument('--filename', default='pa_test.gcode', help='file name on the printers')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--local', type=int, default=0, help='upload to this many local stand-in servers instead')
+    args = parser.parse_args()
+    if args.printers is None and not args.local:
+        parser.error('a printers file or --local is required')
+
+    with open(args.settings, 'r') as json_file:
+        tower_settings = json.load(json_file)
+
+    async def main():
+        if not args.local:
+            with open(args.printers, 'r') as printers_file:
+                printers = [Printer.from_dict(values) for values in json.load(printers_file)]
+            return await upload_all(printers, args.filename, lambda: GCodeGenerator.iter_chunks(tower_settings),
+                                    args.retries)
+        servers = [await LocalUploadServer(fail_requests=1).start() for _ in range(args.local)]
+        kinds = ('rrf', 'moonraker', 'octoprint')
+        printers = [Printer(f'local-{i}', server.url, kinds[i % len(kinds)]) for i, server in enumerate(servers)]
+        try:
+            return await upload_all(printers, args.filename, lambda: GCodeGenerator.iter_chunks(tower_settings),
+                                    args.retries)
+        finally:
+            for server in servers:
+                await server.close()
+
+    summary = asyncio.run(main())
+    print(json.dumps(summary, indent=4))
+    raise SystemExit(1 if summary['failed'] else 0)